@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+"""Throughput and latency benchmarks for the IPC and stats hot paths.
+
+Results are printed as one JSON object per line, so that runs can be
+compared over time:
+
+    python benchmarks/run_benchmarks.py [--quick] [--only ipc,latency,stats] [--output FILE]
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import zmq
+
+from spotmark import ipc, wire
+from spotmark.accumulator import Accumulator
+from spotmark.histogram import LatencyHistogram
+from spotmark.stats import ClusterStats
+
+ZMQ_URI = os.environ.get("SPOTMARK_BENCHMARK_ZMQ_URI", "tcp://127.0.0.1:10100")
+
+
+class BenchmarkEmitter(multiprocessing.Process):
+
+    def __init__(self, num_messages, message_factory):
+        super(BenchmarkEmitter, self).__init__()
+        self.num_messages = num_messages
+        self.message_factory = message_factory
+
+    def run(self):
+        emitter = ipc.ZMQEmitter(ZMQ_URI)
+        make_message = self.message_factory
+        for i in xrange(self.num_messages):
+            emitter.send(make_message())
+        emitter.push_socket.close(linger=-1)
+
+
+class BenchmarkReceiver(multiprocessing.Process):
+    """Receives expected_messages frames through an ipc.ZMQReceiver into
+    an Accumulator, as the client does, so that the IOLoop and zmqstream
+    overhead is measured along with decoding. Reports elapsed time from
+    the first frame and, for JSON frames carrying a "sent" time, the emit
+    to aggregate latency"""
+
+    def __init__(self, expected_messages, results):
+        super(BenchmarkReceiver, self).__init__()
+        self.expected_messages = expected_messages
+        self.results = results
+
+    def process_messages(self, frames):
+        if self.start is None:
+            self.start = time.time()
+        self.accumulator.process_messages(frames)
+        now = time.time()
+        for frame in frames:
+            if not wire.is_record(frame):
+                sent = json.loads(frame).get("sent")
+                if sent is not None:
+                    self.latencies.record(now - sent)
+        self.received += len(frames)
+        if self.received >= self.expected_messages:
+            self.receiver.io_loop.stop()
+
+    def run(self):
+        self.accumulator = Accumulator()
+        self.latencies = LatencyHistogram()
+        self.received, self.start = 0, None
+        self.receiver = ipc.ZMQReceiver(self.process_messages, ZMQ_URI)
+        self.results.put("ready")
+        self.receiver.begin_receiving()
+
+        elapsed = time.time() - self.start
+        self.receiver.pull_socket.close(linger=0)
+        self.results.put({
+            "elapsed_secs": elapsed,
+            "success_count": self.accumulator.success_count,
+            "latency_p50_secs": self.latencies.percentile(50),
+            "latency_p99_secs": self.latencies.percentile(99),
+        })
+
+
+def run_fan_in(num_emitters, messages_per_emitter, message_factory):
+    results = multiprocessing.Queue()
+    receiver = BenchmarkReceiver(num_emitters * messages_per_emitter, results)
+    receiver.start()
+    results.get(timeout=10)
+
+    emitters = [BenchmarkEmitter(messages_per_emitter, message_factory) for i in range(num_emitters)]
+    for emitter in emitters:
+        emitter.start()
+    result = results.get(timeout=600)
+    for process in emitters + [receiver]:
+        process.join()
+    return result
+
+
+def binary_message(num_latencies):
+    latencies = [0.01] * num_latencies
+    return lambda: wire.pack_record(1, 0, latencies)
+
+def json_message(num_latencies):
+    latencies = [0.01] * num_latencies
+    return lambda: json.dumps({"success_count": 1, "latencies": latencies})
+
+def timestamped_message():
+    return json.dumps({"sent": time.time(), "success_count": 1})
+
+
+def benchmark_ipc(quick):
+    """Fan-in throughput by emitter count, encoding and message size"""
+
+    messages_per_emitter = 2000 if quick else 20000
+    for num_emitters in ([1, 4] if quick else [1, 4, 16]):
+        for encoding, factory in [("binary", binary_message), ("json", json_message)]:
+            for num_latencies in [0, 10, 100]:
+                result = run_fan_in(num_emitters, messages_per_emitter, factory(num_latencies))
+                total = num_emitters * messages_per_emitter
+                yield {
+                    "benchmark": "ipc_fan_in",
+                    "emitters": num_emitters,
+                    "encoding": encoding,
+                    "latencies_per_message": num_latencies,
+                    "messages": total,
+                    "messages_per_sec": total / result["elapsed_secs"],
+                    "lost": total - result["success_count"],
+                }
+
+
+def benchmark_latency(quick):
+    """Time from a message being emitted to it being aggregated"""
+
+    for num_emitters in ([1, 4] if quick else [1, 4, 16]):
+        result = run_fan_in(num_emitters, 1000 if quick else 10000, timestamped_message)
+        yield {
+            "benchmark": "emit_to_aggregate_latency",
+            "emitters": num_emitters,
+            "p50_secs": result["latency_p50_secs"],
+            "p99_secs": result["latency_p99_secs"],
+        }
+
+
+def time_calls(func, repeat):
+    start = time.time()
+    for i in xrange(repeat):
+        func()
+    return (time.time() - start) / repeat
+
+
+def benchmark_stats(quick):
+    """ClusterStats update and query cost by fleet size and run length"""
+
+    interval_secs = 10
+    run_hours = [1] if quick else [1, 8]
+    instance_counts = [10, 100] if quick else [10, 100, 1000]
+    for hours in run_hours:
+        for num_instances in instance_counts:
+            stats = ClusterStats()
+            num_intervals = hours * 3600 / interval_secs
+
+            start = time.time()
+            for i in xrange(num_intervals):
+                end_time = (i + 1) * interval_secs
+                for instance_id in xrange(num_instances):
+                    stats.update(instance_id, 95, 5, end_time - interval_secs, end_time)
+            update_secs = (time.time() - start) / (num_intervals * num_instances)
+
+            now = num_intervals * interval_secs
+            repeat = 20 if num_instances < 1000 else 5
+            yield {
+                "benchmark": "cluster_stats",
+                "instances": num_instances,
+                "run_hours": hours,
+                "update_secs": update_secs,
+                "request_count_60s_secs": time_calls(lambda: stats.request_count(now - 60, now), repeat),
+                "success_rate_60s_secs": time_calls(lambda: stats.success_rate(now - 60, now), repeat),
+                "instance_count_60s_secs": time_calls(lambda: stats.instance_count(now - 60, now), repeat),
+                "request_count_full_run_secs": time_calls(lambda: stats.request_count(0, now), repeat),
+                "window_request_count_secs": time_calls(lambda: stats.window(60).request_count(now), 1000),
+                "window_success_rate_secs": time_calls(lambda: stats.window(60).success_rate(now), 1000),
+            }
+
+
+BENCHMARKS = {
+    "ipc": benchmark_ipc,
+    "latency": benchmark_latency,
+    "stats": benchmark_stats,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--quick", action="store_true", help="Smaller runs, for a smoke test")
+    parser.add_argument("--only", default=",".join(sorted(BENCHMARKS)), help="Comma-separated benchmarks to run")
+    parser.add_argument("--output", help="Append results to this file as well as printing them")
+    args = parser.parse_args()
+
+    output = open(args.output, "a") if args.output else None
+    environment = {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpus": multiprocessing.cpu_count(),
+        "zmq": zmq.zmq_version(),
+        "time": time.time(),
+    }
+    for name in args.only.split(","):
+        for result in BENCHMARKS[name](args.quick):
+            result.update(environment)
+            line = json.dumps(result, sort_keys=True)
+            print line
+            if output:
+                output.write(line + "\n")
+                output.flush()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,42 +1,352 @@
+import base64
 import json
+import math
+import Queue
+import threading
 import time
-
-import boto
+import zlib
 
 from constants import INSTANCE_ID, SQS_QUEUE_NAME
+from histogram import LatencyHistogram
+from tags import DEFAULT_MAX_TAGS, TaggedTotals
+from transport import SQSTransport
+import wire
+
+# SQS limits on a single message and on a SendMessageBatch request
+MAX_SQS_MESSAGE_BYTES = 256 * 1024
+MAX_SQS_BATCH_ENTRIES = 10
+
+def decode_body(body):
+    """Returns the list of {"instance_id": ..., "content": ...} messages
+    carried by a raw SQS message body. This is either a single JSON
+    message, base64-encoded by boto's default Message class, or a
+    base64-encoded, zlib-compressed JSON list of messages"""
+
+    if not body.startswith("{"):
+        body = base64.b64decode(body)
+        if not body.startswith("{"):
+            body = zlib.decompress(body)
+    messages = json.loads(body)
+    if isinstance(messages, dict):
+        return [messages]
+    return messages
+
+class BackgroundWriter(object):
+    """Runs SQS writes on a worker thread, so that a slow SQS round trip
+    doesn't block the IOLoop that's reading from ZMQ.
+
+    Writes are queued up to max_backlog; beyond that they're refused and
+    counted in dropped_count rather than blocking the caller, which can
+    keep what it was writing and try again later"""
+
+    def __init__(self, max_backlog=100):
+        self.jobs = Queue.Queue(max_backlog)
+        self.flush_count, self.error_count, self.dropped_count = 0, 0, 0
+        self.last_flush_secs, self.max_flush_secs, self.total_flush_secs = None, 0.0, 0.0
+
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    @property
+    def backlog(self):
+        return self.jobs.qsize()
+
+    def submit(self, func, *args):
+        """Queues func(*args) to run on the worker thread, returning False if
+        it was dropped because the backlog is full"""
+
+        try:
+            self.jobs.put_nowait((func, args))
+        except Queue.Full:
+            self.dropped_count += 1
+            return False
+        return True
+
+    def join(self):
+        """Waits until all queued writes have completed"""
+
+        self.jobs.join()
+
+    def _run(self):
+        while 1:
+            func, args = self.jobs.get()
+            start = time.time()
+            try:
+                func(*args)
+            except Exception as e:
+                self.error_count += 1
+                print "SQS write failed:", e
+            finally:
+                duration = time.time() - start
+                self.flush_count += 1
+                self.last_flush_secs = duration
+                self.max_flush_secs = max(self.max_flush_secs, duration)
+                self.total_flush_secs += duration
+                self.jobs.task_done()
+
+    def metrics(self):
+        mean = self.total_flush_secs / self.flush_count if self.flush_count else None
+        return {
+            "backlog": self.backlog,
+            "flush_count": self.flush_count,
+            "error_count": self.error_count,
+            "dropped_count": self.dropped_count,
+            "last_flush_secs": self.last_flush_secs,
+            "mean_flush_secs": mean,
+            "max_flush_secs": self.max_flush_secs
+        }
+
+
+class Accumulator(object):
+    """Accumulates success and fail counts, a histogram of request
+    latencies and counts of each kind of failure from ZMQ messages, and
+    the same counts and latencies per tag set for tagged results"""
 
-class SQSAccumulator(object):
-    """Accumulates success and fail counts and periodically
-    enqeues an update to SQS"""
+    def __init__(self, max_tags=DEFAULT_MAX_TAGS):
+        self.success_count, self.failure_count = 0, 0
+        self.latency_histogram = LatencyHistogram()
+        self.failure_kinds = {}
+        self.tagged = TaggedTotals(max_tags)
+
+    def totals(self):
+        """Returns the accumulated totals, in the same form as the messages
+        sent by an AggregatingEmitter"""
+
+        totals = {
+            "success_count": self.success_count,
+            "failure_count": self.failure_count,
+            "latency_histogram": self.latency_histogram.to_dict(),
+            "failure_kinds": self.failure_kinds
+        }
+        if self.tagged:
+            totals["tags"] = self.tagged.to_dict()
+        return totals
 
-    def __init__(self, queue_name=SQS_QUEUE_NAME):
-        sqs = boto.connect_sqs()
-        self.queue = sqs.get_queue(queue_name)
+    def reset(self):
         self.success_count, self.failure_count = 0, 0
+        self.latency_histogram.reset()
+        self.failure_kinds = {}
+        self.tagged.reset()
+
+    def process_messages(self, messages):
+        """Adds the counts and latencies from a batch of ZMQ frames, which
+        are binary records (see wire.py) or JSON messages"""
+
+        records = [msg for msg in messages if wire.is_record(msg)]
+        if records:
+            batch = wire.unpack_records(records)
+            self.success_count += batch.success_count
+            self.failure_count += batch.failure_count
+            self.latency_histogram.record_many(batch.latencies)
+            for tag, counts in batch.tag_counts.iteritems():
+                self.tagged.add(tag, counts[0], counts[1], batch.tag_latencies.get(tag, ()))
+            if len(records) == len(messages):
+                return
+            messages = [msg for msg in messages if not wire.is_record(msg)]
+
+        messages = [json.loads(msg) for msg in messages]
+        self.success_count += sum(msg.get("success_count", 0) for msg in messages)
+        self.failure_count += sum(msg.get("failure_count", 0) for msg in messages)
+
+        # Messages from an AggregatingEmitter carry a histogram and a
+        # count of each kind of failure rather than raw latencies
+        failure_kinds = self.failure_kinds
+        for msg in messages:
+            if "latencies" in msg:
+                self.latency_histogram.record_many(msg["latencies"])
+            if "latency_histogram" in msg:
+                self.latency_histogram.merge(LatencyHistogram.from_dict(msg["latency_histogram"]))
+            for kind, count in msg.get("failure_kinds", {}).iteritems():
+                failure_kinds[kind] = failure_kinds.get(kind, 0) + count
+            if "tags" in msg:
+                self.tagged.merge_dict(msg["tags"])
+
+
+
+class SQSAccumulator(Accumulator):
+    """Accumulates success and fail counts, and a histogram of
+    request latencies, and periodically enqeues an update to SQS,
+    or to another Transport if one is given"""
+
+    def __init__(self, queue_name=SQS_QUEUE_NAME, writer=None, transport=None):
+        super(SQSAccumulator, self).__init__()
+        if transport is None:
+            transport = SQSTransport(queue_name)
+        self.transport = transport
+        # Optional BackgroundWriter to publish from
+        self.writer = writer
         self.last_sqs_time = None
+        # Updates are stamped with the reference clock, clock_offset_secs
+        # ahead of the local one. If bucket_secs is set, update times are
+        # rounded down to a multiple of it, for updates sent on aligned
+        # boundaries, so that intervals line up across instances
+        self.clock_offset_secs = 0.0
+        self.bucket_secs = None
 
-    def enqueue(self, message):
-        _message = {
+    @property
+    def queue(self):
+        return self.transport.queue
+
+    def wrap(self, message):
+        return {
             "instance_id": INSTANCE_ID,
             "content": message
-        }    
-        sqs_message = self.queue.new_message(body=json.dumps(_message))
-        self.queue.write(sqs_message)
+        }
+
+    def write(self, func, *args):
+        """Calls func(*args) to publish, on the writer's thread if there
+        is one. Returns False if the writer's backlog is full"""
+
+        if self.writer is None:
+            func(*args)
+            return True
+        return self.writer.submit(func, *args)
+
+    def enqueue(self, message):
+        """Publishes a message, returning False if it was refused because
+        the writer's backlog is full"""
+
+        return self.write(self.transport.send, json.dumps(self.wrap(message)))
+
+    def close(self):
+        """Waits for queued writes to be published, eg. before exiting"""
+
+        if self.writer is not None:
+            self.writer.join()
 
     def enqueue_update(self):
-        now = int(time.time())
+        # Fractional, so that updates can be sent more than once a second
+        now = time.time() + self.clock_offset_secs
+        if self.bucket_secs:
+            # Allow for the timer firing a little early
+            now = math.floor(now / self.bucket_secs + 0.01) * self.bucket_secs
+            if now == self.last_sqs_time:
+                # Still in the same bucket; carry the totals into the next
+                return
 
-        self.enqueue({
-            "success_count": self.success_count,
-            "failure_count": self.failure_count,
+        update = self.totals()
+        update.update({
             "interval_start": self.last_sqs_time,
             "interval_end": now
         })
-        self.success_count, self.failure_count = 0, 0
+        if self.writer is not None:
+            update["writer"] = self.writer.metrics()
+
+        if not self.enqueue(update):
+            # Keep the totals, so that the next update covers this
+            # interval too rather than losing it
+            return
+        self.reset()
         self.last_sqs_time = now
 
-    def process_messages(self, messages):
-        messages = [json.loads(msg) for msg in messages]
-        self.success_count += sum(msg.get("success_count", 0) for msg in messages)
-        self.failure_count += sum(msg.get("failure_count", 0) for msg in messages)
 
+class BatchingSQSAccumulator(SQSAccumulator):
+    """SQSAccumulator that holds enqueued messages back and publishes them
+    together, packed into compressed entries of a SendMessageBatch call.
+
+    Pending messages are flushed once there are flush_size of them or the
+    oldest has waited max_latency_secs; the flush is checked whenever a
+    message is enqueued or an update is due, ie. at least every update
+    interval. Call close() before exiting to publish what's left.
+
+    A message too big to fit in an SQS message even once compressed is
+    dropped and counted in oversized_count"""
+
+    def __init__(self, queue_name=SQS_QUEUE_NAME, writer=None, flush_size=10, max_latency_secs=30,
+                 transport=None):
+        super(BatchingSQSAccumulator, self).__init__(queue_name, writer, transport)
+        self.flush_size = flush_size
+        self.max_latency_secs = max_latency_secs
+        self.pending = []
+        self.oldest_pending_time = None
+        self.oversized_count = 0
+        # Encoded batches the writer had no room for, oldest first
+        self.unsent = []
+
+    def enqueue(self, message):
+        if not self.pending:
+            self.oldest_pending_time = time.time()
+        self.pending.append(json.dumps(self.wrap(message), separators=(",", ":")))
+        self.flush_if_due()
+        return True
+
+    def enqueue_update(self):
+        super(BatchingSQSAccumulator, self).enqueue_update()
+        # An update within the same bucket enqueues nothing
+        self.flush_if_due()
+
+    def flush_if_due(self):
+        if self.unsent or (self.pending and (len(self.pending) >= self.flush_size or
+                time.time() - self.oldest_pending_time >= self.max_latency_secs)):
+            self.flush()
+
+    def close(self):
+        self.flush()
+        while self.unsent:
+            super(BatchingSQSAccumulator, self).close()
+            self.flush()
+        super(BatchingSQSAccumulator, self).close()
+
+    def encode(self, serialized_messages):
+        """Returns the raw SQS body for a list of JSON-serialized messages"""
+
+        payload = "[%s]" % ",".join(serialized_messages)
+        return base64.b64encode(zlib.compress(payload))
+
+    def pack(self, serialized_messages):
+        """Yields lists of encoded bodies, each of which fits in a single
+        SendMessageBatch request"""
+
+        # Encoding is base64, and zlib doesn't grow the payload by more
+        # than a few bytes, so limiting the uncompressed size keeps each
+        # entry within the SQS limit without having to compress twice
+        max_payload_bytes = MAX_SQS_MESSAGE_BYTES * 3 / 4 - 1024
+
+        entries, chunk, chunk_bytes = [], [], 0
+        for serialized in serialized_messages:
+            if len(serialized) > max_payload_bytes:
+                # Too big to share an entry, but it may compress enough
+                # to fit in one of its own
+                if chunk:
+                    entries.append(self.encode(chunk))
+                    chunk, chunk_bytes = [], 0
+                body = self.encode([serialized])
+                if len(body) > MAX_SQS_MESSAGE_BYTES:
+                    self.oversized_count += 1
+                    print "Dropped message too large for SQS: %s bytes" % len(serialized)
+                else:
+                    entries.append(body)
+                continue
+            if chunk and chunk_bytes + len(serialized) > max_payload_bytes:
+                entries.append(self.encode(chunk))
+                chunk, chunk_bytes = [], 0
+            chunk.append(serialized)
+            chunk_bytes += len(serialized) + 1
+        if chunk:
+            entries.append(self.encode(chunk))
+
+        batch, batch_bytes = [], 0
+        for body in entries:
+            if batch and (len(batch) == MAX_SQS_BATCH_ENTRIES or
+                    batch_bytes + len(body) > MAX_SQS_MESSAGE_BYTES):
+                yield batch
+                batch, batch_bytes = [], 0
+            batch.append(body)
+            batch_bytes += len(body)
+        if batch:
+            yield batch
+
+    def flush(self):
+        """Publishes all pending messages. Returns False if the writer's
+        backlog filled up, in which case what's left is kept in unsent
+        and published by the next flush"""
+
+        pending, self.pending = self.pending, []
+        self.oldest_pending_time = None
+        self.unsent.extend(self.pack(pending))
+        while self.unsent:
+            if not self.write(self.transport.send_batch, self.unsent[0]):
+                return False
+            self.unsent.pop(0)
+        return True
@@ -0,0 +1,112 @@
+"""An optional aggregation tier between clients and SQS, for fleets large
+enough that every client writing to SQS would flood the queue.
+
+Clients with an aggregator_uri push their messages over ZMQ, with a
+ZMQTransport, to one of a few Aggregator nodes. Each Aggregator
+merges what it receives and publishes it to SQS in compressed batches,
+so SQS traffic grows with the number of aggregators rather than the
+number of instances"""
+
+from collections import OrderedDict
+import json
+import multiprocessing
+import signal
+import sys
+
+from accumulator import BackgroundWriter, BatchingSQSAccumulator, decode_body
+from constants import AGGREGATOR_BIND_URI, SQS_QUEUE_NAME
+from histogram import LatencyHistogram
+from ipc import ZMQPeriodicReceiver
+from tags import TaggedTotals
+
+def merge_updates(first, second):
+    """Returns the update covering two consecutive updates from the same
+    instance, as sent by SQSAccumulator.enqueue_update"""
+
+    histogram = LatencyHistogram.from_dict(first["latency_histogram"])
+    histogram.merge(LatencyHistogram.from_dict(second["latency_histogram"]))
+    failure_kinds = dict(first.get("failure_kinds", {}))
+    for kind, count in second.get("failure_kinds", {}).iteritems():
+        failure_kinds[kind] = failure_kinds.get(kind, 0) + count
+    tagged = TaggedTotals()
+    tagged.merge_dict(first.get("tags", {}))
+    tagged.merge_dict(second.get("tags", {}))
+
+    merged = dict(second)
+    merged.update({
+        "success_count": first["success_count"] + second["success_count"],
+        "failure_count": first["failure_count"] + second["failure_count"],
+        "latency_histogram": histogram.to_dict(),
+        "failure_kinds": failure_kinds,
+        "interval_start": first["interval_start"]
+    })
+    if tagged:
+        merged["tags"] = tagged.to_dict()
+    return merged
+
+
+class Aggregator(multiprocessing.Process):
+    """Receives the messages that clients push to zmq_uri and publishes
+    them to SQS every flush_interval_secs.
+
+    Consecutive updates from the same instance are merged into one, and
+    everything pending is published as compressed SendMessageBatch
+    entries, which the SQSConsumer decodes like any other batch"""
+
+    def __init__(self, zmq_uri=AGGREGATOR_BIND_URI, queue_name=SQS_QUEUE_NAME, flush_interval_secs=10,
+                 max_publish_backlog=100):
+        super(Aggregator, self).__init__()
+        self.daemon = True
+        self.zmq_uri = zmq_uri
+        self.queue_name = queue_name
+        self.flush_interval_secs = flush_interval_secs
+        self.max_publish_backlog = max_publish_backlog
+
+        # instance_id -> contents waiting to be published, oldest first
+        self.pending = OrderedDict()
+        self.received_count, self.published_count = 0, 0
+        self.publisher = None
+
+    def handle_messages(self, frames):
+        for frame in frames:
+            for message in decode_body(frame):
+                contents = self.pending.setdefault(message["instance_id"], [])
+                content = message["content"]
+                self.received_count += 1
+
+                previous = contents[-1] if contents else None
+                if (previous is not None and "success_count" in content and "success_count" in previous
+                        and previous["interval_end"] == content["interval_start"]):
+                    contents[-1] = merge_updates(previous, content)
+                else:
+                    contents.append(content)
+
+    def flush(self):
+        """Publishes everything received since the last flush"""
+
+        pending, self.pending = self.pending, OrderedDict()
+        for instance_id, contents in pending.iteritems():
+            for content in contents:
+                message = {"instance_id": instance_id, "content": content}
+                self.publisher.pending.append(json.dumps(message, separators=(",", ":")))
+                self.published_count += 1
+        self.publisher.flush()
+
+    def run(self):
+        # Sockets have to be created after forking
+        writer = None
+        if self.max_publish_backlog:
+            writer = BackgroundWriter(self.max_publish_backlog)
+        self.publisher = BatchingSQSAccumulator(self.queue_name, writer)
+        receiver = ZMQPeriodicReceiver(
+            self.handle_messages,
+            self.flush,
+            self.flush_interval_secs * 1000,
+            self.zmq_uri
+        )
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        try:
+            receiver.begin_receiving()
+        finally:
+            self.flush()
+            self.publisher.close()
@@ -1,8 +1,31 @@
 #!/usr/bin/env python
 
+import signal
+import sys
+import time
+
 import accumulator
+import aggregator
+import clock
 import ipc
 import constants
+import transport
+
+def read_boot_marks(path=constants.BOOT_TIMES_PATH):
+    """Returns the {mark: timestamp} boot phase marks written by the
+    startup script, or an empty dict if there aren't any"""
+
+    marks = {}
+    try:
+        boot_times = open(path)
+    except IOError:
+        return marks
+    with boot_times:
+        for line in boot_times:
+            parts = line.split()
+            if len(parts) == 2:
+                marks[parts[0]] = float(parts[1])
+    return marks
 
 class Client(object):
     """Implements client functionality for Spotmark
@@ -10,21 +33,99 @@ class Client(object):
     Listens to ZMQ event stream and periodically pushes
     totals to SQS"""
 
-    def __init__(self, sqs_update_frequency_secs):
+    def __init__(self, sqs_update_frequency_secs, publish_batch_size=None, max_publish_backlog=100,
+                 num_shards=constants.ZMQ_SHARDS, aggregator_uri=constants.AGGREGATOR_URI,
+                 run_aggregator=constants.RUN_AGGREGATOR, controller_uri=constants.CONTROLLER_URI,
+                 align_updates=True):
         self.sqs_update_frequency_secs = sqs_update_frequency_secs
+        # If set, updates are published in compressed batches of this size
+        self.publish_batch_size = publish_batch_size
+        # Publishing happens on a background thread so that it doesn't hold
+        # up reading from ZMQ; set to None to publish inline
+        self.max_publish_backlog = max_publish_backlog
+        # If set, this many ShardWorker processes decode messages from
+        # emitters and forward partial totals to the main receiver
+        self.num_shards = num_shards
+        # If set, updates go to the Aggregator at this endpoint instead of SQS
+        self.aggregator_uri = aggregator_uri
+        # Whether to run an Aggregator for other clients on this node
+        self.run_aggregator = run_aggregator
+        # If set, updates are pushed straight to the controller's ZMQConsumer
+        # at this endpoint. Either way, SQS is the fallback
+        self.controller_uri = controller_uri
+        # Send updates on boundaries of the update interval on the NTP
+        # clock, so that every instance's intervals cover the same periods
+        self.align_updates = align_updates
+        self.accumulator = None
+        self.first_request_time = None
+
+    def process_messages(self, messages):
+        """Accumulates messages, reporting the time of the first successful
+        request as the end of the boot"""
+
+        self.accumulator.process_messages(messages)
+        if self.first_request_time is None and self.accumulator.success_count:
+            self.first_request_time = time.time()
+            self.enqueue_boot_report({"first_request": self.first_request_time})
+
+    def enqueue_boot_report(self, marks):
+        """Reports boot marks taken on the local clock, moved onto the
+        reference clock that updates are stamped with"""
+
+        offset = self.accumulator.clock_offset_secs
+        self.accumulator.enqueue({"boot_report": dict(
+            (mark, timestamp + offset) for mark, timestamp in marks.iteritems()
+        )})
 
     def start(self):
 
-        sqs_accumulator = accumulator.SQSAccumulator()
+        # Start shards before anything here creates a ZMQ context,
+        # which can't be used across a fork
+        for shard in range(self.num_shards or 0):
+            ipc.ShardWorker(shard, constants.ZMQ_URI).start()
+        if self.run_aggregator:
+            aggregator.Aggregator(flush_interval_secs=self.sqs_update_frequency_secs).start()
+
+        writer = None
+        if self.max_publish_backlog:
+            writer = accumulator.BackgroundWriter(self.max_publish_backlog)
+
+        update_transport = None
+        push_uri = self.aggregator_uri or self.controller_uri
+        if push_uri:
+            update_transport = transport.ZMQTransport(push_uri, fallback=transport.SQSTransport())
+
+        if self.publish_batch_size:
+            sqs_accumulator = accumulator.BatchingSQSAccumulator(
+                writer=writer, flush_size=self.publish_batch_size, transport=update_transport
+            )
+        else:
+            sqs_accumulator = accumulator.SQSAccumulator(writer=writer, transport=update_transport)
+        self.accumulator = sqs_accumulator
+        if self.align_updates:
+            sqs_accumulator.clock_offset_secs = clock.measure_clock_offset()
+            sqs_accumulator.bucket_secs = self.sqs_update_frequency_secs
         streamer = ipc.ZMQPeriodicReceiver(
-            sqs_accumulator.process_messages, 
+            self.process_messages,
             sqs_accumulator.enqueue_update,
             self.sqs_update_frequency_secs * 1000,
-            constants.ZMQ_URI
+            constants.ZMQ_URI,
+            align=self.align_updates,
+            clock_offset_secs=sqs_accumulator.clock_offset_secs
         )
 
+        boot_marks = read_boot_marks()
+        boot_marks["client_start"] = time.time()
         sqs_accumulator.enqueue({"status": "running"})
-        streamer.begin_receiving()
+        self.enqueue_boot_report(boot_marks)
+
+        # Exit through the finally block on termination, so that anything
+        # held back for batching is published
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        try:
+            streamer.begin_receiving()
+        finally:
+            sqs_accumulator.close()
 
 if __name__ == '__main__':
     client = Client(10)
@@ -0,0 +1,57 @@
+"""Measures how far the local clock is from a reference NTP server, so
+that instances can stamp and align their updates on a common clock"""
+
+import os
+import socket
+import struct
+import time
+
+from constants import NTP_SERVER
+
+# Seconds between the NTP epoch (1900) and the Unix epoch
+NTP_EPOCH_OFFSET = 2208988800
+
+def _ntp_time(seconds, fraction):
+    return seconds - NTP_EPOCH_OFFSET + fraction / 2.0 ** 32
+
+def ntp_offset(server=NTP_SERVER, port=123, timeout_secs=1.0):
+    """Makes one SNTP request and returns (offset, round trip) in seconds,
+    where offset is what needs adding to time.time() to get the server's
+    time"""
+
+    request = "\x1b" + 47 * "\0"
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.settimeout(timeout_secs)
+    try:
+        sent = time.time()
+        sock.sendto(request, (server, port))
+        response = sock.recv(48)
+        received = time.time()
+    finally:
+        sock.close()
+
+    assert len(response) >= 48, "Short NTP response from %s" % server
+    server_received = _ntp_time(*struct.unpack("!II", response[32:40]))
+    server_sent = _ntp_time(*struct.unpack("!II", response[40:48]))
+    offset = ((server_received - sent) + (server_sent - received)) / 2
+    round_trip = (received - sent) - (server_sent - server_received)
+    return offset, round_trip
+
+def measure_clock_offset(server=NTP_SERVER, samples=4, **kwargs):
+    """Returns the offset from the sample with the shortest round trip, or
+    0 if the server can't be reached. Outside AWS the local clock is
+    trusted as is"""
+
+    if os.environ.get("SPOTMARK_ENVIRONMENT") != "AWS" and server == NTP_SERVER:
+        return 0.0
+
+    measured = []
+    for i in range(samples):
+        try:
+            measured.append(ntp_offset(server, **kwargs))
+        except (socket.error, AssertionError) as e:
+            print "Clock offset measurement failed:", e
+    if not measured:
+        return 0.0
+    offset, round_trip = min(measured, key=lambda sample: sample[1])
+    return offset
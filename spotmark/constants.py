@@ -15,3 +15,18 @@ INSTANCE_ID = get_metadata("http://169.254.169.254/latest/meta-data/instance-id"
 
 SQS_QUEUE_NAME = os.environ.get("SPOTMARK_SQS_QUEUE_NAME", "spotmark")
 ZMQ_URI = os.environ.get("SPOTMARK_ZMQ_URI", "tcp://0.0.0.0:10000")
+# Number of receiver shards; emitters should connect to ipc.emitter_uri(ZMQ_URI, ZMQ_SHARDS)
+ZMQ_SHARDS = int(os.environ.get("SPOTMARK_ZMQ_SHARDS", 0))
+# Where the startup script writes boot phase timestamps
+BOOT_TIMES_PATH = os.environ.get("SPOTMARK_BOOT_TIMES", "/var/log/spotmark-boot-times")
+# Set on clients that report through an aggregator node rather than to SQS
+AGGREGATOR_URI = os.environ.get("SPOTMARK_AGGREGATOR_URI")
+# Where aggregator nodes listen, and whether this node is one
+AGGREGATOR_BIND_URI = os.environ.get("SPOTMARK_AGGREGATOR_BIND_URI", "tcp://0.0.0.0:10200")
+RUN_AGGREGATOR = os.environ.get("SPOTMARK_RUN_AGGREGATOR") == "1"
+# Set on clients that push updates straight to the controller over ZMQ
+CONTROLLER_URI = os.environ.get("SPOTMARK_CONTROLLER_URI")
+# Where the controller's ZMQConsumer listens
+CONTROLLER_BIND_URI = os.environ.get("SPOTMARK_CONTROLLER_BIND_URI", "tcp://0.0.0.0:10300")
+# SNTP server for measuring clock offset; the default is Amazon Time Sync
+NTP_SERVER = os.environ.get("SPOTMARK_NTP_SERVER", "169.254.169.123")
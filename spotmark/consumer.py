@@ -0,0 +1,220 @@
+from collections import OrderedDict
+import Queue
+import threading
+
+import boto
+from boto.sqs.message import RawMessage
+import zmq
+
+from accumulator import decode_body
+from constants import CONTROLLER_BIND_URI, SQS_QUEUE_NAME
+from histogram import LatencyHistogram
+
+class SQSConsumer(object):
+    """Reads the messages clients publish to SQS and feeds them into
+    ClusterStats.
+
+    num_receivers threads long-poll the queue, each receiving and deleting
+    up to 10 messages per request. Messages SQS delivers more than once are
+    skipped. Updates are queued and applied to ClusterStats by
+    apply_updates, which should be called from the control loop's thread"""
+
+    def __init__(self, cluster_stats, queue_name=SQS_QUEUE_NAME, num_receivers=4,
+                 wait_time_secs=20, max_remembered=100000):
+        self.cluster_stats = cluster_stats
+        self.queue_name = queue_name
+        self.num_receivers = num_receivers
+        self.wait_time_secs = wait_time_secs
+
+        # Most recent non-update message (eg. {"status": "running"}) per instance
+        self.statuses = {}
+        self.updates = Queue.Queue()
+        # (tag key, update) for the per-tag ClusterStats
+        self.tag_updates = Queue.Queue()
+        # (instance_id, boot marks) for ClusterStats.update_boot_report
+        self.boot_reports = Queue.Queue()
+        self.threads = []
+        self._stopped = threading.Event()
+
+        # Keys of recently seen messages, oldest first
+        self._seen = OrderedDict()
+        self._seen_lock = threading.Lock()
+        self.max_remembered = max_remembered
+        self.duplicate_count = 0
+
+    def connect(self):
+        """Returns a new connection to the queue. boto connections
+        shouldn't be shared between threads"""
+
+        queue = boto.connect_sqs().get_queue(self.queue_name)
+        queue.set_message_class(RawMessage)
+        return queue
+
+    def _first_seen(self, key):
+        with self._seen_lock:
+            if key in self._seen:
+                self.duplicate_count += 1
+                return False
+            self._seen[key] = True
+            if len(self._seen) > self.max_remembered:
+                self._seen.popitem(last=False)
+            return True
+
+    def handle_messages(self, messages):
+        """Decodes SQS messages, queueing updates and recording statuses"""
+
+        for sqs_message in messages:
+            if self._first_seen(sqs_message.id):
+                self.handle_body(sqs_message.get_body())
+
+    def handle_body(self, body):
+        """Handles one message body, as sent by any Transport"""
+
+        for message in decode_body(body):
+            instance_id, content = message["instance_id"], message["content"]
+            if "boot_report" in content:
+                self.boot_reports.put((instance_id, content["boot_report"]))
+                continue
+            if "success_count" not in content:
+                self.statuses[instance_id] = content
+                continue
+
+            # A client's first update has no start time
+            end_time = content["interval_end"]
+            start_time = content["interval_start"]
+            if start_time is None:
+                start_time = end_time
+
+            # Redelivered updates can also arrive in a new message if the
+            # client had to republish, or over a fallback transport
+            if not self._first_seen((instance_id, start_time, end_time)):
+                continue
+
+            histogram = content.get("latency_histogram")
+            if histogram is not None:
+                histogram = LatencyHistogram.from_dict(histogram)
+            self.updates.put((
+                instance_id, content["success_count"], content["failure_count"],
+                start_time, end_time, histogram
+            ))
+            for key, totals in content.get("tags", {}).iteritems():
+                histogram = totals.get("latency_histogram")
+                if histogram is not None:
+                    histogram = LatencyHistogram.from_dict(histogram)
+                self.tag_updates.put((key, (
+                    instance_id, totals["success_count"], totals["failure_count"],
+                    start_time, end_time, histogram
+                )))
+
+    def receive(self, queue):
+        """Receives, handles and deletes one batch of messages, returning
+        the number received"""
+
+        messages = queue.get_messages(num_messages=10, wait_time_seconds=self.wait_time_secs)
+        if messages:
+            self.handle_messages(messages)
+            queue.delete_message_batch(messages)
+        return len(messages)
+
+    def _receive_loop(self):
+        queue = self.connect()
+        while not self._stopped.is_set():
+            try:
+                self.receive(queue)
+            except Exception as e:
+                print "Error receiving from SQS:", e
+                self._stopped.wait(1)
+
+    def start(self):
+        self._stopped.clear()
+        for i in range(self.num_receivers):
+            thread = threading.Thread(target=self._receive_loop)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self):
+        """Stops the receivers once their current long poll completes"""
+
+        self._stopped.set()
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+    def apply_updates(self):
+        """Applies all queued updates and boot reports to ClusterStats,
+        returning the number of updates applied"""
+
+        while 1:
+            try:
+                instance_id, marks = self.boot_reports.get_nowait()
+            except Queue.Empty:
+                break
+            self.cluster_stats.update_boot_report(instance_id, marks)
+
+        updates = []
+        while 1:
+            try:
+                updates.append(self.updates.get_nowait())
+            except Queue.Empty:
+                break
+
+        self.cluster_stats.update_many(updates)
+
+        tag_updates = {}
+        while 1:
+            try:
+                key, update = self.tag_updates.get_nowait()
+            except Queue.Empty:
+                break
+            tag_updates.setdefault(key, []).append(update)
+        for key, updates_for_tag in tag_updates.iteritems():
+            self.cluster_stats.tagged(key).update_many(updates_for_tag)
+        return len(updates)
+
+
+class ZMQConsumer(SQSConsumer):
+    """Receives the messages clients push straight to the controller with
+    a ZMQTransport, for lower latency than going through SQS. Updates are
+    applied with apply_updates, as for SQSConsumer. Clients fall back to
+    SQS, so run an SQSConsumer alongside"""
+
+    def __init__(self, cluster_stats, zmq_uri=CONTROLLER_BIND_URI, poll_timeout_ms=1000,
+                 max_remembered=100000):
+        # A PULL socket is read from a single thread
+        super(ZMQConsumer, self).__init__(cluster_stats, num_receivers=1, max_remembered=max_remembered)
+        self.zmq_uri = zmq_uri
+        self.poll_timeout_ms = poll_timeout_ms
+
+    def connect(self):
+        socket = zmq.Context.instance().socket(zmq.PULL)
+        socket.bind(self.zmq_uri)
+        return socket
+
+    def receive(self, socket):
+        """Waits up to poll_timeout_ms for messages and handles all that
+        are waiting, returning the number received"""
+
+        if not socket.poll(self.poll_timeout_ms):
+            return 0
+        count = 0
+        while 1:
+            try:
+                body = socket.recv(zmq.NOBLOCK)
+            except zmq.Again:
+                break
+            self.handle_body(body)
+            count += 1
+        return count
+
+    def _receive_loop(self):
+        socket = self.connect()
+        try:
+            while not self._stopped.is_set():
+                try:
+                    self.receive(socket)
+                except Exception as e:
+                    print "Error receiving from ZMQ:", e
+                    self._stopped.wait(1)
+        finally:
+            socket.close(linger=0)
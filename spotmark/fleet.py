@@ -0,0 +1,210 @@
+import itertools
+import Queue
+import threading
+import time
+
+class LaunchBatch(object):
+    """Records when the instances requested by one FleetLauncher.launch
+    call were requested, fulfilled and first served a request"""
+
+    def __init__(self, batch_id, allocation):
+        self.batch_id = batch_id
+        self.allocation = allocation
+        self.launch_time = time.time()
+        self.request_ids = set()
+        # instance_id -> time the request was seen to be fulfilled
+        self.fulfilled = {}
+        self.errors = []
+
+    def first_served_time(self, cluster_stats):
+        """Returns the end of the first interval in which an instance from
+        this batch reported a successful request, or None"""
+
+        times = []
+        for instance_id in self.fulfilled:
+            stats = cluster_stats.instance_stats.get(instance_id)
+            if stats is None:
+                continue
+            for interval in stats:
+                if interval.successes:
+                    times.append(interval.end_time)
+                    break
+        return min(times) if times else None
+
+    def report(self, cluster_stats=None):
+        def since_launch(timestamp):
+            return None if timestamp is None else timestamp - self.launch_time
+
+        fulfilled_times = sorted(self.fulfilled.values())
+        report = {
+            "batch_id": self.batch_id,
+            "allocation": self.allocation,
+            "requested": len(self.request_ids),
+            "fulfilled": len(fulfilled_times),
+            "errors": self.errors,
+            "time_to_first_fulfilled": since_launch(fulfilled_times[0] if fulfilled_times else None),
+            "time_to_all_fulfilled": since_launch(
+                fulfilled_times[-1] if len(fulfilled_times) == len(self.request_ids) else None
+            ),
+        }
+        if cluster_stats is not None:
+            report["time_to_first_request_served"] = since_launch(self.first_served_time(cluster_stats))
+        return report
+
+
+class FleetLauncher(object):
+    """Launches spot instances across several pools - eg. different
+    instance types or availability zones - in parallel.
+
+    pools is a list of (SpotInstanceLauncher, capacity) pairs, where
+    capacity is the relative throughput of one of the pool's instances.
+    Each launch is split across pools in proportion to capacity per
+    dollar at current spot prices, and each pool's request is made on its
+    own thread. Fulfillment is picked up from the pools' FleetStateTrackers
+    rather than waited for.
+
+    Fulfillment is seen on the trackers' threads, so the boot marks it
+    gives ClusterStats are queued and applied by apply_updates, which
+    should be called from the control loop's thread, as for SQSConsumer.
+
+    The requested and fulfilled marks are taken on this machine's clock
+    plus clock_offset_secs, while instances report marks on the
+    reference clock (see clock.py), and phases such as total span both.
+    Pass the controller's offset, eg. from clock.measure_clock_offset,
+    for those phases not to include the difference between the clocks"""
+
+    def __init__(self, pools, cluster_stats=None, clock_offset_secs=0.0):
+        self.pools = pools
+        self.cluster_stats = cluster_stats
+        self.clock_offset_secs = clock_offset_secs
+        # (instance_id, boot marks) for ClusterStats.update_boot_report
+        self.boot_reports = Queue.Queue()
+        self.batches = []
+        self._batch_ids = itertools.count()
+        self._lock = threading.Lock()
+
+        for launcher, capacity in pools:
+            launcher.fleet.on_event(self._on_event)
+
+    def _on_event(self, event, request_id, instance_id):
+        if event != 'fulfilled':
+            return
+        with self._lock:
+            for batch in self.batches:
+                if request_id in batch.request_ids:
+                    batch.fulfilled[instance_id] = time.time()
+                    if self.cluster_stats is not None:
+                        self.boot_reports.put((instance_id, {
+                            "requested": batch.launch_time + self.clock_offset_secs,
+                            "fulfilled": batch.fulfilled[instance_id] + self.clock_offset_secs
+                        }))
+                    break
+
+    def apply_updates(self):
+        """Applies the queued boot marks to ClusterStats, returning the
+        number of instances reported"""
+
+        count = 0
+        while 1:
+            try:
+                instance_id, marks = self.boot_reports.get_nowait()
+            except Queue.Empty:
+                break
+            self.cluster_stats.update_boot_report(instance_id, marks)
+            count += 1
+        return count
+
+    def weights(self):
+        """Returns the capacity per dollar of each pool, or 0 for pools
+        without a current spot price"""
+
+        weights = []
+        for launcher, capacity in self.pools:
+            try:
+                price = float(launcher.bid_price)
+            except AssertionError:
+                weights.append(0)
+                continue
+            weights.append(capacity / price if price > 0 else capacity)
+        return weights
+
+    def allocate(self, num_instances):
+        """Splits num_instances across the pools in proportion to their
+        weights, giving remainders to the largest fractional shares"""
+
+        weights = self.weights()
+        total = float(sum(weights))
+        assert total > 0, "No pools have a spot price to bid with"
+
+        shares = [num_instances * weight / total for weight in weights]
+        allocation = [int(share) for share in shares]
+        remainders = sorted(range(len(shares)), key=lambda i: allocation[i] - shares[i])
+        for i in remainders[:num_instances - sum(allocation)]:
+            allocation[i] += 1
+        return allocation
+
+    def _launch_pool(self, batch, launcher, count, kwargs):
+        try:
+            request_ids = launcher.launch(count, **kwargs)
+        except Exception as e:
+            with self._lock:
+                batch.errors.append("%s: %s" % (launcher.instance_type, e))
+            return
+        with self._lock:
+            batch.request_ids.update(request_ids)
+
+    def launch(self, num_instances, **kwargs):
+        """Requests num_instances across the pools, returning the LaunchBatch
+        recording their progress"""
+
+        allocation = self.allocate(num_instances)
+        batch = LaunchBatch(next(self._batch_ids), allocation)
+        with self._lock:
+            self.batches.append(batch)
+
+        threads = []
+        for (launcher, capacity), count in zip(self.pools, allocation):
+            if not count:
+                continue
+            thread = threading.Thread(target=self._launch_pool, args=(batch, launcher, count, kwargs))
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+        return batch
+
+    @property
+    def instance_ids(self):
+        return set().union(*[launcher.instance_ids for launcher, capacity in self.pools])
+
+    @property
+    def instance_count(self):
+        return len(self.instance_ids)
+
+    def terminate(self, num_instances=None, instance_ids=None):
+        """Terminates num_instances, taken from the most expensive pools
+        per unit of capacity first, or the given instance_ids"""
+
+        assert num_instances or instance_ids, "Must supply num_instances or instance_ids"
+        assert not(num_instances and instance_ids), "Must supply only one of num_instances or instance_ids"
+
+        if instance_ids:
+            instance_ids = set(instance_ids)
+            for launcher, capacity in self.pools:
+                owned = instance_ids & launcher.instance_ids
+                if owned:
+                    launcher.terminate(instance_ids=owned)
+            return
+
+        pools = zip(self.weights(), [launcher for launcher, capacity in self.pools])
+        for weight, launcher in sorted(pools, key=lambda pool: pool[0]):
+            count = min(num_instances, launcher.instance_count)
+            if count:
+                launcher.terminate(num_instances=count)
+                num_instances -= count
+            if not num_instances:
+                break
+
+    def batch_reports(self):
+        with self._lock:
+            return [batch.report(self.cluster_stats) for batch in self.batches]
@@ -0,0 +1,88 @@
+class LatencyHistogram(object):
+    """HDR-style histogram of request latencies.
+
+    Latencies are recorded in microseconds into log-linear buckets: values
+    below 2 ** sub_bucket_bits get a bucket each, and every power of two
+    above that is split into 2 ** (sub_bucket_bits - 1) equal buckets, so
+    the relative error is bounded by 1 / 2 ** (sub_bucket_bits - 1).
+    Values above max_latency_secs are clamped, which bounds the number of
+    buckets. Counts are kept sparsely, so an empty or narrow histogram is
+    cheap to store and to ship, and histograms with the same
+    sub_bucket_bits can be merged by adding counts"""
+
+    def __init__(self, sub_bucket_bits=7, max_latency_secs=3600):
+        self.sub_bucket_bits = sub_bucket_bits
+        self.max_value = int(max_latency_secs * 1e6)
+        self.counts = {}
+        self.count = 0
+
+    def _index(self, value):
+        magnitude = max(value.bit_length() - self.sub_bucket_bits, 0)
+        half = 1 << (self.sub_bucket_bits - 1)
+        return magnitude * half + (value >> magnitude)
+
+    def _highest_value(self, index):
+        """Returns the largest value that falls into the bucket at index"""
+
+        half = 1 << (self.sub_bucket_bits - 1)
+        magnitude = max(index // half - 1, 0)
+        sub_bucket = index - magnitude * half
+        return ((sub_bucket + 1) << magnitude) - 1
+
+    def record(self, latency_secs, count=1):
+        value = min(max(int(latency_secs * 1e6), 0), self.max_value)
+        index = self._index(value)
+        self.counts[index] = self.counts.get(index, 0) + count
+        self.count += count
+
+    def record_many(self, latencies_secs):
+        counts, index_of, max_value = self.counts, self._index, self.max_value
+        for latency_secs in latencies_secs:
+            index = index_of(min(max(int(latency_secs * 1e6), 0), max_value))
+            counts[index] = counts.get(index, 0) + 1
+        self.count += len(latencies_secs)
+
+    def merge(self, other):
+        assert other.sub_bucket_bits == self.sub_bucket_bits, "Can't merge histograms with different precision"
+        counts = self.counts
+        for index, count in other.counts.iteritems():
+            counts[index] = counts.get(index, 0) + count
+        self.count += other.count
+        return self
+
+    def percentile(self, percentile):
+        """Returns the latency in seconds at or below which percentile
+        percent of the recorded latencies fall, or None if nothing
+        has been recorded"""
+
+        assert 0 <= percentile <= 100, "percentile must be between 0 and 100"
+        if not self.count:
+            return None
+
+        threshold = max(self.count * percentile / 100.0, 1)
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= threshold:
+                break
+        return self._highest_value(index) / 1e6
+
+    def reset(self):
+        self.counts = {}
+        self.count = 0
+
+    def to_dict(self):
+        """Returns a compact, JSON-serializable representation"""
+
+        return {
+            "sub_bucket_bits": self.sub_bucket_bits,
+            "counts": sorted(self.counts.iteritems())
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        histogram = cls(sub_bucket_bits=data["sub_bucket_bits"])
+        for index, count in data["counts"]:
+            histogram.counts[index] = count
+            histogram.count += count
+        return histogram
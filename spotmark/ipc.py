@@ -1,6 +1,42 @@
+import json
+import multiprocessing
+import os
+import time
+
 import zmq
 from zmq.eventloop import ioloop, zmqstream
 
+from accumulator import Accumulator
+from histogram import LatencyHistogram
+from tags import DEFAULT_MAX_TAGS, TaggedTotals
+import wire
+
+def shard_uri(zmq_uri, shard):
+    """Returns the endpoint for receiver shard number shard. TCP shards
+    listen on the ports following zmq_uri's, other transports append
+    the shard number to the address"""
+
+    if zmq_uri.startswith("tcp://"):
+        address, port = zmq_uri.rsplit(":", 1)
+        return "%s:%d" % (address, int(port) + 1 + shard)
+    return "%s-%d" % (zmq_uri, shard)
+
+def next_aligned_time(now, interval_secs, clock_offset_secs=0.0):
+    """Returns the local time of the next multiple of interval_secs on the
+    reference clock, which is clock_offset_secs ahead of the local one"""
+
+    reference_now = now + clock_offset_secs
+    boundary = (int(reference_now // interval_secs) + 1) * interval_secs
+    return boundary - clock_offset_secs
+
+def emitter_uri(zmq_uri, num_shards):
+    """Returns the endpoint an emitter in this process should connect to,
+    spreading processes across num_shards receiver shards"""
+
+    if not num_shards:
+        return zmq_uri
+    return shard_uri(zmq_uri, os.getpid() % num_shards)
+
 class ZMQReceiver(object):
     """Reads messages from a ZeroMQ message stream. Uses
     tornado's event loop rather than repeatedly polling"""
@@ -26,21 +62,73 @@ class ZMQReceiver(object):
 class ZMQPeriodicReceiver(ZMQReceiver):
     """Like ZMQReceiver but with two callbacks - msg_callback
     receives messages from ZMQ, while periodic_callback is called 
-    at a user-specified interval"""
+    at a user-specified interval.
+
+    If align is set, periodic_callback is called on multiples of the
+    interval on a reference clock clock_offset_secs ahead of the local
+    one, so that receivers on different instances fire together"""
     
     def __init__(self, msg_callback, periodic_callback, 
-                periodic_callback_interval_ms, zmq_uri):
+                periodic_callback_interval_ms, zmq_uri, align=False, clock_offset_secs=0.0):
         super(ZMQPeriodicReceiver, self).__init__(msg_callback, zmq_uri)
         self.periodic_callback_interval_ms = periodic_callback_interval_ms 
         self.periodic_callback = periodic_callback
+        self.align = align
+        self.clock_offset_secs = clock_offset_secs
 
     def setup_ioloop(self):
         super(ZMQPeriodicReceiver, self).setup_ioloop()
+        if self.align:
+            self._schedule_aligned()
+            return
         periodic = ioloop.PeriodicCallback(
             self.periodic_callback, self.periodic_callback_interval_ms, io_loop=self.io_loop
         )
         periodic.start()
 
+    def _schedule_aligned(self):
+        deadline = next_aligned_time(
+            time.time(), self.periodic_callback_interval_ms / 1000.0, self.clock_offset_secs
+        )
+        self.io_loop.add_timeout(deadline, self._run_aligned)
+
+    def _run_aligned(self):
+        try:
+            self.periodic_callback()
+        finally:
+            self._schedule_aligned()
+
+
+class ShardWorker(multiprocessing.Process):
+    """One of several receiver processes for when a single receiver can't
+    keep up with decoding messages. Each binds its own shard endpoint,
+    accumulates what it receives and pushes the partial totals to the
+    collector receiving on zmq_uri every partial_interval_ms"""
+
+    def __init__(self, shard, zmq_uri, partial_interval_ms=1000):
+        super(ShardWorker, self).__init__()
+        self.daemon = True
+        self.shard = shard
+        self.zmq_uri = zmq_uri
+        self.partial_interval_ms = partial_interval_ms
+
+    def push_partial(self):
+        if self.accumulator.success_count or self.accumulator.failure_count:
+            self.emitter.send(json.dumps(self.accumulator.totals()))
+            self.accumulator.reset()
+
+    def run(self):
+        # Sockets have to be created after forking
+        self.accumulator = Accumulator()
+        self.emitter = ZMQEmitter(self.zmq_uri)
+        receiver = ZMQPeriodicReceiver(
+            self.accumulator.process_messages,
+            self.push_partial,
+            self.partial_interval_ms,
+            shard_uri(self.zmq_uri, self.shard)
+        )
+        receiver.begin_receiving()
+
 
 class ZMQEmitter(object):
     """Class that knows how to send messages to a ZMQReceiver""" 
@@ -50,9 +138,113 @@ class ZMQEmitter(object):
 
         self.push_socket = context.socket(zmq.PUSH)
         self.push_socket.connect(zmq_uri)
+
+    def send_record(self, success_count=0, failure_count=0, latencies=(), tag=None):
+        """Sends counts and latencies as a binary record, which is much
+        cheaper for the receiver to decode than JSON. tag is a dict of
+        tags or a tag key"""
+
+        self.push_socket.send(wire.pack_record(success_count, failure_count, latencies, tag))
+
+    def send_records(self, records):
+        """Sends (success_count, failure_count, latencies, tag) tuples as one
+        multipart message, which the receiver decodes in a single pass"""
+
+        self.push_socket.send_multipart([wire.pack_record(*record) for record in records])
     
     def __getattr__(self, name):
         """Expose the various send methods implement on the socket"""
         if "send" in name:
             return getattr(self.push_socket, name)
         return super(ZMQEmitter, self).__getattr__(name)
+
+
+
+class AggregatingEmitter(ZMQEmitter):
+    """ZMQEmitter that counts results and builds a latency histogram
+    in-process, and sends them as a single message every flush_count
+    records or flush_interval_ms, whichever comes first.
+
+    Sends never block: if the receiver isn't keeping up the totals are
+    kept and sent with the next flush, which is put off for another
+    flush_count records or flush_interval_ms so that a busy receiver
+    doesn't cost a serialization per record. There's no timer, so an
+    emitter that stops recording sends nothing until flush() or close()"""
+
+    def __init__(self, zmq_uri, flush_count=1000, flush_interval_ms=1000, max_tags=DEFAULT_MAX_TAGS):
+        super(AggregatingEmitter, self).__init__(zmq_uri)
+        self.flush_count = flush_count
+        self.flush_interval_secs = flush_interval_ms / 1000.0
+        self.latency_histogram = LatencyHistogram()
+        self.tagged = TaggedTotals(max_tags)
+        self.reset()
+
+    def reset(self):
+        self.success_count, self.failure_count = 0, 0
+        self.failure_kinds = {}
+        self.latency_histogram.reset()
+        self.tagged.reset()
+        self.last_flush_time = time.time()
+        self.next_flush_count = self.flush_count
+
+    def tag_id(self, tags):
+        """Interns a dict of tags, returning an id to pass as tags when
+        recording so that the tag set isn't formatted and hashed per request"""
+
+        return self.tagged.registry.intern(tags)
+
+    def record_success(self, latency=None, tags=None):
+        self.success_count += 1
+        if latency is not None:
+            self.latency_histogram.record(latency)
+        if tags is not None:
+            self.tagged.record(tags, True, latency)
+        self._maybe_flush()
+
+    def record_failure(self, kind=None, latency=None, tags=None):
+        self.failure_count += 1
+        if kind is not None:
+            self.failure_kinds[kind] = self.failure_kinds.get(kind, 0) + 1
+        if latency is not None:
+            self.latency_histogram.record(latency)
+        if tags is not None:
+            self.tagged.record(tags, False, latency)
+        self._maybe_flush()
+
+    def _maybe_flush(self):
+        if (self.success_count + self.failure_count >= self.next_flush_count or
+                time.time() - self.last_flush_time >= self.flush_interval_secs):
+            self.flush()
+
+    def flush(self):
+        """Sends the totals recorded since the last flush. Returns False if
+        they couldn't be sent without blocking"""
+
+        if not (self.success_count or self.failure_count):
+            self.last_flush_time = time.time()
+            return True
+
+        message = {
+            "success_count": self.success_count,
+            "failure_count": self.failure_count,
+            "failure_kinds": self.failure_kinds,
+            "latency_histogram": self.latency_histogram.to_dict()
+        }
+        if self.tagged:
+            message["tags"] = self.tagged.to_dict()
+        message = json.dumps(message)
+        try:
+            self.push_socket.send(message, zmq.NOBLOCK)
+        except zmq.Again:
+            # Back off rather than retrying on every record
+            self.last_flush_time = time.time()
+            self.next_flush_count = self.success_count + self.failure_count + self.flush_count
+            return False
+        self.reset()
+        return True
+
+    def close(self, linger_ms=1000):
+        """Flushes anything outstanding and closes the socket"""
+
+        self.flush()
+        self.push_socket.close(linger=linger_ms)
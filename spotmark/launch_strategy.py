@@ -1,3 +1,5 @@
+from collections import deque
+import math
 import time
 
 class LaunchStrategy(object):
@@ -9,6 +11,8 @@ class LaunchStrategy(object):
         self.last_decision_time = 0
         self.last_decision = 0
         self.last_requests_per_second = 0
+        # Source of the current time, replaceable for simulation
+        self.clock = time.time
 
     def get_instance_count_delta(self):
         """Returns the adjustment to the current number of running instances
@@ -17,24 +21,255 @@ class LaunchStrategy(object):
 
 class RequestsPerSecondStrategy(LaunchStrategy):
 
-    def __init__(self, cluster_stats, target_requests_per_second):
+    def __init__(self, cluster_stats, target_requests_per_second, window_secs=None):
         super(RequestsPerSecondStrategy, self).__init__(cluster_stats)
         self.target_requests_per_second = target_requests_per_second
         self.required_instance_count = None
+        # If set, read the cluster's running totals for this trailing window
+        # rather than recomputing them from every instance's history
+        self.window_secs = window_secs
+
+    def get_counts(self, now):
+        """Returns the number of reporting instances and the number of
+        requests per second they are making, over the trailing window if
+        window_secs is set and since last_decision_time otherwise.
+
+        As in PredictiveStrategy.observe, throughput is requests per
+        reported instance-second, scaled by the number of instances"""
+
+        if self.window_secs is None:
+            counts = (
+                self.cluster_stats.instance_count(self.last_decision_time, now),
+                self.cluster_stats.request_count(self.last_decision_time, now),
+                self.cluster_stats.instance_seconds(self.last_decision_time, now)
+            )
+        else:
+            window = self.cluster_stats.window(self.window_secs)
+            counts = window.instance_count(now), window.request_count(now), window.instance_seconds(now)
+
+        instance_count, request_count, instance_seconds = counts
+        if not instance_seconds:
+            return instance_count, 0.0
+        return instance_count, instance_count * request_count / float(instance_seconds)
 
     def get_instance_count_delta(self):
         """Returns the change in instance required to achieve the
         targeted requests per second"""
 
-        now = time.time()
+        now = self.clock()
         
         # Don't adjust number of machines because previous changes
         # are yet to take effect (eg new machines launching)
-        instance_count = self.cluster_stats.instance_count(self.last_decision_time, now)
+        instance_count, request_count = self.get_counts(now)
         if self.required_instance_count is not None and (self.required_instance_count != instance_count):
             return 0
-        request_count = self.cluster_stats.request_count(self.last_decision_time, now)
         requests_per_instance = round(request_count / instance_count)
         self.required_instance_count = round(self.target_requests_per_second / requests_per_instance)
 
         return self.required_instance_count - instance_count
+
+
+class PredictiveStrategy(LaunchStrategy):
+    """Scales towards a target requests per second without waiting for
+    every previous launch to start reporting.
+
+    Per-instance throughput is estimated with an exponentially weighted
+    moving average, and instances that have been launched but aren't
+    reporting yet are counted as if they were, until boot_timeout_secs
+    passes. The shortfall between the target and the predicted throughput
+    of reporting plus in-flight instances drives a PID controller, whose
+    output in requests per second is converted to instances, rounding up,
+    so the fleet overshoots the target by less than one instance"""
+
+    def __init__(self, cluster_stats, target_requests_per_second, window_secs=60,
+                 smoothing=0.3, kp=1.0, ki=0.0, kd=0.0, max_step=None,
+                 boot_timeout_secs=600, bootstrap_instances=1):
+        super(PredictiveStrategy, self).__init__(cluster_stats)
+        self.target_requests_per_second = target_requests_per_second
+        self.window_secs = window_secs
+        self.smoothing = smoothing
+        self.kp, self.ki, self.kd = kp, ki, kd
+        self.max_step = max_step
+        self.boot_timeout_secs = boot_timeout_secs
+        self.bootstrap_instances = bootstrap_instances
+
+        self.per_instance_rps = None
+        self.integral, self.last_error = 0.0, None
+        # [launch time, count] of launches yet to report, oldest first
+        self.in_flight = deque()
+        self.terminating = 0
+        self.last_instance_count = 0
+
+    def observe(self, now):
+        """Returns the number of reporting instances and their requests per
+        second over the trailing window.
+
+        Throughput is requests per reported instance-second, scaled by the
+        number of instances, so that instances which have only reported
+        for part of the window aren't counted as slow"""
+
+        windows = getattr(self.cluster_stats, "windows", {})
+        if self.window_secs in windows:
+            window = windows[self.window_secs]
+            counts = window.instance_count(now), window.request_count(now), window.instance_seconds(now)
+        else:
+            min_time = now - self.window_secs
+            counts = (
+                self.cluster_stats.instance_count(min_time, now),
+                self.cluster_stats.request_count(min_time, now),
+                self.cluster_stats.instance_seconds(min_time, now)
+            )
+
+        instance_count, request_count, instance_seconds = counts
+        if not instance_seconds:
+            return instance_count, 0.0
+        return instance_count, instance_count * request_count / float(instance_seconds)
+
+    @property
+    def in_flight_count(self):
+        return sum(count for launch_time, count in self.in_flight)
+
+    def _update_in_flight(self, now, instance_count):
+        # Newly reporting instances account for the oldest launches first
+        arrived = max(instance_count - self.last_instance_count, 0)
+        while arrived and self.in_flight:
+            launched = self.in_flight[0]
+            taken = min(arrived, launched[1])
+            launched[1] -= taken
+            arrived -= taken
+            if not launched[1]:
+                self.in_flight.popleft()
+
+        # Give up on launches that never started reporting, eg. spot
+        # requests that weren't fulfilled
+        while self.in_flight and now - self.in_flight[0][0] > self.boot_timeout_secs:
+            self.in_flight.popleft()
+
+        departed = max(self.last_instance_count - instance_count, 0)
+        self.terminating = max(self.terminating - departed, 0)
+        self.last_instance_count = instance_count
+
+    def _update_throughput(self, instance_count, requests_per_second):
+        if not (instance_count and requests_per_second):
+            return
+        sample = requests_per_second / instance_count
+        if self.per_instance_rps is None:
+            self.per_instance_rps = sample
+        else:
+            self.per_instance_rps += self.smoothing * (sample - self.per_instance_rps)
+
+    def get_instance_count_delta(self):
+        now = self.clock()
+        instance_count, requests_per_second = self.observe(now)
+        self._update_in_flight(now, instance_count)
+        self._update_throughput(instance_count, requests_per_second)
+        self.last_requests_per_second = requests_per_second
+
+        expected_count = instance_count + self.in_flight_count - self.terminating
+        if self.per_instance_rps is None:
+            # Nothing to model yet; start something so there is
+            delta = 0 if expected_count else self.bootstrap_instances
+        else:
+            error = self.target_requests_per_second - self.per_instance_rps * expected_count
+            # Only integrate once launches have landed, and errors bigger
+            # than rounding to whole instances, so that the integral corrects
+            # model error rather than boot latency
+            if not self.in_flight and abs(error) > self.per_instance_rps:
+                self.integral += error
+            derivative = 0.0 if self.last_error is None else error - self.last_error
+            self.last_error = error
+
+            output = self.kp * error + self.ki * self.integral + self.kd * derivative
+            instances = output / self.per_instance_rps
+            # Round up, so that scaling up reaches the target and scaling
+            # down only removes whole surplus instances. Allow for floating
+            # point error so that exact matches don't round
+            delta = int(math.ceil(instances - 1e-9))
+            # Can't terminate instances that aren't reporting yet
+            delta = max(delta, -max(expected_count - self.in_flight_count, 0))
+
+        if self.max_step is not None:
+            delta = max(min(delta, self.max_step), -self.max_step)
+
+        if delta > 0:
+            self.in_flight.append([now, delta])
+        elif delta < 0:
+            self.terminating -= delta
+        self.last_decision_time = now
+        self.last_decision = delta
+        return delta
+
+
+class ScheduledStrategy(PredictiveStrategy):
+    """PredictiveStrategy whose target follows a LoadProfile over time.
+
+    The target used for launching is the highest the profile reaches
+    within boot_latency_secs, so that capacity for an upcoming step is
+    launched early enough to be serving when the step begins. Each
+    decision records the profile's current target against the achieved
+    requests per second, summarised per segment by step_reports.
+
+    If boot_latency_percentile is set, the lead time is instead that
+    percentile of the fleet's measured boot latency, from request to first
+    successful request, once any instance has reported one"""
+
+    def __init__(self, cluster_stats, profile, boot_latency_secs=300, boot_latency_percentile=None, **kwargs):
+        super(ScheduledStrategy, self).__init__(cluster_stats, 0, **kwargs)
+        self.profile = profile
+        self.boot_latency_secs = boot_latency_secs
+        self.boot_latency_percentile = boot_latency_percentile
+        self.start_time = None
+        # Segment index -> [decision count, target sum, achieved sum, min achieved ratio]
+        self.step_samples = {}
+
+    def elapsed(self, now):
+        if self.start_time is None:
+            self.start_time = now
+        return now - self.start_time
+
+    def lead_time_secs(self):
+        if self.boot_latency_percentile is not None:
+            measured = self.cluster_stats.boot_latency(self.boot_latency_percentile)
+            if measured is not None:
+                return measured
+        return self.boot_latency_secs
+
+    def get_instance_count_delta(self):
+        elapsed = self.elapsed(self.clock())
+        self.target_requests_per_second = self.profile.max_target(
+            elapsed, elapsed + self.lead_time_secs()
+        )
+        delta = super(ScheduledStrategy, self).get_instance_count_delta()
+
+        target = self.profile.target_at(elapsed)
+        achieved = self.last_requests_per_second
+        samples = self.step_samples.setdefault(self.profile.segment_index_at(elapsed), [0, 0.0, 0.0, None])
+        samples[0] += 1
+        samples[1] += target
+        samples[2] += achieved
+        if target:
+            ratio = achieved / float(target)
+            samples[3] = ratio if samples[3] is None else min(samples[3], ratio)
+        return delta
+
+    def step_reports(self):
+        """Returns the mean target and achieved requests per second for each
+        segment of the profile that has had a decision made in it"""
+
+        reports = []
+        for index in sorted(self.step_samples):
+            count, target_sum, achieved_sum, min_ratio = self.step_samples[index]
+            segment = self.profile.segments[index]
+            mean_target, mean_achieved = target_sum / count, achieved_sum / count
+            reports.append({
+                "segment": index,
+                "kind": segment.name,
+                "start_secs": self.profile.start_offsets[index],
+                "duration_secs": segment.duration_secs,
+                "decisions": count,
+                "mean_target": mean_target,
+                "mean_achieved": mean_achieved,
+                "achieved_ratio": mean_achieved / mean_target if mean_target else None,
+                "min_achieved_ratio": min_ratio
+            })
+        return reports
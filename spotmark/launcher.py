@@ -1,19 +1,239 @@
 from datetime import datetime, timedelta
 import boto
+import threading
 import time
 
 # Ubuntu 13.04 64-bit instance-store
 DEFAULT_AMI = 'ami-5dd0ba34'
 BOOTSTRAP_TEMPLATE = "startup_template.sh"
 
-def get_most_recent_spot_price(instance_type, environment="Linux/UNIX"):
-    start_time = datetime.utcnow() - timedelta(seconds=3600)
-    prices = boto.connect_ec2().get_spot_price_history(
-        start_time=start_time.isoformat(),
-        instance_type=instance_type,
-        product_description=environment
+class SpotPriceCache(object):
+    """Caches the most recent spot price for each region, availability
+    zone, instance type and product.
+
+    Prices for all of a region's availability zones are fetched together,
+    and refreshed once they are older than ttl_secs. A refresh only asks
+    for the history since the newest price already seen"""
+
+    def __init__(self, ttl_secs=300, history_secs=3600):
+        self.ttl_secs = ttl_secs
+        self.history_secs = history_secs
+        # (region, availability zone, instance type, product) -> (timestamp, price)
+        self.prices = {}
+        # (region, instance type, product) -> (fetch time, newest timestamp)
+        self.fetches = {}
+
+    def refresh(self, ec2, instance_type, product_description):
+        region = ec2.region.name
+        fetch_key = (region, instance_type, product_description)
+        if fetch_key in self.fetches:
+            start_time = self.fetches[fetch_key][1]
+        else:
+            start_time = (datetime.utcnow() - timedelta(seconds=self.history_secs)).isoformat()
+
+        history = ec2.get_spot_price_history(
+            start_time=start_time,
+            instance_type=instance_type,
+            product_description=product_description
+        )
+
+        newest = start_time
+        for entry in history:
+            key = (region, entry.availability_zone, instance_type, product_description)
+            # Timestamps are ISO 8601 strings, so compare as strings
+            if key not in self.prices or entry.timestamp > self.prices[key][0]:
+                self.prices[key] = (entry.timestamp, entry.price)
+            newest = max(newest, entry.timestamp)
+        self.fetches[fetch_key] = (time.time(), newest)
+
+    def get_price(self, ec2, instance_type, product_description="Linux/UNIX", availability_zone=None):
+        """Returns the most recent spot price in availability_zone, or in
+        any of the region's zones if availability_zone isn't given"""
+
+        region = ec2.region.name
+        fetch_key = (region, instance_type, product_description)
+        fetched = self.fetches.get(fetch_key)
+        if fetched is None or time.time() - fetched[0] >= self.ttl_secs:
+            self.refresh(ec2, instance_type, product_description)
+
+        prices = [price for key, price in self.prices.iteritems()
+            if key[0] == region and key[2:] == fetch_key[1:]
+            and availability_zone in (None, key[1])]
+        if not prices:
+            raise AssertionError("No spot price history for %s %s in %s" % (
+                instance_type, product_description, availability_zone or region
+            ))
+        return max(prices)[1]
+
+SPOT_PRICE_CACHE = SpotPriceCache()
+
+def get_most_recent_spot_price(instance_type, environment="Linux/UNIX", availability_zone=None, ec2=None):
+    return SPOT_PRICE_CACHE.get_price(
+        ec2 or boto.connect_ec2(), instance_type, environment, availability_zone
     )
-    return prices[0].price
+
+# Spot request status codes for instances that AWS has taken back
+INTERRUPTION_CODES = {
+    'marked-for-termination',
+    'instance-terminated-by-price',
+    'instance-terminated-no-capacity',
+    'instance-terminated-capacity-oversubscribed',
+    'instance-terminated-launch-group-constraint',
+}
+CLOSED_STATES = {'closed', 'cancelled', 'failed'}
+# Error code for describing a request that EC2 has deleted
+REQUEST_NOT_FOUND = 'InvalidSpotInstanceRequestID.NotFound'
+
+class FleetStateTracker(object):
+    """Keeps the state of a set of spot instance requests in memory, so
+    that reading it doesn't need an EC2 API call.
+
+    refresh() describes all tracked requests in batches of batch_size, and
+    can be run on a background thread every poll_interval_secs with
+    start(). Listeners added with on_event are called with (event,
+    request_id, instance_id) for these events:
+
+        fulfilled   - an instance was assigned to the request
+        active      - the request became active
+        interrupted - AWS terminated, or is about to terminate, the instance
+        closed      - the request was closed, cancelled or failed
+
+    Requests are untracked once they've closed, as EC2 deletes them a few
+    hours later and describing a deleted request fails"""
+
+    def __init__(self, ec2, poll_interval_secs=15, batch_size=100):
+        self.ec2 = ec2
+        self.poll_interval_secs = poll_interval_secs
+        self.batch_size = batch_size
+        # request_id -> (state, status code, instance_id)
+        self.requests = {}
+        self.listeners = []
+        self.lock = threading.Lock()
+        self.thread = None
+        self._stopped = threading.Event()
+
+    @staticmethod
+    def _request_state(request):
+        status = getattr(request, 'status', None)
+        return (request.state, getattr(status, 'code', None), request.instance_id)
+
+    def on_event(self, listener):
+        self.listeners.append(listener)
+
+    def track(self, requests):
+        """Starts tracking newly-made spot requests"""
+
+        with self.lock:
+            for request in requests:
+                self.requests[request.id] = self._request_state(request)
+
+    def untrack(self, request_ids):
+        with self.lock:
+            for request_id in request_ids:
+                self.requests.pop(request_id, None)
+
+    @property
+    def request_ids(self):
+        with self.lock:
+            return set(self.requests)
+
+    @property
+    def instance_ids(self):
+        with self.lock:
+            return {instance_id for state, code, instance_id in self.requests.values()
+                if state == 'active' and instance_id}
+
+    def request_statuses(self):
+        with self.lock:
+            return [(state, instance_id) for state, code, instance_id in self.requests.values()]
+
+    def request_ids_for(self, instance_ids):
+        instance_ids = set(instance_ids)
+        with self.lock:
+            return {request_id for request_id, (state, code, instance_id) in self.requests.items()
+                if instance_id in instance_ids}
+
+    def _describe_batch(self, request_ids):
+        try:
+            return self.ec2.get_all_spot_instance_requests(request_ids=request_ids)
+        except Exception as e:
+            if getattr(e, 'error_code', None) != REQUEST_NOT_FOUND:
+                print "Error describing spot requests:", e
+                return []
+
+        # Find the deleted requests, so the rest can still be described
+        described = []
+        for request_id in request_ids:
+            try:
+                described.extend(self.ec2.get_all_spot_instance_requests(request_ids=[request_id]))
+            except Exception as e:
+                if getattr(e, 'error_code', None) == REQUEST_NOT_FOUND:
+                    self.untrack([request_id])
+                else:
+                    print "Error describing spot request %s:" % request_id, e
+        return described
+
+    def describe(self):
+        """Describes the tracked requests in batches. A batch that fails is
+        skipped so that the others are still described, and requests EC2
+        has deleted are untracked"""
+
+        request_ids = list(self.request_ids)
+        described = []
+        for i in range(0, len(request_ids), self.batch_size):
+            described.extend(self._describe_batch(request_ids[i:i + self.batch_size]))
+        return described
+
+    def refresh(self):
+        """Updates the state of all tracked requests and notifies listeners
+        of any changes"""
+
+        events = []
+        described = self.describe()
+        with self.lock:
+            for request in described:
+                if request.id not in self.requests:
+                    continue
+                old_state, old_code, old_instance_id = self.requests[request.id]
+                state, code, instance_id = new = self._request_state(request)
+                self.requests[request.id] = new
+
+                if instance_id and not old_instance_id:
+                    events.append(('fulfilled', request.id, instance_id))
+                if state == 'active' and old_state != 'active':
+                    events.append(('active', request.id, instance_id))
+                if code in INTERRUPTION_CODES and old_code not in INTERRUPTION_CODES:
+                    events.append(('interrupted', request.id, instance_id))
+                if state in CLOSED_STATES and old_state not in CLOSED_STATES:
+                    events.append(('closed', request.id, instance_id))
+                if state in CLOSED_STATES:
+                    del self.requests[request.id]
+
+        for event in events:
+            for listener in self.listeners:
+                listener(*event)
+        return events
+
+    def _poll(self):
+        while not self._stopped.wait(self.poll_interval_secs):
+            try:
+                self.refresh()
+            except Exception as e:
+                print "Error refreshing spot requests:", e
+
+    def start(self):
+        if self.thread is None:
+            self._stopped.clear()
+            self.thread = threading.Thread(target=self._poll)
+            self.thread.daemon = True
+            self.thread.start()
+
+    def stop(self):
+        if self.thread is not None:
+            self._stopped.set()
+            self.thread.join()
+            self.thread = None
+
 
 class ScriptedInstanceLauncher(object):
     """Launches an EC2 instance to run a user-supplied script"""
@@ -113,12 +333,24 @@ class SpotInstanceLauncher(ScriptedInstanceLauncher):
         super(SpotInstanceLauncher, self).__init__(instance_type, security_group, key_name,
             ami=ami, user_data=user_data, region_name=region_name, availability_zone=availability_zone
         )
-        self.spot_request_ids = set()
+        self._fleet = None
+
+    @property
+    def fleet(self):
+        """FleetStateTracker for the requests made by this launcher. It
+        starts polling after the first launch"""
+
+        if not self._fleet:
+            self._fleet = FleetStateTracker(self.ec2)
+        return self._fleet
+
+    @property
+    def spot_request_ids(self):
+        return self.fleet.request_ids
 
     @property
     def instance_ids(self):
-        requests = self.get_spot_requests()
-        return {i.instance_id for i in requests if i.state == 'active'}
+        return self.fleet.instance_ids
 
     @instance_ids.setter
     def instance_ids(self, value):
@@ -128,15 +360,19 @@ class SpotInstanceLauncher(ScriptedInstanceLauncher):
 
     @property
     def bid_price(self):
-        return get_most_recent_spot_price(self.instance_type)
+        return get_most_recent_spot_price(
+            self.instance_type, availability_zone=self.availability_zone, ec2=self.ec2
+        )
     
     def get_request_statuses(self):
-        return [(request.state, request.instance_id) for request in self.get_spot_requests()]
+        return self.fleet.request_statuses()
 
     def get_spot_requests(self):
         return self.ec2.get_all_spot_instance_requests(request_ids=list(self.spot_request_ids))
 
     def launch(self, num_instances, **kwargs):
+        # Launch in the zone whose price we're bidding
+        kwargs.setdefault("placement", self.availability_zone)
         requests = self.ec2.request_spot_instances(
             self.bid_price,
             self.ami,
@@ -146,7 +382,9 @@ class SpotInstanceLauncher(ScriptedInstanceLauncher):
             key_name=self.key_name,
             **kwargs
         )
-        self.spot_request_ids.update(request.id for request in requests)
+        self.fleet.track(requests)
+        self.fleet.start()
+        return [request.id for request in requests]
 
     def terminate(self, num_instances=None, instance_ids=None):
         """Terminates num_instances or instance_ids and also cancels
@@ -159,7 +397,6 @@ class SpotInstanceLauncher(ScriptedInstanceLauncher):
             instance_ids = list(self.instance_ids)[:num_instances]
         super(SpotInstanceLauncher, self).terminate(instance_ids=instance_ids)
 
-        to_cancel = [i for i in self.get_spot_requests() if i.instance_id in instance_ids]
-        request_ids = {request.id for request in to_cancel}
-        self.ec2.cancel_spot_instance_requests(request_ids)
-        self.spot_request_ids = self.spot_request_ids - request_ids
+        request_ids = self.fleet.request_ids_for(instance_ids)
+        self.ec2.cancel_spot_instance_requests(list(request_ids))
+        self.fleet.untrack(request_ids)
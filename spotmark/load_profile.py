@@ -0,0 +1,124 @@
+from bisect import bisect_right
+
+class Segment(object):
+    """Base class for one part of a LoadProfile. Targets are piecewise
+    linear within a segment, which LoadProfile.max_target relies on"""
+
+    name = "segment"
+
+    def __init__(self, duration_secs):
+        assert duration_secs > 0, "duration_secs must be positive"
+        self.duration_secs = duration_secs
+
+    def target_at(self, offset_secs):
+        """Returns the target requests per second offset_secs into the segment"""
+        raise NotImplementedError("Method should be implemented by sub-classes")
+
+    def breakpoints(self):
+        """Returns the offsets at which the target changes slope"""
+        return [0, self.duration_secs]
+
+
+class Soak(Segment):
+    """Holds a constant target"""
+
+    name = "soak"
+
+    def __init__(self, requests_per_second, duration_secs):
+        super(Soak, self).__init__(duration_secs)
+        self.requests_per_second = requests_per_second
+
+    def target_at(self, offset_secs):
+        return self.requests_per_second
+
+
+class Ramp(Segment):
+    """Moves the target linearly from start to end requests per second"""
+
+    name = "ramp"
+
+    def __init__(self, start_requests_per_second, end_requests_per_second, duration_secs):
+        super(Ramp, self).__init__(duration_secs)
+        self.start_requests_per_second = start_requests_per_second
+        self.end_requests_per_second = end_requests_per_second
+
+    def target_at(self, offset_secs):
+        fraction = min(max(offset_secs / float(self.duration_secs), 0), 1)
+        change = self.end_requests_per_second - self.start_requests_per_second
+        return self.start_requests_per_second + fraction * change
+
+
+class Spike(Segment):
+    """Holds a base target, jumping to peak_requests_per_second for
+    spike_secs starting spike_start_secs into the segment"""
+
+    name = "spike"
+
+    def __init__(self, base_requests_per_second, peak_requests_per_second, duration_secs,
+                 spike_start_secs, spike_secs):
+        super(Spike, self).__init__(duration_secs)
+        assert spike_start_secs + spike_secs <= duration_secs, "Spike must end within the segment"
+        self.base_requests_per_second = base_requests_per_second
+        self.peak_requests_per_second = peak_requests_per_second
+        self.spike_start_secs = spike_start_secs
+        self.spike_secs = spike_secs
+
+    def target_at(self, offset_secs):
+        if self.spike_start_secs <= offset_secs < self.spike_start_secs + self.spike_secs:
+            return self.peak_requests_per_second
+        return self.base_requests_per_second
+
+    def breakpoints(self):
+        spike_end = self.spike_start_secs + self.spike_secs
+        return [0, self.spike_start_secs, spike_end, self.duration_secs]
+
+
+def step_ladder(start_requests_per_second, step_requests_per_second, step_secs, num_steps):
+    """Returns Soak segments stepping the target up by step_requests_per_second
+    every step_secs, for finding the load at which the system under test
+    stops keeping up"""
+
+    return [Soak(start_requests_per_second + i * step_requests_per_second, step_secs)
+        for i in range(num_steps)]
+
+
+class LoadProfile(object):
+    """A sequence of segments describing the target requests per second
+    over the course of a run. After the last segment the target stays at
+    the value it finished on"""
+
+    def __init__(self, segments):
+        assert segments, "A LoadProfile needs at least one segment"
+        self.segments = segments
+        self.start_offsets = []
+        offset = 0
+        for segment in segments:
+            self.start_offsets.append(offset)
+            offset += segment.duration_secs
+        self.duration_secs = offset
+
+    def segment_index_at(self, elapsed_secs):
+        index = bisect_right(self.start_offsets, elapsed_secs) - 1
+        return min(max(index, 0), len(self.segments) - 1)
+
+    def target_at(self, elapsed_secs):
+        index = self.segment_index_at(elapsed_secs)
+        return self.segments[index].target_at(elapsed_secs - self.start_offsets[index])
+
+    def finished(self, elapsed_secs):
+        return elapsed_secs >= self.duration_secs
+
+    def max_target(self, start_secs, end_secs):
+        """Returns the highest target between start_secs and end_secs.
+        Targets are piecewise linear, so it's enough to look at the
+        endpoints and either side of each breakpoint between them"""
+
+        targets = [self.target_at(start_secs), self.target_at(end_secs)]
+        for segment, offset in zip(self.segments, self.start_offsets):
+            for breakpoint in segment.breakpoints():
+                elapsed = offset + breakpoint
+                if start_secs <= elapsed <= end_secs:
+                    # The value just before the breakpoint, and from it on
+                    targets.append(segment.target_at(max(breakpoint - 1e-9, 0)))
+                    targets.append(self.target_at(elapsed))
+        return max(targets)
@@ -0,0 +1,211 @@
+"""Exports a run's stats as time series on a uniform grid, to CSV or, if
+pyarrow is installed, Parquet or Arrow IPC files.
+
+Everything works on iterators of (instance_id, successes, failures,
+start_time, end_time, latency_histogram) updates in start time order, as
+produced by ClusterStats.updates() and StatsStore.intervals(), so that a
+run of any length exports in constant memory"""
+
+import argparse
+import csv
+import math
+
+from histogram import LatencyHistogram
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+DEFAULT_PERCENTILES = (50, 90, 99)
+CLUSTER = "cluster"
+
+def report_fields(percentiles=DEFAULT_PERCENTILES):
+    return [
+        "time", "instance_id", "instances", "successes", "failures", "requests",
+        "requests_per_second", "success_rate"
+    ] + ["latency_p%g" % p for p in percentiles]
+
+def _make_row(time, instance_id, instances, totals, step_secs, percentiles):
+    successes, failures, histogram = totals
+    requests = successes + failures
+    row = {
+        "time": time,
+        "instance_id": instance_id,
+        "instances": instances,
+        "successes": successes,
+        "failures": failures,
+        "requests": requests,
+        "requests_per_second": requests / float(step_secs),
+        "success_rate": successes / requests if requests else None,
+    }
+    for p in percentiles:
+        row["latency_p%g" % p] = histogram.percentile(p) if histogram is not None else None
+    return row
+
+def _bucket_rows(index, bucket, step_secs, per_instance, percentiles):
+    cluster = [0.0, 0.0, None]
+    rows = []
+    for instance_id in sorted(bucket):
+        totals = bucket[instance_id]
+        cluster[0] += totals[0]
+        cluster[1] += totals[1]
+        if totals[2] is not None:
+            if cluster[2] is None:
+                cluster[2] = LatencyHistogram(totals[2].sub_bucket_bits)
+            cluster[2].merge(totals[2])
+        if per_instance:
+            rows.append(_make_row(index * step_secs, instance_id, 1, totals, step_secs, percentiles))
+    rows.insert(0, _make_row(index * step_secs, CLUSTER, len(bucket), cluster, step_secs, percentiles))
+    return rows
+
+def resample(updates, step_secs, per_instance=False, percentiles=DEFAULT_PERCENTILES):
+    """Yields a row dict per step_secs bucket covering the updates, with
+    cluster-wide totals under instance_id "cluster", followed by a row
+    per reporting instance if per_instance is set.
+
+    Counts are split between buckets in proportion to how much of each
+    interval falls in them, so they can be fractional. Latencies can't be
+    split, so each interval's histogram goes to the bucket holding its
+    midpoint. success_rate is successes over requests in the bucket.
+
+    Updates must be in start time order. A bucket is complete once an
+    update starts after it, so only buckets spanned by the longest
+    interval are held in memory"""
+
+    # Bucket index -> {instance_id: [successes, failures, histogram]}
+    open_buckets = {}
+    next_index = None
+
+    def flush(before_index):
+        for index in xrange(next_index, before_index):
+            bucket = open_buckets.pop(index, {})
+            for row in _bucket_rows(index, bucket, step_secs, per_instance, percentiles):
+                yield row
+
+    for instance_id, successes, failures, start_time, end_time, histogram in updates:
+        first = int(start_time // step_secs)
+        if next_index is None:
+            next_index = first
+        elif first > next_index:
+            for row in flush(first):
+                yield row
+            next_index = first
+
+        last = max(int(math.ceil(end_time / float(step_secs))) - 1, first)
+        duration = float(end_time - start_time)
+        for index in xrange(first, last + 1):
+            if duration:
+                overlap = min(end_time, (index + 1) * step_secs) - max(start_time, index * step_secs)
+                fraction = overlap / duration
+            else:
+                fraction = 1.0
+            totals = open_buckets.setdefault(index, {}).setdefault(instance_id, [0.0, 0.0, None])
+            totals[0] += successes * fraction
+            totals[1] += failures * fraction
+
+        if histogram is not None:
+            midpoint = min(int((start_time + end_time) / 2.0 // step_secs), last)
+            totals = open_buckets.setdefault(midpoint, {}).setdefault(instance_id, [0.0, 0.0, None])
+            if totals[2] is None:
+                totals[2] = LatencyHistogram(histogram.sub_bucket_bits)
+            totals[2].merge(histogram)
+
+    if open_buckets:
+        for row in flush(max(open_buckets) + 1):
+            yield row
+
+def write_csv(rows, fileobj, percentiles=DEFAULT_PERCENTILES):
+    """Writes rows from resample as CSV, returning the number written"""
+
+    writer = csv.DictWriter(fileobj, report_fields(percentiles))
+    writer.writeheader()
+    count = 0
+    for row in rows:
+        writer.writerow(row)
+        count += 1
+    return count
+
+def _arrow_schema(percentiles):
+    types = {"instance_id": pyarrow.string(), "instances": pyarrow.int64()}
+    return pyarrow.schema([
+        pyarrow.field(name, types.get(name, pyarrow.float64()))
+        for name in report_fields(percentiles)
+    ])
+
+def _record_batches(rows, schema, batch_rows):
+    names = schema.names
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == batch_rows:
+            yield _record_batch(chunk, schema, names)
+            chunk = []
+    if chunk:
+        yield _record_batch(chunk, schema, names)
+
+def _record_batch(chunk, schema, names):
+    arrays = [pyarrow.array([row[name] for row in chunk], type=schema.field_by_name(name).type)
+        for name in names]
+    return pyarrow.RecordBatch.from_arrays(arrays, names)
+
+def write_parquet(rows, path, percentiles=DEFAULT_PERCENTILES, batch_rows=65536):
+    """Writes rows from resample to a Parquet file, batch_rows at a time,
+    returning the number written"""
+
+    if pyarrow is None:
+        raise ImportError("pyarrow is required to write Parquet")
+    schema = _arrow_schema(percentiles)
+    writer = pyarrow.parquet.ParquetWriter(path, schema)
+    count = 0
+    try:
+        for batch in _record_batches(rows, schema, batch_rows):
+            writer.write_table(pyarrow.Table.from_batches([batch]))
+            count += batch.num_rows
+    finally:
+        writer.close()
+    return count
+
+def write_arrow(rows, path, percentiles=DEFAULT_PERCENTILES, batch_rows=65536):
+    """Writes rows from resample to an Arrow IPC file, batch_rows at a
+    time, returning the number written"""
+
+    if pyarrow is None:
+        raise ImportError("pyarrow is required to write Arrow files")
+    schema = _arrow_schema(percentiles)
+    sink = pyarrow.OSFile(path, "wb")
+    writer = pyarrow.RecordBatchFileWriter(sink, schema)
+    count = 0
+    try:
+        for batch in _record_batches(rows, schema, batch_rows):
+            writer.write_batch(batch)
+            count += batch.num_rows
+    finally:
+        writer.close()
+        sink.close()
+    return count
+
+def main():
+    from store import StatsStore
+
+    parser = argparse.ArgumentParser(description="Exports a run's stats from a StatsStore file")
+    parser.add_argument("store", help="Path of the StatsStore file")
+    parser.add_argument("output", help="Path to write; the format is chosen by extension "
+        "(.csv, .parquet or .arrow)")
+    parser.add_argument("--step-secs", type=float, default=10)
+    parser.add_argument("--per-instance", action="store_true")
+    args = parser.parse_args()
+
+    store = StatsStore(args.store)
+    rows = resample(store.intervals(), args.step_secs, args.per_instance)
+    if args.output.endswith(".parquet"):
+        write_parquet(rows, args.output)
+    elif args.output.endswith(".arrow"):
+        write_arrow(rows, args.output)
+    else:
+        with open(args.output, "wb") as output:
+            write_csv(rows, output)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+"""Discrete-event simulation of a benchmarking fleet, for seeing how a
+LaunchStrategy behaves without launching any instances.
+
+Simulated instances boot, serve requests and report intervals to a real
+ClusterStats, and the strategy makes its decisions against a virtual
+clock. Nothing sleeps, so hours of fleet time run in seconds"""
+
+import heapq
+import itertools
+import random
+
+from stats import ClusterStats
+
+class SimulatedInstance(object):
+
+    def __init__(self, instance_id, launch_time, boot_secs, requests_per_second):
+        self.instance_id = instance_id
+        self.launch_time = launch_time
+        self.ready_time = launch_time + boot_secs
+        self.requests_per_second = requests_per_second
+        self.last_report_time = None
+        self.end_time = None
+
+    @property
+    def running(self):
+        return self.end_time is None
+
+    def serving(self, now):
+        return self.running and now >= self.ready_time
+
+
+class FleetSimulator(object):
+    """Runs a strategy against a simulated fleet.
+
+    strategy_factory is called with the simulation's ClusterStats and
+    returns the LaunchStrategy to evaluate. Boot times and per-instance
+    throughput are drawn from boot_secs and requests_per_second, which are
+    functions of a random.Random, so that runs with the same seed are
+    repeatable. Each instance reports every report_interval_secs, give or
+    take report_jitter_secs, and is interrupted at interruptions_per_hour"""
+
+    def __init__(self, strategy_factory,
+                 boot_secs=lambda rng: max(rng.gauss(180, 30), 30),
+                 requests_per_second=lambda rng: max(rng.gauss(50, 5), 1),
+                 success_rate=1.0, interruptions_per_hour=0.0,
+                 report_interval_secs=10, report_jitter_secs=1,
+                 decision_interval_secs=30, seed=0):
+        self.cluster_stats = ClusterStats()
+        self.strategy = strategy_factory(self.cluster_stats)
+        self.strategy.clock = lambda: self.now
+
+        self.boot_secs = boot_secs
+        self.requests_per_second = requests_per_second
+        self.success_rate = success_rate
+        self.interruptions_per_hour = interruptions_per_hour
+        self.report_interval_secs = report_interval_secs
+        self.report_jitter_secs = report_jitter_secs
+        self.decision_interval_secs = decision_interval_secs
+        self.rng = random.Random(seed)
+
+        self.now = 0.0
+        self.events = []
+        self._sequence = itertools.count()
+        self._instance_ids = itertools.count()
+        self.instances = {}
+        self.interruption_count = 0
+        # (time, target, served requests per second, measured requests
+        # per second, serving instances, running instances) per decision
+        self.timeline = []
+
+    def schedule(self, at, handler, *args):
+        heapq.heappush(self.events, (at, next(self._sequence), handler, args))
+
+    def running_instances(self):
+        return [i for i in self.instances.itervalues() if i.running]
+
+    def served_requests_per_second(self):
+        return sum(i.requests_per_second for i in self.instances.itervalues() if i.serving(self.now))
+
+    def launch(self, count):
+        for i in range(count):
+            instance = SimulatedInstance(
+                "sim-%d" % next(self._instance_ids), self.now,
+                self.boot_secs(self.rng), self.requests_per_second(self.rng)
+            )
+            self.instances[instance.instance_id] = instance
+            self.schedule(instance.ready_time, self.on_ready, instance)
+
+    def terminate(self, count):
+        """Terminates the most recently launched instances"""
+
+        running = sorted(self.running_instances(), key=lambda i: i.launch_time, reverse=True)
+        for instance in running[:count]:
+            instance.end_time = self.now
+
+    def next_report_time(self):
+        jitter = self.rng.uniform(-self.report_jitter_secs, self.report_jitter_secs)
+        return self.now + max(self.report_interval_secs + jitter, 0.001)
+
+    def on_ready(self, instance):
+        if not instance.running:
+            return
+        instance.last_report_time = self.now
+        self.schedule(self.next_report_time(), self.on_report, instance)
+        if self.interruptions_per_hour:
+            interrupt_after = self.rng.expovariate(self.interruptions_per_hour / 3600.0)
+            self.schedule(self.now + interrupt_after, self.on_interrupt, instance)
+
+    def on_report(self, instance):
+        if not instance.running:
+            return
+        requests = int(round(instance.requests_per_second * (self.now - instance.last_report_time)))
+        successes = int(round(requests * self.success_rate))
+        self.cluster_stats.update(
+            instance.instance_id, successes, requests - successes, instance.last_report_time, self.now
+        )
+        instance.last_report_time = self.now
+        self.schedule(self.next_report_time(), self.on_report, instance)
+
+    def on_interrupt(self, instance):
+        if instance.running:
+            instance.end_time = self.now
+            self.interruption_count += 1
+
+    def on_decide(self):
+        delta = self.strategy.get_instance_count_delta()
+        if delta > 0:
+            self.launch(delta)
+        elif delta < 0:
+            self.terminate(-delta)
+
+        self.timeline.append((
+            self.now,
+            self.target_at(self.now),
+            self.served_requests_per_second(),
+            self.strategy.last_requests_per_second,
+            sum(1 for i in self.instances.itervalues() if i.serving(self.now)),
+            len(self.running_instances())
+        ))
+        self.schedule(self.now + self.decision_interval_secs, self.on_decide)
+
+    def target_at(self, now):
+        profile = getattr(self.strategy, "profile", None)
+        if profile is not None:
+            return profile.target_at(now - (self.strategy.start_time or 0))
+        return self.strategy.target_requests_per_second
+
+    def run(self, duration_secs, target_fraction=0.95):
+        """Simulates duration_secs of fleet time and returns the result"""
+
+        if not self.events:
+            self.schedule(self.now, self.on_decide)
+        end_time = self.now + duration_secs
+        while self.events and self.events[0][0] <= end_time:
+            at, _, handler, args = heapq.heappop(self.events)
+            self.now = at
+            handler(*args)
+        self.now = end_time
+        return self.result(target_fraction)
+
+    def result(self, target_fraction=0.95):
+        """Summarises the run: time until the fleet first served
+        target_fraction of the target, the largest overshoot of the target
+        as a fraction of it, and the instance-hours paid for"""
+
+        time_to_target, overshoot, max_instances = None, 0.0, 0
+        for now, target, served, measured, serving, running in self.timeline:
+            max_instances = max(max_instances, running)
+            if not target:
+                continue
+            if time_to_target is None and served >= target * target_fraction:
+                time_to_target = now
+            overshoot = max(overshoot, (served - target) / float(target))
+
+        instance_secs = sum((i.end_time if i.end_time is not None else self.now) - i.launch_time
+            for i in self.instances.itervalues())
+        return {
+            "duration_secs": self.now,
+            "time_to_target_secs": time_to_target,
+            "overshoot": overshoot,
+            "max_instances": max_instances,
+            "instances_launched": len(self.instances),
+            "interruptions": self.interruption_count,
+            "instance_hours": instance_secs / 3600.0,
+        }
+
+
+def compare(strategy_factories, duration_secs, **kwargs):
+    """Runs each of a dict of named strategy factories through the same
+    simulated conditions, returning their results by name"""
+
+    return dict(
+        (name, FleetSimulator(factory, **kwargs).run(duration_secs))
+        for name, factory in strategy_factories.iteritems()
+    )
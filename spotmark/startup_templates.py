@@ -4,15 +4,42 @@ import jinja2
 
 TEMPLATES_DIR = "../templates"
 
-def get_startup_script(template_file, aws_access_key, aws_secret_key, **kwargs):
-    env = jinja2.Environment(
-        loader=jinja2.PackageLoader('spotmark', '../templates')
-    )
-    template = env.get_template(template_file)
+# Built once so that compiled templates are cached between calls
+ENVIRONMENT = jinja2.Environment(
+    loader=jinja2.PackageLoader('spotmark', TEMPLATES_DIR)
+)
+
+def get_startup_script(template_file, aws_access_key, aws_secret_key, prebaked_dir=None,
+                       environment_url=None, wheelhouse_url=None, install_dir="spotmark",
+                       aggregator_uri=None, run_aggregator=False, controller_uri=None, **kwargs):
+    """Renders a startup script. By default instances clone the repo and
+    build its virtualenv, compiling pyzmq, which takes minutes. Faster
+    boots use one of:
+
+    prebaked_dir: where the repo and virtualenv are already installed on
+        the AMI, so nothing is installed at all
+    environment_url: a .tar.gz of the repo and a virtualenv built in
+        install_dir on the same image, to unpack and run as is
+    wheelhouse_url: a .tar.gz of wheels for requirements.txt, so that pip
+        installs without compiling anything
+
+    aggregator_uri and run_aggregator set up the aggregation tier: clients
+    given an aggregator_uri report to the Aggregator there rather than to
+    SQS, and instances launched with run_aggregator run one. Clients given
+    a controller_uri push updates straight to the controller's ZMQConsumer"""
+
+    template = ENVIRONMENT.get_template(template_file)
     kwargs.update({
         "spotmark": {
             "aws_access_key": aws_access_key,
-            "aws_secret_key": aws_secret_key
+            "aws_secret_key": aws_secret_key,
+            "prebaked_dir": prebaked_dir,
+            "environment_url": environment_url,
+            "wheelhouse_url": wheelhouse_url,
+            "install_dir": install_dir,
+            "aggregator_uri": aggregator_uri,
+            "run_aggregator": run_aggregator,
+            "controller_uri": controller_uri
         }
     })
     return template.render(**kwargs)
@@ -1,79 +1,511 @@
+from array import array
+from bisect import bisect_left, bisect_right
 from collections import namedtuple
+import heapq
+import itertools
 import time
 
 import boto
 
+from histogram import LatencyHistogram
+from tags import DEFAULT_MAX_TAGS, TagRegistry, tag_key
+
 stats_tuple = namedtuple("stats", "successes failures requests start_time end_time interval")
 
+DEFAULT_WINDOWS = (30, 60, 300)
+
+# Boot phases as (name, start mark, end mark). Marks are timestamps
+# reported by the controller (requested, fulfilled), the startup script
+# (os_boot, user_data_start, install_end) and the client (client_start,
+# first_request). Phases may overlap; instance_start covers everything
+# from the spot request to the kernel booting
+BOOT_PHASES = (
+    ("spot_fulfillment", "requested", "fulfilled"),
+    ("instance_start", "requested", "os_boot"),
+    ("os_boot", "os_boot", "user_data_start"),
+    ("install", "user_data_start", "install_end"),
+    ("client_start", "install_end", "client_start"),
+    ("warm_up", "client_start", "first_request"),
+    ("total", "requested", "first_request"),
+)
+
 class InstanceStats(object):
-    """Represents stats for a single benchmarking instance"""
+    """Represents stats for a single benchmarking instance
+
+    Intervals are stored column-wise in parallel typed arrays, kept
+    sorted by start time, so that window queries are a pair of binary
+    searches followed by sums over array slices.
+
+    An instance's intervals are expected not to overlap, as when each
+    update starts where the last ended, so that end times are sorted
+    too; period queries bisect them. Overlapping intervals - eg. after
+    the instance's clock steps backwards - aren't rejected, but queries
+    spanning them may miscount"""
 
     def __init__(self, instance_id):
         self.instance_id = instance_id
-        self._stats = []
+        self._successes = array('l')
+        self._failures = array('l')
+        self._start_times = array('d')
+        self._end_times = array('d')
+        # LatencyHistogram per interval, or None if latencies weren't reported
+        self._histograms = []
+
+    def __len__(self):
+        return len(self._start_times)
 
-    def update(self, successes, failures, start_time, end_time):
-        self._stats.append(stats_tuple(
+    def __getitem__(self, index):
+        successes, failures = self._successes[index], self._failures[index]
+        start_time, end_time = self._start_times[index], self._end_times[index]
+        return stats_tuple(
             successes=successes,
             failures=failures,
             requests=successes + failures,
             start_time=start_time,
             end_time=end_time,
             interval=end_time - start_time
-        ))
+        )
+
+    def update(self, successes, failures, start_time, end_time, latency_histogram=None):
+        # Updates almost always arrive in time order, in which case this
+        # is an append; late arrivals are inserted in place
+        index = len(self._start_times)
+        if index and start_time < self._start_times[-1]:
+            index = bisect_right(self._start_times, start_time)
+
+        self._successes.insert(index, successes)
+        self._failures.insert(index, failures)
+        self._start_times.insert(index, start_time)
+        self._end_times.insert(index, end_time)
+        self._histograms.insert(index, latency_histogram)
+
+    def updates(self):
+        """Yields the intervals as (instance_id, successes, failures,
+        start_time, end_time, latency_histogram) updates, in time order"""
+
+        for i in xrange(len(self._start_times)):
+            yield (self.instance_id, self._successes[i], self._failures[i],
+                   self._start_times[i], self._end_times[i], self._histograms[i])
+
+    def prune(self, before_time):
+        """Drops the intervals that started before before_time, returning
+        the number dropped"""
+
+        count = bisect_left(self._start_times, before_time)
+        if count:
+            for column in (self._successes, self._failures, self._start_times,
+                           self._end_times, self._histograms):
+                del column[:count]
+        return count
+
+    def _period_slice(self, min_time, max_time):
+        """Returns the (lo, hi) indexes of the intervals lying entirely
+        within min_time and max_time"""
 
-    def get_period(self, min_time, max_time):
         assert min_time <= max_time, "min_time cannot be greater than max_time"
-        return [i for i in self._stats if i.start_time >= min_time and i.end_time <= max_time]
+        lo = bisect_left(self._start_times, min_time)
+        hi = bisect_right(self._end_times, max_time, lo)
+        return lo, hi
+
+    def _partial_overlaps(self, min_time, max_time, lo, hi):
+        """Returns (index, overlap secs, fraction) for the intervals that
+        lie partly within min_time and max_time, given the slice of those
+        entirely within it"""
+
+        partial = []
+        before = lo - 1
+        if before >= 0 and self._end_times[before] > min_time:
+            partial.append(before)
+        partial.extend(xrange(hi, bisect_left(self._start_times, max_time)))
+
+        overlaps = []
+        for i in partial:
+            start_time, end_time = self._start_times[i], self._end_times[i]
+            overlap = min(end_time, max_time) - max(start_time, min_time)
+            if overlap > 0:
+                overlaps.append((i, overlap, overlap / (end_time - start_time)))
+        return overlaps
+
+    def get_period(self, min_time, max_time):
+        lo, hi = self._period_slice(min_time, max_time)
+        return [self[i] for i in xrange(lo, hi)]
+
+    def has_period(self, min_time, max_time):
+        """Returns whether any interval lies at least partly within the
+        period"""
+
+        lo, hi = self._period_slice(min_time, max_time)
+        return hi > lo or bool(self._partial_overlaps(min_time, max_time, lo, hi))
 
     def success_rate(self, min_time, max_time):
-        """Returns the mean success rate of the instances
-        for requests made over since last_seconds"""
+        """Returns the fraction of the requests made in the period that
+        succeeded, counted as for request_count, or 0 if none were made"""
 
-        rates = [(i.successes / float(i.requests)) for i in self.get_period(min_time, max_time)]
-        if not rates:
+        requests = self.request_count(min_time, max_time)
+        if not requests:
             return 0
-        return sum(rates) / len(rates)
+        return self.success_count(min_time, max_time) / float(requests)
 
     def request_count(self, min_time, max_time):
-        print [i.requests for i in self.get_period(min_time, max_time)] 
-        return sum(i.requests for i in self.get_period(min_time, max_time))
+        """Returns the number of requests made in the period. Intervals
+        that lie partly outside it count in proportion to their overlap"""
+
+        lo, hi = self._period_slice(min_time, max_time)
+        count = sum(self._successes[lo:hi]) + sum(self._failures[lo:hi])
+        for i, overlap, fraction in self._partial_overlaps(min_time, max_time, lo, hi):
+            count += (self._successes[i] + self._failures[i]) * fraction
+        return count
+
+    def success_count(self, min_time, max_time):
+        """Returns the number of successful requests in the period, counted
+        as for request_count"""
+
+        lo, hi = self._period_slice(min_time, max_time)
+        count = sum(self._successes[lo:hi])
+        for i, overlap, fraction in self._partial_overlaps(min_time, max_time, lo, hi):
+            count += self._successes[i] * fraction
+        return count
+
+    def instance_seconds(self, min_time, max_time):
+        """Returns the total time covered by intervals in the period"""
+
+        lo, hi = self._period_slice(min_time, max_time)
+        seconds = sum(self._end_times[lo:hi]) - sum(self._start_times[lo:hi])
+        for i, overlap, fraction in self._partial_overlaps(min_time, max_time, lo, hi):
+            seconds += overlap
+        return seconds
+
+    def latency_histogram(self, min_time, max_time, merged=None):
+        """Returns a LatencyHistogram of the latencies reported over the
+        period, merging into merged if given. Histograms can't be split,
+        so an interval's latencies count only towards periods that hold
+        the whole interval"""
+
+        lo, hi = self._period_slice(min_time, max_time)
+        if merged is None:
+            merged = LatencyHistogram()
+        for histogram in self._histograms[lo:hi]:
+            if histogram is not None:
+                merged.merge(histogram)
+        return merged
 
          
+class TrailingWindow(object):
+    """Running cluster-wide totals over the last window_secs seconds.
+
+    Intervals are added as they are reported and expired as time moves
+    forward, so that queries cost the same regardless of the number of
+    instances or the length of the run. An interval counts towards the
+    window if it started within window_secs of the time of the query"""
+
+    def __init__(self, window_secs):
+        self.window_secs = window_secs
+        self.successes, self.failures = 0, 0
+        # Total length of the intervals in the window
+        self.reported_secs = 0.0
+        self.now = None
+
+        # Min-heap on start time so that late-arriving updates still
+        # expire in the right order
+        self._intervals = []
+        self._sequence = itertools.count()
+
+        # instance_id -> [interval count, request count, success count]
+        self._instances = {}
+        # Sum over instances of each instance's success rate
+        self._rate_sum = 0.0
+        self._rated_instance_count = 0
+
+    def _update_instance(self, instance_id, sign, successes, failures):
+        totals = self._instances.setdefault(instance_id, [0, 0, 0])
+        if totals[1]:
+            self._rate_sum -= totals[2] / float(totals[1])
+            self._rated_instance_count -= 1
+
+        totals[0] += sign
+        totals[1] += sign * (successes + failures)
+        totals[2] += sign * successes
+
+        # Instances without requests have no success rate
+        if totals[1]:
+            self._rate_sum += totals[2] / float(totals[1])
+            self._rated_instance_count += 1
+        if not totals[0]:
+            del self._instances[instance_id]
+        if not self._rated_instance_count:
+            self._rate_sum = 0.0
+
+    def add(self, instance_id, successes, failures, start_time, end_time):
+        if self.now is not None and start_time < self.now - self.window_secs:
+            return
+
+        heapq.heappush(self._intervals,
+            (start_time, next(self._sequence), instance_id, successes, failures, end_time)
+        )
+        self.successes += successes
+        self.failures += failures
+        self.reported_secs += end_time - start_time
+        self._update_instance(instance_id, 1, successes, failures)
+
+    def advance(self, now=None):
+        """Expires intervals that started before now - window_secs. Time
+        never moves backwards, so an earlier now is ignored"""
+
+        if now is None:
+            now = time.time()
+        if self.now is not None and now <= self.now:
+            return
+        self.now = now
+
+        min_time = now - self.window_secs
+        intervals = self._intervals
+        while intervals and intervals[0][0] < min_time:
+            start_time, _, instance_id, successes, failures, end_time = heapq.heappop(intervals)
+            self.successes -= successes
+            self.failures -= failures
+            self.reported_secs -= end_time - start_time
+            self._update_instance(instance_id, -1, successes, failures)
+        if not intervals:
+            self.reported_secs = 0.0
+
+    def request_count(self, now=None):
+        self.advance(now)
+        return self.successes + self.failures
+
+    def instance_count(self, now=None):
+        self.advance(now)
+        return len(self._instances)
+
+    def instance_seconds(self, now=None):
+        """Returns the total time covered by the intervals in the window,
+        summed over instances"""
+
+        self.advance(now)
+        return self.reported_secs
+
+    def instance_ids(self, now=None):
+        self.advance(now)
+        return set(self._instances)
+
+    def success_rate(self, now=None):
+        """Returns the mean of the instances' success rates, as for
+        ClusterStats.success_rate"""
+
+        self.advance(now)
+        if not self._rated_instance_count:
+            return 0
+        return self._rate_sum / self._rated_instance_count
+
+
 class ClusterStats(object):
-    """Provides stats for a cluster of benchmarking instances"""
+    """Provides stats for a cluster of benchmarking instances
 
-    def __init__(self):
+    If a StatsStore is given, every update is also written to it, so that
+    the history can be replayed after a restart. If retention_secs is set,
+    intervals that started more than retention_secs before the latest
+    reported interval are dropped from memory, bounding memory use over
+    long runs; the store keeps them. Trailing windows expire intervals
+    as updates arrive, so they're bounded by their own length.
+
+    Intervals reported per tag set are kept in a nested ClusterStats per
+    tag key, see tagged() and for_tags(). Tag sets beyond max_tags share
+    the tags.OVERFLOW_TAG one. Tagged intervals aren't stored"""
+
+    def __init__(self, windows=DEFAULT_WINDOWS, store=None, retention_secs=None, max_tags=DEFAULT_MAX_TAGS):
+        assert retention_secs is None or retention_secs >= max(windows or [0]), \
+            "retention_secs must cover the longest trailing window"
         self.instance_stats = {}
+        self.windows = dict((secs, TrailingWindow(secs)) for secs in windows)
+        self.store = store
+        self.retention_secs = retention_secs
+        self._next_prune_time = None
+        # instance_id -> {mark: timestamp}, see BOOT_PHASES
+        self.boot_marks = {}
+        self.boot_phases = dict((phase, LatencyHistogram()) for phase, start, end in BOOT_PHASES)
+        # tag key -> ClusterStats
+        self.tag_stats = {}
+        self.tag_registry = TagRegistry(max_tags)
+
+    def update(self, instance_id, successes, failures, start_time, end_time, latency_histogram=None,
+               persist=True):
+        if persist and self.store is not None:
+            self.store.append(instance_id, successes, failures, start_time, end_time, latency_histogram)
 
-    def update(self, instance_id, successes, failures, start_time, end_time):
         if instance_id not in self.instance_stats:
             self.instance_stats[instance_id] = InstanceStats(instance_id)
         
         stats = self.instance_stats[instance_id]
-        stats.update(successes, failures, start_time, end_time)
+        stats.update(successes, failures, start_time, end_time, latency_histogram)
+
+        for window in self.windows.itervalues():
+            window.add(instance_id, successes, failures, start_time, end_time)
+            # Expire as updates arrive, rather than only when queried, so
+            # that windows nobody reads don't grow for the whole run
+            window.advance(end_time)
+
+        if self.retention_secs is not None:
+            if self._next_prune_time is None:
+                self._next_prune_time = end_time + self.retention_secs
+            elif end_time >= self._next_prune_time:
+                self.prune(end_time - self.retention_secs)
+                # Pruning visits every instance, so only do it every
+                # tenth of the retention period
+                self._next_prune_time = end_time + self.retention_secs / 10.0
+
+    def update_many(self, updates, persist=True):
+        """Applies a batch of (instance_id, successes, failures, start_time,
+        end_time, latency_histogram) updates. They're applied in time order,
+        so that intervals are appended rather than inserted"""
+
+        if persist and self.store is not None and updates:
+            self.store.append_many(updates)
+        for update in sorted(updates, key=lambda update: update[3]):
+            self.update(*update, persist=False)
+
+    def updates(self):
+        """Yields every interval held in memory as an update tuple, as for
+        update_many, in start time order across instances"""
+
+        def keyed(n, stats):
+            # Ties are broken by instance and position, so updates
+            # themselves are never compared
+            for i, update in enumerate(stats.updates()):
+                yield update[3], n, i, update
+
+        merged = heapq.merge(*[keyed(n, stats) for n, stats in enumerate(self.instance_stats.itervalues())])
+        for start_time, n, i, update in merged:
+            yield update
+
+    def prune(self, before_time):
+        """Drops intervals that started before before_time from memory,
+        including from the trailing windows, and instances left with none,
+        returning the number of intervals dropped"""
+
+        for window in self.windows.itervalues():
+            window.advance(before_time + window.window_secs)
+        count = 0
+        for instance_id, stats in self.instance_stats.items():
+            count += stats.prune(before_time)
+            if not len(stats):
+                del self.instance_stats[instance_id]
+        for stats in self.tag_stats.itervalues():
+            count += stats.prune(before_time)
+        return count
+
+    def tagged(self, tags):
+        """Returns the ClusterStats for a dict of tags or tag key, creating
+        it if need be, for applying tagged updates to"""
+
+        tag_id = self.tag_registry.intern(tags)
+        assert tag_id is not None, "No tags given"
+        key = self.tag_registry.key(tag_id)
+        stats = self.tag_stats.get(key)
+        if stats is None:
+            stats = self.tag_stats[key] = ClusterStats(tuple(self.windows), retention_secs=self.retention_secs,
+                max_tags=0)
+        return stats
+
+    def for_tags(self, tags):
+        """Returns the ClusterStats for a dict of tags or tag key, or None
+        if nothing has been reported with those tags"""
+
+        return self.tag_stats.get(tag_key(tags))
+
+    def update_boot_report(self, instance_id, marks, persist=True):
+        """Merges a dict of boot marks for an instance, recording the
+        duration of each phase they complete. Marks already known for
+        the instance are kept, so repeated reports are harmless"""
+
+        if persist and self.store is not None:
+            self.store.append_boot_marks(instance_id, marks)
+        known = self.boot_marks.setdefault(instance_id, {})
+        new_marks = set(mark for mark in marks if mark not in known)
+        for mark in new_marks:
+            known[mark] = marks[mark]
+
+        for phase, start, end in BOOT_PHASES:
+            if (start in new_marks or end in new_marks) and start in known and end in known:
+                self.boot_phases[phase].record(known[end] - known[start])
+
+    def boot_latency(self, percentile, phase="total"):
+        """Returns the duration of a boot phase at the given percentile
+        across the fleet, or None if no instance has completed it"""
+
+        assert phase in self.boot_phases, "Unknown boot phase %s" % phase
+        return self.boot_phases[phase].percentile(percentile)
+
+    def boot_report(self):
+        """Returns the count and p50, p90 and max duration of each boot phase"""
+
+        report = {}
+        for phase, histogram in self.boot_phases.iteritems():
+            report[phase] = {
+                "count": histogram.count,
+                "p50": histogram.percentile(50),
+                "p90": histogram.percentile(90),
+                "max": histogram.percentile(100)
+            }
+        return report
+
+    def window(self, window_secs):
+        """Returns the TrailingWindow tracking the last window_secs seconds"""
+
+        assert window_secs in self.windows, "No trailing window of %s seconds" % window_secs
+        return self.windows[window_secs]
 
     def get_period(self, min_time, max_time):
         """Returns the set of InstanceStats objects which have data for the
-        requested period"""
+        requested period, ie. an interval at least partly within it"""
 
         assert min_time <= max_time, "min_time cannot be greater than max_time"
-        return [i for i in self.instance_stats.values() if i.get_period(min_time, max_time)]
+        return [i for i in self.instance_stats.values() if i.has_period(min_time, max_time)]
 
     def success_rate(self, min_time, max_time):
-        """Returns the mean success rate of the instances
-        for requests made over since last_seconds"""
+        """Returns the mean of the instances' success rates over the
+        period, counted as for InstanceStats.success_rate"""
 
-        stats = [i.success_rate(min_time, max_time) for i in self.get_period(min_time, max_time)]
+        assert min_time <= max_time, "min_time cannot be greater than max_time"
+        stats = []
+        for i in self.instance_stats.itervalues():
+            requests = i.request_count(min_time, max_time)
+            # Instances that made no requests in the period have no success rate
+            if requests:
+                stats.append(i.success_count(min_time, max_time) / float(requests))
         if not stats:
             return 0
         return sum(stats) / len(stats)
 
     def request_count(self, min_time, max_time):
-        return sum(i.request_count(min_time, max_time) for i in self.get_period(min_time, max_time))
+        assert min_time <= max_time, "min_time cannot be greater than max_time"
+        return sum(i.request_count(min_time, max_time) for i in self.instance_stats.itervalues())
+
+    def instance_seconds(self, min_time, max_time):
+        """Returns the total length of the intervals reported in the period,
+        summed over instances"""
+
+        assert min_time <= max_time, "min_time cannot be greater than max_time"
+        return sum(i.instance_seconds(min_time, max_time) for i in self.instance_stats.itervalues())
 
     def instance_count(self, min_time, max_time):
         """Returns the number of instances that reported stats between min_time
-        and max_time"""
-        
-        return len(self.get_period(min_time, max_time))
+        and max_time, including those whose intervals lie only partly within
+        it"""
+
+        assert min_time <= max_time, "min_time cannot be greater than max_time"
+        return sum(1 for i in self.instance_stats.itervalues() if i.has_period(min_time, max_time))
+
+    def latency_histogram(self, min_time, max_time):
+        """Returns the cluster-wide LatencyHistogram for the period, from
+        the intervals lying entirely within it"""
+
+        assert min_time <= max_time, "min_time cannot be greater than max_time"
+        merged = LatencyHistogram()
+        for stats in self.instance_stats.itervalues():
+            stats.latency_histogram(min_time, max_time, merged)
+        return merged
+
+    def latency_percentile(self, percentile, min_time, max_time):
+        """Returns the latency in seconds at the given percentile across the
+        cluster for the period, or None if no latencies were reported"""
+
+        return self.latency_histogram(min_time, max_time).percentile(percentile)
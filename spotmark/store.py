@@ -0,0 +1,200 @@
+import json
+import sqlite3
+import threading
+
+from histogram import LatencyHistogram
+
+# (age, resolution) pairs: intervals that ended more than age seconds ago
+# are merged into rollups of resolution seconds
+DEFAULT_ROLLUPS = ((3600, 60), (6 * 3600, 600))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS intervals (
+    instance_id TEXT NOT NULL,
+    start_time REAL NOT NULL,
+    end_time REAL NOT NULL,
+    successes INTEGER NOT NULL,
+    failures INTEGER NOT NULL,
+    latency_histogram TEXT,
+    -- 0 for intervals as reported, otherwise the rollup's resolution
+    resolution INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS intervals_start_time ON intervals (start_time);
+CREATE INDEX IF NOT EXISTS intervals_resolution ON intervals (resolution, end_time);
+CREATE TABLE IF NOT EXISTS boot_marks (
+    instance_id TEXT NOT NULL,
+    mark TEXT NOT NULL,
+    time REAL NOT NULL,
+    PRIMARY KEY (instance_id, mark)
+);
+"""
+
+def encode_histogram(histogram):
+    if histogram is None:
+        return None
+    return json.dumps(histogram.to_dict(), separators=(",", ":"))
+
+def decode_histogram(data):
+    if data is None:
+        return None
+    return LatencyHistogram.from_dict(json.loads(data))
+
+
+class StatsStore(object):
+    """Persists the intervals and boot marks given to a ClusterStats in
+    a SQLite file, so that a restarted controller can replay its history
+    and a finished run can be analysed offline.
+
+    Intervals are appended as reported. downsample() merges old intervals
+    into per-instance rollups, as set by rollups, so that the file stays a
+    manageable size over long runs"""
+
+    def __init__(self, path, rollups=DEFAULT_ROLLUPS):
+        self.path = path
+        self.rollups = sorted(rollups)
+        # Updates are applied on the control loop's thread, but the store
+        # may be read, eg. for an export, from others
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+    def append_many(self, updates):
+        """Appends (instance_id, successes, failures, start_time, end_time,
+        latency_histogram) updates, as for ClusterStats.update_many"""
+
+        rows = [(str(instance_id), start_time, end_time, successes, failures, encode_histogram(histogram))
+            for instance_id, successes, failures, start_time, end_time, histogram in updates]
+        with self.lock:
+            with self.connection:
+                self.connection.executemany(
+                    "INSERT INTO intervals (instance_id, start_time, end_time, successes, failures, "
+                    "latency_histogram) VALUES (?, ?, ?, ?, ?, ?)", rows
+                )
+
+    def append(self, instance_id, successes, failures, start_time, end_time, latency_histogram=None):
+        self.append_many([(instance_id, successes, failures, start_time, end_time, latency_histogram)])
+
+    def append_boot_marks(self, instance_id, marks):
+        """Stores boot marks, keeping the first time seen for each"""
+
+        with self.lock:
+            with self.connection:
+                self.connection.executemany(
+                    "INSERT OR IGNORE INTO boot_marks (instance_id, mark, time) VALUES (?, ?, ?)",
+                    [(str(instance_id), mark, timestamp) for mark, timestamp in marks.iteritems()]
+                )
+
+    def intervals(self, min_time=None, max_time=None, batch_size=10000):
+        """Yields the stored (instance_id, successes, failures, start_time,
+        end_time, latency_histogram) updates in start time order, reading
+        batch_size rows at a time"""
+
+        query = ("SELECT instance_id, successes, failures, start_time, end_time, latency_histogram "
+            "FROM intervals WHERE start_time >= ? AND end_time <= ? ORDER BY start_time")
+        cursor = self.connection.cursor()
+        with self.lock:
+            cursor.execute(query, (
+                float("-inf") if min_time is None else min_time,
+                float("inf") if max_time is None else max_time
+            ))
+        while 1:
+            with self.lock:
+                rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            for instance_id, successes, failures, start_time, end_time, histogram in rows:
+                yield instance_id, successes, failures, start_time, end_time, decode_histogram(histogram)
+
+    def boot_marks(self):
+        """Returns {instance_id: {mark: timestamp}}"""
+
+        marks = {}
+        with self.lock:
+            rows = self.connection.execute("SELECT instance_id, mark, time FROM boot_marks").fetchall()
+        for instance_id, mark, timestamp in rows:
+            marks.setdefault(instance_id, {})[mark] = timestamp
+        return marks
+
+    def replay(self, cluster_stats, min_time=None, batch_size=10000):
+        """Loads the stored history into cluster_stats, without storing it
+        again, returning the number of intervals replayed. Set min_time to
+        skip intervals that cluster_stats would prune anyway"""
+
+        for instance_id, marks in self.boot_marks().iteritems():
+            cluster_stats.update_boot_report(instance_id, marks, persist=False)
+
+        count, updates = 0, []
+        for update in self.intervals(min_time, batch_size=batch_size):
+            updates.append(update)
+            if len(updates) == batch_size:
+                cluster_stats.update_many(updates, persist=False)
+                count += len(updates)
+                updates = []
+        cluster_stats.update_many(updates, persist=False)
+        return count + len(updates)
+
+    def downsample(self, now):
+        """Merges intervals older than each rollup's age into rollups of
+        its resolution, returning the number of rows removed"""
+
+        removed = 0
+        for age, resolution in self.rollups:
+            removed += self._rollup(now - age, resolution)
+        return removed
+
+    def _write_rollup(self, instance_id, resolution, rollup):
+        """Replaces a bucket's rows with their rollup, returning the number
+        of rows removed"""
+
+        successes, failures, start_time, end_time, histogram, rowids = rollup
+        if len(rowids) == 1:
+            # Nothing to merge with, but mark it as done
+            self.connection.execute("UPDATE intervals SET resolution = ? WHERE rowid = ?",
+                (resolution, rowids[0]))
+            return 0
+        self.connection.executemany("DELETE FROM intervals WHERE rowid = ?",
+            [(rowid,) for rowid in rowids])
+        self.connection.execute(
+            "INSERT INTO intervals (instance_id, start_time, end_time, successes, failures, "
+            "latency_histogram, resolution) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (instance_id, start_time, end_time, successes, failures,
+             encode_histogram(histogram), resolution)
+        )
+        return len(rowids) - 1
+
+    def _rollup(self, before_time, resolution):
+        removed = 0
+        with self.lock:
+            with self.connection:
+                # Rows arrive grouped by instance in start time order, so a
+                # bucket is complete, and written out, once the next starts.
+                # Only one bucket is held in memory at a time
+                rows = self.connection.execute(
+                    "SELECT rowid, instance_id, successes, failures, start_time, end_time, latency_histogram "
+                    "FROM intervals WHERE resolution < ? AND end_time < ? ORDER BY instance_id, start_time",
+                    (resolution, before_time)
+                )
+                # [successes, failures, start_time, end_time, histogram, rowids]
+                key, rollup = None, None
+                for rowid, instance_id, successes, failures, start_time, end_time, histogram in rows:
+                    row_key = (instance_id, int(start_time // resolution))
+                    if row_key != key:
+                        if rollup is not None:
+                            removed += self._write_rollup(key[0], resolution, rollup)
+                        key, rollup = row_key, [0, 0, start_time, end_time, None, []]
+                    rollup[0] += successes
+                    rollup[1] += failures
+                    rollup[3] = max(rollup[3], end_time)
+                    if histogram is not None:
+                        histogram = decode_histogram(histogram)
+                        rollup[4] = histogram if rollup[4] is None else rollup[4].merge(histogram)
+                    rollup[5].append(rowid)
+                if rollup is not None:
+                    removed += self._write_rollup(key[0], resolution, rollup)
+        return removed
@@ -0,0 +1,152 @@
+"""Finds instances doing markedly worse than the rest of the fleet - eg.
+on a bad host or next to a noisy neighbour - so that they can be replaced.
+
+Each instance's throughput and success rate over a trailing window is
+scored against the fleet's median, scaled by the median absolute
+deviation, so that the stragglers themselves don't drag the baseline
+down the way they would a mean and standard deviation"""
+
+from collections import namedtuple
+import time
+
+straggler_tuple = namedtuple("straggler",
+    "instance_id requests_per_second success_rate throughput_score success_score")
+
+# Scales the MAD to match the standard deviation of normally distributed
+# values, so that scores read like z-scores
+MAD_SCALE = 1.4826
+
+def median(values):
+    ordered = sorted(values)
+    middle = len(ordered) // 2
+    if len(ordered) % 2:
+        return ordered[middle]
+    return (ordered[middle - 1] + ordered[middle]) / 2.0
+
+def robust_scores(values, min_relative_scale=0.02):
+    """Returns the deviation of each value from the median, in scaled
+    median absolute deviations. Where more than half the values are
+    equal the MAD is 0, so the mean absolute deviation is used instead.
+
+    The scale is at least min_relative_scale of the median, so that a
+    fleet that barely varies doesn't turn a tiny difference - eg. one
+    failure in a thousand - into a huge score. If every value is 0 all
+    scores are 0"""
+
+    centre = median(values)
+    deviations = [abs(value - centre) for value in values]
+    scale = median(deviations) * MAD_SCALE
+    if not scale:
+        # 1.2533 is sqrt(pi / 2), the same correction for the mean
+        scale = sum(deviations) / len(deviations) * 1.2533
+    scale = max(scale, abs(centre) * min_relative_scale)
+    if not scale:
+        return [0.0] * len(values)
+    return [(value - centre) / scale for value in values]
+
+
+class StragglerDetector(object):
+    """Flags instances whose throughput or success rate over the last
+    window_secs is more than threshold robust deviations below the
+    fleet's, and at least min_shortfall below the fleet's median as a
+    fraction of it, so that statistically clear but immaterial
+    differences aren't worth an instance replacement.
+
+    Only instances that reported for at least min_coverage of the window
+    are scored, so that instances still warming up aren't mistaken for
+    stragglers, and nothing is flagged until min_instances can be
+    compared"""
+
+    def __init__(self, cluster_stats, window_secs=300, threshold=3.5, min_instances=5, min_coverage=0.5,
+                 min_shortfall=0.1):
+        self.cluster_stats = cluster_stats
+        self.window_secs = window_secs
+        self.threshold = threshold
+        self.min_shortfall = min_shortfall
+        self.min_instances = min_instances
+        self.min_coverage = min_coverage
+        # Source of the current time, replaceable for simulation
+        self.clock = time.time
+
+    def instance_metrics(self, now=None):
+        """Returns (instance_ids, requests per second, success rates) for
+        the instances scored over the window ending at now"""
+
+        if now is None:
+            now = self.clock()
+        min_time = now - self.window_secs
+        instance_ids, throughputs, success_rates = [], [], []
+        for instance_id, stats in self.cluster_stats.instance_stats.iteritems():
+            seconds = stats.instance_seconds(min_time, now)
+            if seconds < self.window_secs * self.min_coverage:
+                continue
+            requests = stats.request_count(min_time, now)
+            instance_ids.append(instance_id)
+            throughputs.append(requests / float(seconds))
+            success_rates.append(stats.success_count(min_time, now) / float(requests) if requests else 0.0)
+        return instance_ids, throughputs, success_rates
+
+    def find_stragglers(self, now=None):
+        """Returns a straggler_tuple for each flagged instance, worst first"""
+
+        instance_ids, throughputs, success_rates = self.instance_metrics(now)
+        if len(instance_ids) < self.min_instances:
+            return []
+
+        def lagging(values, scores):
+            cutoff = median(values) * (1 - self.min_shortfall)
+            return [score <= -self.threshold and value <= cutoff for value, score in zip(values, scores)]
+
+        throughput_scores, success_scores = robust_scores(throughputs), robust_scores(success_rates)
+        stragglers = []
+        scored = zip(instance_ids, throughputs, success_rates, throughput_scores, success_scores,
+                     lagging(throughputs, throughput_scores), lagging(success_rates, success_scores))
+        for (instance_id, throughput, success_rate, throughput_score, success_score,
+                slow, failing) in scored:
+            if slow or failing:
+                stragglers.append(straggler_tuple(
+                    instance_id, throughput, success_rate, throughput_score, success_score
+                ))
+        return sorted(stragglers, key=lambda s: min(s.throughput_score, s.success_score))
+
+
+class StragglerReplacer(object):
+    """Terminates the stragglers a StragglerDetector finds and launches
+    as many replacements, through a launcher such as a FleetLauncher or
+    SpotInstanceLauncher.
+
+    At most max_fraction of the fleet (and at least one instance) is
+    replaced at a time, and after a replacement nothing more is done for
+    cooldown_secs, so that the fleet's baseline can settle with the
+    replacements in it"""
+
+    def __init__(self, detector, launcher, max_fraction=0.1, cooldown_secs=600):
+        self.detector = detector
+        self.launcher = launcher
+        self.max_fraction = max_fraction
+        self.cooldown_secs = cooldown_secs
+        self.last_replacement_time = None
+        self.replaced = []
+
+    def replace(self, now=None):
+        """Replaces the worst stragglers, returning their instance_ids"""
+
+        if now is None:
+            now = self.detector.clock()
+        if self.last_replacement_time is not None and now - self.last_replacement_time < self.cooldown_secs:
+            return []
+
+        # Instances launched elsewhere can't be terminated by this launcher
+        owned = self.launcher.instance_ids
+        stragglers = [s.instance_id for s in self.detector.find_stragglers(now) if s.instance_id in owned]
+        limit = max(int(len(owned) * self.max_fraction), 1)
+        instance_ids = stragglers[:limit]
+        if not instance_ids:
+            return []
+
+        print "Replacing stragglers:", instance_ids
+        self.launcher.terminate(instance_ids=instance_ids)
+        self.launcher.launch(len(instance_ids))
+        self.last_replacement_time = now
+        self.replaced.extend(instance_ids)
+        return instance_ids
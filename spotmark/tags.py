@@ -0,0 +1,150 @@
+"""Tags split a benchmark's counts and latencies by dimensions such as
+endpoint or status class, eg. {"endpoint": "/search", "status": "2xx"}.
+
+A tag set travels as a canonical key string, "endpoint=/search,status=2xx".
+Each process interns the keys it sees in a TagRegistry, so that per-tag
+totals live in lists indexed by small integer ids, and caps how many it
+tracks: tag sets beyond max_tags are counted together under OVERFLOW_TAG,
+which keeps memory and update sizes bounded whatever the benchmark sends"""
+
+from histogram import LatencyHistogram
+
+DEFAULT_MAX_TAGS = 64
+OVERFLOW_TAG = "__overflow__"
+OVERFLOW_ID = 0
+
+def tag_key(tags):
+    """Returns the canonical key for a dict of tags, or a key given as is.
+    Returns None for no tags"""
+
+    if not tags:
+        return None
+    if isinstance(tags, basestring):
+        return tags
+    return ",".join("%s=%s" % (name, tags[name]) for name in sorted(tags))
+
+
+class TagRegistry(object):
+    """Interns tag keys as integer ids, which are only meaningful within
+    the process that assigned them"""
+
+    def __init__(self, max_tags=DEFAULT_MAX_TAGS):
+        self.max_tags = max_tags
+        self.keys = [OVERFLOW_TAG]
+        self.ids = {OVERFLOW_TAG: OVERFLOW_ID}
+        # Number of times a new tag set was turned away by the cap
+        self.overflow_count = 0
+
+    def __len__(self):
+        return len(self.keys)
+
+    def intern(self, tags):
+        """Returns the id for a tag set (or an id already returned by this
+        registry), OVERFLOW_ID if max_tags tag sets are already known, or
+        None for no tags"""
+
+        if isinstance(tags, (int, long)):
+            return tags
+        key = tag_key(tags)
+        if key is None:
+            return None
+        tag_id = self.ids.get(key)
+        if tag_id is None:
+            if len(self.keys) > self.max_tags:
+                self.overflow_count += 1
+                return OVERFLOW_ID
+            tag_id = self.ids[key] = len(self.keys)
+            self.keys.append(key)
+        return tag_id
+
+    def key(self, tag_id):
+        return self.keys[tag_id]
+
+
+class TaggedTotals(object):
+    """Success and failure counts and a latency histogram per tag set"""
+
+    def __init__(self, max_tags=DEFAULT_MAX_TAGS):
+        self.registry = TagRegistry(max_tags)
+        # Indexed by tag id; histograms are created when first needed
+        self.success_counts, self.failure_counts, self.histograms = [], [], []
+
+    def __nonzero__(self):
+        return any(self.success_counts) or any(self.failure_counts)
+
+    def _grow(self, tag_id):
+        missing = tag_id + 1 - len(self.success_counts)
+        self.success_counts.extend([0] * missing)
+        self.failure_counts.extend([0] * missing)
+        self.histograms.extend([None] * missing)
+
+    def _histogram(self, tag_id):
+        histogram = self.histograms[tag_id]
+        if histogram is None:
+            histogram = self.histograms[tag_id] = LatencyHistogram()
+        return histogram
+
+    def record(self, tags, succeeded, latency=None):
+        """Counts one request, for emitters recording as they go"""
+
+        tag_id = self.registry.intern(tags)
+        if tag_id is None:
+            return
+        if tag_id >= len(self.success_counts):
+            self._grow(tag_id)
+        if succeeded:
+            self.success_counts[tag_id] += 1
+        else:
+            self.failure_counts[tag_id] += 1
+        if latency is not None:
+            self._histogram(tag_id).record(latency)
+
+    def add(self, tags, success_count=0, failure_count=0, latencies=(), latency_histogram=None):
+        tag_id = self.registry.intern(tags)
+        if tag_id is None:
+            return
+        if tag_id >= len(self.success_counts):
+            self._grow(tag_id)
+        self.success_counts[tag_id] += success_count
+        self.failure_counts[tag_id] += failure_count
+        if len(latencies):
+            self._histogram(tag_id).record_many(latencies)
+        if latency_histogram is not None:
+            self._histogram(tag_id).merge(latency_histogram)
+
+    def to_dict(self):
+        """Returns {tag key: {"success_count": ..., "failure_count": ...,
+        "latency_histogram": ...}} for the tag sets with anything recorded,
+        as carried by the "tags" of updates"""
+
+        totals = {}
+        for tag_id, histogram in enumerate(self.histograms):
+            successes, failures = self.success_counts[tag_id], self.failure_counts[tag_id]
+            if not (successes or failures):
+                continue
+            totals[self.registry.key(tag_id)] = {
+                "success_count": successes,
+                "failure_count": failures,
+                "latency_histogram": histogram.to_dict() if histogram is not None else None
+            }
+        return totals
+
+    def merge_dict(self, totals):
+        """Adds totals in the form returned by to_dict"""
+
+        for key, tag_totals in totals.iteritems():
+            histogram = tag_totals.get("latency_histogram")
+            self.add(
+                key, tag_totals.get("success_count", 0), tag_totals.get("failure_count", 0),
+                latency_histogram=LatencyHistogram.from_dict(histogram) if histogram else None
+            )
+
+    def reset(self):
+        """Zeroes the totals, keeping the interned ids"""
+
+        count = len(self.success_counts)
+        self.success_counts = [0] * count
+        self.failure_counts = [0] * count
+        for histogram in self.histograms:
+            if histogram is not None:
+                histogram.reset()
@@ -0,0 +1,125 @@
+"""Transports carry the messages an SQSAccumulator publishes to whatever
+feeds ClusterStats.
+
+Each transport sends bodies that accumulator.decode_body can read: single
+JSON {"instance_id": ..., "content": ...} messages through send(), and
+the encoded batches built by BatchingSQSAccumulator through send_batch()"""
+
+import boto
+import zmq
+
+from constants import SQS_QUEUE_NAME
+
+class Transport(object):
+
+    def send(self, body):
+        raise NotImplementedError("Method should be implemented by sub-classes")
+
+    def send_batch(self, bodies):
+        for body in bodies:
+            self.send(body)
+
+
+class SQSTransport(Transport):
+    """Writes messages to an SQS queue, which SQSConsumer reads.
+
+    Batch entries that SQS fails through no fault of the sender are
+    retried once; entries that still fail are counted in failed_count"""
+
+    def __init__(self, queue_name=SQS_QUEUE_NAME):
+        self.queue_name = queue_name
+        self._queue = None
+        self.failed_count = 0
+
+    @property
+    def queue(self):
+        """The SQS queue, connected to on first use so that transports
+        that are only a fallback don't need AWS access until used"""
+
+        if self._queue is None:
+            self._queue = boto.connect_sqs().get_queue(self.queue_name)
+        return self._queue
+
+    def send(self, body):
+        self.queue.write(self.queue.new_message(body=body))
+
+    def send_batch(self, bodies):
+        entries = [(str(i), body, 0) for i, body in enumerate(bodies)]
+        errors = self.queue.write_batch(entries).errors
+        retry = [entries[int(error["id"])] for error in errors if error.get("sender_fault") != "true"]
+        if retry:
+            errors = [error for error in errors if error.get("sender_fault") == "true"]
+            errors.extend(self.queue.write_batch(retry).errors)
+        if errors:
+            self.failed_count += len(errors)
+            print "Failed to publish batch entries:", errors
+
+
+class ZMQTransport(Transport):
+    """Pushes messages over ZMQ, to a ZMQConsumer on the controller or to
+    an Aggregator.
+
+    Messages are only queued for a connected peer, so if nothing is
+    listening a send times out after send_timeout_ms. It's then passed
+    to the fallback transport, if any, or dropped and counted. The
+    socket is created on first use, so that it belongs to the thread
+    doing the sending"""
+
+    def __init__(self, zmq_uri, fallback=None, send_timeout_ms=100):
+        self.zmq_uri = zmq_uri
+        self.fallback = fallback
+        self.send_timeout_ms = send_timeout_ms
+        self.socket = None
+        self.sent_count, self.fallback_count, self.dropped_count = 0, 0, 0
+
+    def connect(self):
+        self.socket = zmq.Context.instance().socket(zmq.PUSH)
+        self.socket.setsockopt(zmq.IMMEDIATE, 1)
+        self.socket.setsockopt(zmq.SNDTIMEO, self.send_timeout_ms)
+        self.socket.connect(self.zmq_uri)
+
+    def close(self, linger_ms=1000):
+        if self.socket is not None:
+            self.socket.close(linger=linger_ms)
+            self.socket = None
+
+    def _send(self, body, batched):
+        if self.socket is None:
+            self.connect()
+        try:
+            self.socket.send(body)
+        except zmq.Again:
+            if self.fallback is None:
+                self.dropped_count += 1
+                print "No ZMQ peer at %s, dropped message" % self.zmq_uri
+            elif batched:
+                self.fallback_count += 1
+                self.fallback.send_batch([body])
+            else:
+                self.fallback_count += 1
+                self.fallback.send(body)
+        else:
+            self.sent_count += 1
+
+    def send(self, body):
+        self._send(body, False)
+
+    def send_batch(self, bodies):
+        for body in bodies:
+            self._send(body, True)
+
+
+class InProcessTransport(Transport):
+    """Hands bodies straight to handler, eg. an SQSConsumer's
+    handle_body, or keeps them in bodies if there's no handler. For
+    tests, and for simulating a fleet in a single process"""
+
+    def __init__(self, handler=None):
+        self.handler = handler
+        self.bodies = []
+
+    def send(self, body):
+        if self.handler is None:
+            self.bodies.append(body)
+        else:
+            self.handler(body)
@@ -0,0 +1,80 @@
+"""Compact binary records for the emitter -> receiver ZMQ path.
+
+A record is a fixed 12 byte header followed by its latencies, as
+little-endian 32-bit floats in seconds, and then an optional UTF-8 tag
+key (see tags.py):
+
+    magic (B) | success count (I) | failure count (I) | latency count (H) | tag length (B)
+
+Records may be sent one per frame or concatenated within a frame. JSON
+messages start with "{", so the two formats can share a socket"""
+
+from array import array
+from collections import namedtuple
+import struct
+import sys
+
+from tags import tag_key
+
+MAGIC = 0xB7
+HEADER = struct.Struct("<BIIHB")
+MAX_LATENCIES = 0xFFFF
+MAX_TAG_BYTES = 0xFF
+
+record_batch = namedtuple("record_batch",
+    "success_count failure_count latencies tag_counts tag_latencies")
+
+def pack_record(success_count=0, failure_count=0, latencies=(), tag=None):
+    latencies = array('f', latencies)
+    assert len(latencies) <= MAX_LATENCIES, "Too many latencies for one record"
+    if sys.byteorder != "little":
+        latencies.byteswap()
+
+    tag = tag_key(tag)
+    tag = tag.encode("utf-8") if tag else ""
+    assert len(tag) <= MAX_TAG_BYTES, "Tag is too long"
+
+    header = HEADER.pack(MAGIC, success_count, failure_count, len(latencies), len(tag))
+    return header + latencies.tostring() + tag
+
+def is_record(frame):
+    return frame[:1] == chr(MAGIC)
+
+def unpack_records(frames):
+    """Decodes all the records in frames, returning a record_batch of the
+    total counts, all latencies, and the [successes, failures] and
+    latencies per tag"""
+
+    buf = "".join(frames)
+    unpack_from, header_size = HEADER.unpack_from, HEADER.size
+    success_count, failure_count = 0, 0
+    latencies = array('f')
+    tag_counts, tag_latencies = {}, {}
+
+    offset, end = 0, len(buf)
+    while offset < end:
+        magic, successes, failures, num_latencies, tag_length = unpack_from(buf, offset)
+        assert magic == MAGIC, "Not a binary record at offset %s" % offset
+        offset += header_size
+
+        success_count += successes
+        failure_count += failures
+        latency_bytes = ""
+        if num_latencies:
+            latencies_end = offset + 4 * num_latencies
+            latency_bytes = buf[offset:latencies_end]
+            latencies.fromstring(latency_bytes)
+            offset = latencies_end
+        if tag_length:
+            tag = buf[offset:offset + tag_length].decode("utf-8")
+            offset += tag_length
+            counts = tag_counts.setdefault(tag, [0, 0])
+            counts[0] += successes
+            counts[1] += failures
+            if latency_bytes:
+                tag_latencies.setdefault(tag, array('f')).fromstring(latency_bytes)
+
+    if sys.byteorder != "little":
+        for values in [latencies] + tag_latencies.values():
+            values.byteswap()
+    return record_batch(success_count, failure_count, latencies, tag_counts, tag_latencies)
@@ -7,23 +7,68 @@ set -xe
 # See: http://alestic.com/2010/12/ec2-user-data-output
 exec > >(tee /var/log/user-data.log|logger -t user-data -s 2>/dev/console) 2>&1
 
-apt-get update
-
-# python-dev is required for pyzmq to build
-apt-get install -y git python-pip python-virtualenv python-dev
+# Timestamp each boot phase; the client reports them along with its own
+export SPOTMARK_BOOT_TIMES=/var/log/spotmark-boot-times
+mark_boot_phase() {
+    echo "$1 $(date +%s.%N)" >> $SPOTMARK_BOOT_TIMES
+}
+echo "os_boot $(( $(date +%s) - $(cut -d. -f1 /proc/uptime) ))" >> $SPOTMARK_BOOT_TIMES
+mark_boot_phase user_data_start
 
 # Create boto config file (required for AWS access)
 echo "[Credentials]
 aws_access_key_id = {{ spotmark.aws_access_key }}
 aws_secret_access_key = {{ spotmark.aws_secret_key }}" > ~/.boto
 
+# Exported so that the client knows it's on EC2, eg. to measure its
+# clock offset against Amazon Time Sync
+export SPOTMARK_ENVIRONMENT='AWS'
+{% if spotmark.aggregator_uri %}
+export SPOTMARK_AGGREGATOR_URI="{{ spotmark.aggregator_uri }}"
+{% endif %}
+{% if spotmark.controller_uri %}
+export SPOTMARK_CONTROLLER_URI="{{ spotmark.controller_uri }}"
+{% endif %}
+{% if spotmark.run_aggregator %}
+export SPOTMARK_RUN_AGGREGATOR=1
+{% endif %}
+
+{% block install %}
+{% if spotmark.prebaked_dir %}
+# The AMI already has the repo and its virtualenv installed
+cd {{ spotmark.prebaked_dir }}
+{% elif spotmark.environment_url %}
+# Unpack a virtualenv built on the same image, with the repo in it.
+# Virtualenvs aren't relocatable, so it must have been built in {{ spotmark.install_dir }}
+mkdir -p {{ spotmark.install_dir }}
+curl -sSfL "{{ spotmark.environment_url }}" | tar -xz -C {{ spotmark.install_dir }}
+cd {{ spotmark.install_dir }}
+{% else %}
+apt-get update
+{% if spotmark.wheelhouse_url %}
+# Dependencies come pre-built from the wheelhouse, so nothing is compiled
+apt-get install -y git python-pip python-virtualenv
+{% else %}
+# python-dev is required for pyzmq to build
+apt-get install -y git python-pip python-virtualenv python-dev
+{% endif %}
+
 # Setup the Spotmark repo
-SPOTMARK_ENVIRONMENT='AWS'
-git clone git://github.com/craigglennie/spotmark.git
-virtualenv spotmark
-cd spotmark
+git clone git://github.com/craigglennie/spotmark.git {{ spotmark.install_dir }}
+virtualenv {{ spotmark.install_dir }}
+cd {{ spotmark.install_dir }}
 source bin/activate
+{% if spotmark.wheelhouse_url %}
+mkdir -p wheelhouse
+curl -sSfL "{{ spotmark.wheelhouse_url }}" | tar -xz -C wheelhouse
+pip install --no-index --find-links=wheelhouse -r requirements.txt
+{% else %}
 pip install -r requirements.txt
+{% endif %}
+{% endif %}
+{% endblock %}
+mark_boot_phase install_end
+
 source bin/activate
 ./spotmark/client &
 
@@ -1,10 +1,18 @@
+import base64
 import json
+import math
+import os
+import threading
+import time
 import unittest
+import zlib
 
 import boto
+from boto.sqs.message import Message, RawMessage
 import moto
 
-from spotmark import accumulator, constants
+from spotmark import accumulator, constants, wire
+from spotmark.histogram import LatencyHistogram
 
 class TestSQSAccumulator(unittest.TestCase):
 
@@ -43,6 +51,68 @@ class TestSQSAccumulator(unittest.TestCase):
         self.assertEqual(self.accumulator.success_count, 40)
         self.assertEqual(self.accumulator.failure_count, 20)
 
+    def test_process_messages_latencies(self):
+        self.accumulator.process_messages([
+            json.dumps({"success_count": 2, "latencies": [0.1, 0.2]}),
+            json.dumps({"failure_count": 1, "latencies": [0.3]}),
+            json.dumps({"success_count": 1}),
+        ])
+        histogram = self.accumulator.latency_histogram
+        self.assertEqual(histogram.count, 3)
+        self.assertAlmostEqual(histogram.percentile(100), 0.3, delta=0.3 / 64)
+
+    def test_process_messages_binary(self):
+        self.accumulator.process_messages([
+            wire.pack_record(2, 1, [0.1, 0.2]),
+            json.dumps({"success_count": 1, "latencies": [0.3]}),
+            wire.pack_record(0, 1, tag="/search"),
+        ])
+        self.assertEqual(self.accumulator.success_count, 3)
+        self.assertEqual(self.accumulator.failure_count, 2)
+        self.assertEqual(self.accumulator.latency_histogram.count, 3)
+
+    def test_process_messages_tagged(self):
+        histogram = LatencyHistogram()
+        histogram.record(0.3)
+        self.accumulator.process_messages([
+            wire.pack_record(2, 1, [0.1, 0.2], tag="endpoint=/search"),
+            wire.pack_record(1, 0),
+            json.dumps({"success_count": 1, "tags": {"endpoint=/search": {
+                "success_count": 1, "failure_count": 0, "latency_histogram": histogram.to_dict()
+            }}}),
+        ])
+        self.assertEqual(self.accumulator.success_count, 4)
+
+        self.accumulator.enqueue_update()
+        content = json.loads(self.accumulator.queue.read().get_body())["content"]
+        search = content["tags"]["endpoint=/search"]
+        self.assertEqual((search["success_count"], search["failure_count"]), (3, 1))
+        self.assertEqual(LatencyHistogram.from_dict(search["latency_histogram"]).count, 3)
+
+        # Untagged updates don't carry tags
+        self.accumulator.process_messages([wire.pack_record(1, 0)])
+        self.assertNotIn("tags", self.accumulator.totals())
+
+    def test_process_messages_aggregated(self):
+        histogram = LatencyHistogram()
+        histogram.record(0.1)
+        histogram.record(0.2)
+        message = json.dumps({
+            "success_count": 1,
+            "failure_count": 1,
+            "failure_kinds": {"timeout": 1},
+            "latency_histogram": histogram.to_dict()
+        })
+        self.accumulator.process_messages([message, message])
+        self.assertEqual(self.accumulator.success_count, 2)
+        self.assertEqual(self.accumulator.latency_histogram.count, 4)
+        self.assertEqual(self.accumulator.failure_kinds, {"timeout": 2})
+
+        self.accumulator.enqueue_update()
+        content = json.loads(self.accumulator.queue.read().get_body())["content"]
+        self.assertEqual(content["failure_kinds"], {"timeout": 2})
+        self.assertEqual(self.accumulator.failure_kinds, {})
+
     def test_enqueue(self):
         message = self.accumulator.queue.read()
         self.assertIsNone(message)
@@ -86,3 +156,215 @@ class TestSQSAccumulator(unittest.TestCase):
         self.assertEqual(content["interval_start"], interval_end)
         self.assertEqual(content["interval_end"], self.accumulator.last_sqs_time)
 
+    def test_enqueue_update_latency_histogram(self):
+        self.accumulator.process_messages([json.dumps({"success_count": 1, "latencies": [0.5]})])
+        self.accumulator.enqueue_update()
+
+        message = json.loads(self.accumulator.queue.read().get_body())
+        histogram = LatencyHistogram.from_dict(message["content"]["latency_histogram"])
+        self.assertEqual(histogram.count, 1)
+        self.assertAlmostEqual(histogram.percentile(50), 0.5, delta=0.5 / 64)
+        self.assertEqual(self.accumulator.latency_histogram.count, 0)
+
+
+    def test_enqueue_update_aligned(self):
+        self.accumulator.bucket_secs = 10
+        self.accumulator.clock_offset_secs = 3600
+        self.add_messages([10, 5])
+        self.accumulator.enqueue_update()
+        content = json.loads(self.accumulator.queue.read().get_body())["content"]
+        self.assertEqual(content["interval_end"] % 10, 0)
+        self.assertAlmostEqual(content["interval_end"], time.time() + 3600, delta=11)
+
+        # A second update within the same bucket is held back
+        self.add_messages([1, 0])
+        self.accumulator.enqueue_update()
+        self.assertIsNone(self.accumulator.queue.read())
+        self.assertEqual(self.accumulator.success_count, 1)
+
+    def test_enqueue_update_writer(self):
+        self.accumulator.writer = accumulator.BackgroundWriter()
+        self.add_messages([10, 5])
+        self.accumulator.enqueue_update()
+        self.accumulator.writer.join()
+
+        message = json.loads(self.accumulator.queue.read().get_body())
+        self.assertEqual(message["content"]["success_count"], 10)
+        self.assertEqual(message["content"]["writer"]["flush_count"], 0)
+        self.assertEqual(self.accumulator.writer.flush_count, 1)
+
+
+    def test_enqueue_update_backlog_full(self):
+        self.accumulator.writer = accumulator.BackgroundWriter(max_backlog=1)
+        release = threading.Event()
+        self.accumulator.writer.submit(release.wait)
+        while self.accumulator.writer.backlog:
+            time.sleep(0.01)
+        self.accumulator.writer.submit(time.sleep, 0)
+
+        self.accumulator.last_sqs_time = 100
+        self.add_messages([10, 5])
+        self.accumulator.enqueue_update()
+        # Refused, so the totals are kept for the next update
+        self.assertEqual(self.accumulator.success_count, 10)
+        self.assertEqual(self.accumulator.last_sqs_time, 100)
+
+        release.set()
+        self.accumulator.writer.join()
+        self.add_messages([3, 0])
+        self.accumulator.enqueue_update()
+        self.accumulator.writer.join()
+        message = json.loads(self.accumulator.queue.read().get_body())
+        self.assertEqual(message["content"]["success_count"], 13)
+        self.assertEqual(message["content"]["interval_start"], 100)
+
+
+class TestBackgroundWriter(unittest.TestCase):
+
+    def test_submit(self):
+        writer = accumulator.BackgroundWriter()
+        written = []
+        writer.submit(written.append, 1)
+        writer.submit(written.append, 2)
+        writer.join()
+        self.assertEqual(written, [1, 2])
+
+        metrics = writer.metrics()
+        self.assertEqual(metrics["flush_count"], 2)
+        self.assertEqual(metrics["backlog"], 0)
+        self.assertGreaterEqual(metrics["max_flush_secs"], metrics["last_flush_secs"])
+
+    def test_errors(self):
+        writer = accumulator.BackgroundWriter()
+        def fail():
+            raise IOError("SQS is down")
+        writer.submit(fail)
+        writer.join()
+        self.assertEqual(writer.error_count, 1)
+        self.assertEqual(writer.flush_count, 1)
+
+    def test_backlog(self):
+        writer = accumulator.BackgroundWriter(max_backlog=2)
+        release = threading.Event()
+        writer.submit(release.wait)
+        # Wait for the worker to pick up the blocking job
+        while writer.backlog:
+            time.sleep(0.01)
+
+        self.assertTrue(writer.submit(time.sleep, 0))
+        self.assertTrue(writer.submit(time.sleep, 0))
+        self.assertEqual(writer.backlog, 2)
+        self.assertFalse(writer.submit(time.sleep, 0))
+        self.assertEqual(writer.dropped_count, 1)
+
+        release.set()
+        writer.join()
+        self.assertEqual(writer.flush_count, 3)
+
+
+class TestBatchingSQSAccumulator(unittest.TestCase):
+
+    def setUp(self):
+        super(TestBatchingSQSAccumulator, self).setUp()
+
+        self.mock = moto.mock_sqs()
+        self.mock.start()
+        self.queue = boto.connect_sqs().create_queue("test-queue")
+        self.accumulator = accumulator.BatchingSQSAccumulator('test-queue', flush_size=3)
+        self.accumulator.queue.set_message_class(RawMessage)
+
+    def tearDown(self):
+        super(TestBatchingSQSAccumulator, self).tearDown()
+        self.mock.stop()
+
+    def read_all(self):
+        messages = []
+        while 1:
+            sqs_message = self.accumulator.queue.read()
+            if sqs_message is None:
+                return messages
+            messages.extend(accumulator.decode_body(sqs_message.get_body()))
+
+    def test_flush_size(self):
+        self.accumulator.enqueue({"status": "running"})
+        self.accumulator.enqueue({"success_count": 1})
+        self.assertEqual(self.read_all(), [])
+
+        self.accumulator.enqueue({"success_count": 2})
+        self.assertEqual(self.accumulator.pending, [])
+        messages = self.read_all()
+        self.assertEqual([m["content"] for m in messages],
+            [{"status": "running"}, {"success_count": 1}, {"success_count": 2}])
+        self.assertTrue(all(m["instance_id"] == constants.INSTANCE_ID for m in messages))
+
+    def test_max_latency(self):
+        self.accumulator.max_latency_secs = 0
+        self.accumulator.enqueue({"status": "running"})
+        self.assertEqual(len(self.read_all()), 1)
+
+    def test_flush_when_update_due(self):
+        self.accumulator.enqueue({"status": "running"})
+        self.accumulator.max_latency_secs = 0
+        self.accumulator.bucket_secs = 3600
+        self.accumulator.last_sqs_time = math.floor(time.time() / 3600 + 0.01) * 3600
+        # Nothing new to enqueue in the same bucket, but the pending
+        # message has waited long enough
+        self.accumulator.enqueue_update()
+        self.assertEqual(len(self.read_all()), 1)
+
+    def test_close(self):
+        self.accumulator.writer = accumulator.BackgroundWriter()
+        self.accumulator.enqueue({"status": "running"})
+        self.accumulator.close()
+        self.assertEqual(self.accumulator.pending, [])
+        self.assertEqual(len(self.read_all()), 1)
+
+    def test_flush_backlog_full(self):
+        writer = self.accumulator.writer = accumulator.BackgroundWriter(max_backlog=1)
+        release = threading.Event()
+        writer.submit(release.wait)
+        while writer.backlog:
+            time.sleep(0.01)
+        writer.submit(time.sleep, 0)
+
+        for i in range(3):
+            self.accumulator.enqueue({"status": i})
+        self.assertEqual(len(self.accumulator.unsent), 1)
+
+        release.set()
+        self.accumulator.close()
+        self.assertEqual(self.accumulator.unsent, [])
+        self.assertEqual([m["content"]["status"] for m in self.read_all()], [0, 1, 2])
+
+    def test_pack_oversized(self):
+        compressible = json.dumps("x" * accumulator.MAX_SQS_MESSAGE_BYTES)
+        incompressible = json.dumps(os.urandom(200 * 1024).encode("hex"))
+        batches = list(self.accumulator.pack(['"small"', compressible, incompressible, '"last"']))
+        unpacked = [message for batch in batches for body in batch
+            for message in accumulator.decode_body(body)]
+        self.assertEqual(unpacked, ["small", json.loads(compressible), "last"])
+        self.assertEqual(self.accumulator.oversized_count, 1)
+
+    def test_pack(self):
+        # Incompressible messages, so that packing has to split them
+        # across entries and batches
+        serialized = [json.dumps(os.urandom(100 * 1024).encode("hex")) for i in range(25)]
+        batches = list(self.accumulator.pack(serialized))
+        for batch in batches:
+            self.assertLessEqual(len(batch), accumulator.MAX_SQS_BATCH_ENTRIES)
+            self.assertLessEqual(sum(len(body) for body in batch), accumulator.MAX_SQS_MESSAGE_BYTES)
+
+        unpacked = [message for batch in batches for body in batch
+            for message in accumulator.decode_body(body)]
+        self.assertEqual(unpacked, [json.loads(s) for s in serialized])
+
+    def test_decode_body(self):
+        message = {"instance_id": "i-1", "content": {"status": "running"}}
+        self.assertEqual(accumulator.decode_body(json.dumps(message)), [message])
+
+        # As written by SQSAccumulator.enqueue
+        encoded = Message().encode(json.dumps(message))
+        self.assertEqual(accumulator.decode_body(encoded), [message])
+
+        compressed = base64.b64encode(zlib.compress(json.dumps([message])))
+        self.assertEqual(accumulator.decode_body(compressed), [message])
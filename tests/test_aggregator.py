@@ -0,0 +1,130 @@
+import json
+import unittest
+
+import boto
+import moto
+import zmq
+
+from spotmark import aggregator, accumulator, constants, consumer, transport
+from spotmark.histogram import LatencyHistogram
+from spotmark.stats import ClusterStats
+
+AGGREGATOR_URI = "tcp://127.0.0.1:10250"
+
+def make_update(success_count, failure_count, start_time, end_time, *latencies):
+    histogram = LatencyHistogram()
+    histogram.record_many(latencies)
+    return {
+        "success_count": success_count,
+        "failure_count": failure_count,
+        "latency_histogram": histogram.to_dict(),
+        "failure_kinds": {"timeout": failure_count} if failure_count else {},
+        "interval_start": start_time,
+        "interval_end": end_time
+    }
+
+def envelope(instance_id, content):
+    return json.dumps({"instance_id": instance_id, "content": content})
+
+class TestMergeUpdates(unittest.TestCase):
+
+    def test_merge_updates(self):
+        merged = aggregator.merge_updates(make_update(10, 1, 0, 10, 0.1), make_update(5, 2, 10, 20, 0.2, 0.3))
+        self.assertEqual(merged["success_count"], 15)
+        self.assertEqual(merged["failure_count"], 3)
+        self.assertEqual(merged["failure_kinds"], {"timeout": 3})
+        self.assertEqual((merged["interval_start"], merged["interval_end"]), (0, 20))
+        self.assertEqual(LatencyHistogram.from_dict(merged["latency_histogram"]).count, 3)
+        self.assertNotIn("tags", merged)
+
+    def test_merge_tags(self):
+        first, second = make_update(3, 0, 0, 10), make_update(2, 1, 10, 20)
+        first["tags"] = {"endpoint=/search": {"success_count": 3, "failure_count": 0, "latency_histogram": None}}
+        second["tags"] = {
+            "endpoint=/search": {"success_count": 1, "failure_count": 1, "latency_histogram": None},
+            "endpoint=/home": {"success_count": 1, "failure_count": 0, "latency_histogram": None}
+        }
+        tags = aggregator.merge_updates(first, second)["tags"]
+        self.assertEqual(tags["endpoint=/search"]["success_count"], 4)
+        self.assertEqual(tags["endpoint=/search"]["failure_count"], 1)
+        self.assertEqual(tags["endpoint=/home"]["success_count"], 1)
+
+
+class TestAggregator(unittest.TestCase):
+
+    def setUp(self):
+        self.mock = moto.mock_sqs()
+        self.mock.start()
+        boto.connect_sqs().create_queue("test-queue")
+
+        self.aggregator = aggregator.Aggregator(AGGREGATOR_URI, "test-queue")
+        self.aggregator.publisher = accumulator.BatchingSQSAccumulator("test-queue")
+        self.cluster_stats = ClusterStats()
+        self.consumer = consumer.SQSConsumer(self.cluster_stats, "test-queue", wait_time_secs=0)
+        self.queue = self.consumer.connect()
+
+    def tearDown(self):
+        self.mock.stop()
+
+    def receive_all(self):
+        received = 0
+        while 1:
+            count = self.consumer.receive(self.queue)
+            if not count:
+                break
+            received += count
+        self.consumer.apply_updates()
+        return received
+
+    def test_merge_and_publish(self):
+        self.aggregator.handle_messages([
+            envelope("i-1", {"status": "running"}),
+            envelope("i-1", make_update(10, 0, 0, 10, 0.1)),
+            envelope("i-2", make_update(4, 1, 0, 10)),
+            envelope("i-1", make_update(10, 0, 10, 20, 0.2)),
+            # Not consecutive, so kept separate
+            envelope("i-1", make_update(10, 0, 30, 40)),
+        ])
+        self.assertEqual(len(self.aggregator.pending["i-1"]), 3)
+
+        self.aggregator.flush()
+        self.assertEqual(self.aggregator.received_count, 5)
+        self.assertEqual(self.aggregator.published_count, 4)
+        self.assertEqual(self.aggregator.pending, {})
+
+        # Everything arrives in one SQS message
+        self.assertEqual(self.receive_all(), 1)
+        self.assertEqual(self.consumer.statuses, {"i-1": {"status": "running"}})
+        self.assertEqual(self.cluster_stats.request_count(0, 40), 35)
+        self.assertEqual(len(self.cluster_stats.instance_stats["i-1"]), 2)
+        self.assertEqual(self.cluster_stats.latency_histogram(0, 20).count, 2)
+
+    def test_forwarded_messages(self):
+        context = zmq.Context()
+        pull_socket = context.socket(zmq.PULL)
+        pull_socket.bind(AGGREGATOR_URI)
+        self.addCleanup(pull_socket.close, 0)
+
+        push = transport.ZMQTransport(AGGREGATOR_URI, send_timeout_ms=5000)
+        self.addCleanup(push.close, 0)
+        forwarding = accumulator.SQSAccumulator(transport=push)
+        forwarding.enqueue({"status": "running"})
+        forwarding.process_messages([json.dumps({"success_count": 3, "failure_count": 1})])
+        forwarding.enqueue_update()
+
+        # Batched messages from other clients are unpacked too
+        batching = accumulator.BatchingSQSAccumulator(transport=push)
+        batching.enqueue({"status": "batched"})
+        batching.flush()
+
+        frames = []
+        while len(frames) < 3 and pull_socket.poll(5000):
+            frames.append(pull_socket.recv())
+        self.aggregator.handle_messages(frames)
+        self.aggregator.flush()
+
+        self.receive_all()
+        self.assertEqual(self.consumer.statuses, {constants.INSTANCE_ID: {"status": "batched"}})
+        self.assertEqual(self.aggregator.received_count, 3)
+        [stats] = self.cluster_stats.instance_stats.values()
+        self.assertEqual(stats[0].requests, 4)
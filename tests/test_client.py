@@ -0,0 +1,49 @@
+import os
+import tempfile
+import unittest
+
+from spotmark import accumulator, client
+
+class MockAccumulator(accumulator.Accumulator):
+
+    def __init__(self):
+        super(MockAccumulator, self).__init__()
+        self.enqueued = []
+        self.clock_offset_secs = 0.0
+
+    def enqueue(self, message):
+        self.enqueued.append(message)
+
+class TestClient(unittest.TestCase):
+
+    def test_read_boot_marks(self):
+        handle, path = tempfile.mkstemp()
+        self.addCleanup(os.remove, path)
+        with os.fdopen(handle, "w") as boot_times:
+            boot_times.write("os_boot 1400000000\nuser_data_start 1400000020.25\n\n")
+
+        self.assertEqual(client.read_boot_marks(path), {"os_boot": 1400000000, "user_data_start": 1400000020.25})
+        self.assertEqual(client.read_boot_marks(path + ".missing"), {})
+
+    def test_first_request_reported_once(self):
+        spotmark_client = client.Client(10)
+        spotmark_client.accumulator = MockAccumulator()
+
+        spotmark_client.process_messages(['{"failure_count": 1}'])
+        self.assertEqual(spotmark_client.accumulator.enqueued, [])
+
+        spotmark_client.process_messages(['{"success_count": 1}'])
+        spotmark_client.process_messages(['{"success_count": 1}'])
+        [report] = spotmark_client.accumulator.enqueued
+        self.assertEqual(report, {"boot_report": {"first_request": spotmark_client.first_request_time}})
+
+    def test_boot_marks_on_reference_clock(self):
+        spotmark_client = client.Client(10)
+        spotmark_client.accumulator = MockAccumulator()
+        spotmark_client.accumulator.clock_offset_secs = 2.5
+
+        spotmark_client.enqueue_boot_report({"os_boot": 100, "client_start": 160})
+        spotmark_client.process_messages(['{"success_count": 1}'])
+        boot_marks, first_request = spotmark_client.accumulator.enqueued
+        self.assertEqual(boot_marks, {"boot_report": {"os_boot": 102.5, "client_start": 162.5}})
+        self.assertEqual(first_request["boot_report"]["first_request"], spotmark_client.first_request_time + 2.5)
@@ -0,0 +1,47 @@
+import socket
+import struct
+import threading
+import time
+import unittest
+
+from spotmark import clock
+
+class FakeNTPServer(threading.Thread):
+    """Answers one SNTP request with a clock offset_secs ahead"""
+
+    def __init__(self, offset_secs):
+        super(FakeNTPServer, self).__init__()
+        self.daemon = True
+        self.offset_secs = offset_secs
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(("127.0.0.1", 0))
+        self.port = self.sock.getsockname()[1]
+
+    def ntp_timestamp(self):
+        now = time.time() + self.offset_secs + clock.NTP_EPOCH_OFFSET
+        return struct.pack("!II", int(now), int((now % 1) * 2 ** 32))
+
+    def run(self):
+        request, address = self.sock.recvfrom(48)
+        received = self.ntp_timestamp()
+        response = "\x1c" + 31 * "\0" + received + self.ntp_timestamp()
+        self.sock.sendto(response, address)
+        self.sock.close()
+
+class TestClock(unittest.TestCase):
+
+    def test_ntp_offset(self):
+        server = FakeNTPServer(-120.5)
+        server.start()
+        offset, round_trip = clock.ntp_offset("127.0.0.1", server.port)
+        self.assertAlmostEqual(offset, -120.5, delta=0.05)
+        self.assertTrue(0 <= round_trip < 0.5)
+
+    def test_measure_clock_offset(self):
+        server = FakeNTPServer(30)
+        server.start()
+        self.assertAlmostEqual(clock.measure_clock_offset("127.0.0.1", samples=1, port=server.port), 30, delta=0.05)
+
+        # Unreachable servers leave the clock as it is
+        self.assertEqual(clock.measure_clock_offset("127.0.0.1", samples=1, port=server.port,
+            timeout_secs=0.05), 0)
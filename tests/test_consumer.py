@@ -0,0 +1,111 @@
+import unittest
+
+import boto
+import moto
+
+from spotmark import accumulator, consumer, constants
+from spotmark.stats import ClusterStats
+
+class TestSQSConsumer(unittest.TestCase):
+
+    def setUp(self):
+        super(TestSQSConsumer, self).setUp()
+
+        self.mock = moto.mock_sqs()
+        self.mock.start()
+        boto.connect_sqs().create_queue("test-queue")
+        self.accumulator = accumulator.SQSAccumulator("test-queue")
+        self.cluster_stats = ClusterStats()
+        self.consumer = consumer.SQSConsumer(self.cluster_stats, "test-queue", wait_time_secs=0)
+        self.queue = self.consumer.connect()
+
+    def tearDown(self):
+        super(TestSQSConsumer, self).tearDown()
+        self.mock.stop()
+
+    def publish_update(self, accumulator, success_count, failure_count, start_time, end_time):
+        accumulator.success_count = success_count
+        accumulator.failure_count = failure_count
+        accumulator.latency_histogram.record(0.5)
+        accumulator.last_sqs_time = start_time
+        accumulator.enqueue(dict(accumulator.totals(), interval_start=start_time, interval_end=end_time))
+        accumulator.reset()
+
+    def receive_all(self):
+        while self.consumer.receive(self.queue):
+            pass
+        return self.consumer.apply_updates()
+
+    def test_receive(self):
+        self.accumulator.enqueue({"status": "running"})
+        self.publish_update(self.accumulator, 10, 5, None, 100)
+        self.publish_update(self.accumulator, 20, 5, 100, 110)
+
+        self.assertEqual(self.receive_all(), 2)
+        self.assertEqual(self.consumer.statuses, {constants.INSTANCE_ID: {"status": "running"}})
+        self.assertEqual(self.cluster_stats.request_count(0, 110), 40)
+        self.assertEqual(self.cluster_stats.instance_count(100, 110), 1)
+        self.assertEqual(self.cluster_stats.latency_histogram(0, 110).count, 2)
+
+        # Everything received was deleted
+        self.assertIsNone(self.queue.read())
+
+    def test_receive_batched(self):
+        batching = accumulator.BatchingSQSAccumulator("test-queue", flush_size=100)
+        for end_time in range(10, 110, 10):
+            self.publish_update(batching, 1, 1, end_time - 10, end_time)
+        batching.flush()
+
+        self.assertEqual(self.receive_all(), 10)
+        self.assertEqual(self.cluster_stats.request_count(0, 100), 20)
+
+    def test_receive_tagged(self):
+        self.accumulator.tagged.add({"endpoint": "/search"}, 3, 1, [0.5])
+        self.publish_update(self.accumulator, 4, 1, 0, 10)
+
+        self.assertEqual(self.receive_all(), 1)
+        search = self.cluster_stats.for_tags({"endpoint": "/search"})
+        self.assertEqual(search.request_count(0, 10), 4)
+        self.assertEqual(search.latency_histogram(0, 10).count, 1)
+        self.assertEqual(self.cluster_stats.request_count(0, 10), 5)
+
+    def test_boot_report(self):
+        self.accumulator.enqueue({"boot_report": {"requested": 0, "client_start": 150}})
+        self.accumulator.enqueue({"boot_report": {"first_request": 180}})
+
+        self.assertEqual(self.receive_all(), 0)
+        self.assertEqual(self.consumer.statuses, {})
+        self.assertEqual(self.cluster_stats.boot_marks[constants.INSTANCE_ID],
+            {"requested": 0, "client_start": 150, "first_request": 180})
+        self.assertEqual(self.cluster_stats.boot_phases["total"].count, 1)
+
+    def test_duplicates(self):
+        self.publish_update(self.accumulator, 10, 5, 100, 110)
+        # The same update republished
+        self.publish_update(self.accumulator, 10, 5, 100, 110)
+
+        messages = self.queue.get_messages(num_messages=10)
+        self.consumer.handle_messages(messages)
+        # Redelivery of the same SQS message
+        self.consumer.handle_messages(messages)
+
+        self.assertEqual(self.consumer.apply_updates(), 1)
+        self.assertEqual(self.consumer.duplicate_count, 3)
+        self.assertEqual(self.cluster_stats.request_count(100, 110), 15)
+
+    def test_max_remembered(self):
+        self.consumer.max_remembered = 2
+        for key in range(3):
+            self.assertTrue(self.consumer._first_seen(key))
+        self.assertTrue(self.consumer._first_seen(0))
+        self.assertFalse(self.consumer._first_seen(2))
+
+    def test_start_stop(self):
+        self.consumer.num_receivers = 2
+        self.publish_update(self.accumulator, 10, 5, 100, 110)
+        self.consumer.start()
+        try:
+            update = self.consumer.updates.get(timeout=5)
+        finally:
+            self.consumer.stop()
+        self.assertEqual(update[:5], (constants.INSTANCE_ID, 10, 5, 100, 110))
@@ -0,0 +1,123 @@
+import unittest
+
+from spotmark import fleet, launcher
+from spotmark.stats import ClusterStats
+
+class MockLauncher(object):
+
+    def __init__(self, instance_type, bid_price):
+        self.instance_type = instance_type
+        self._bid_price = bid_price
+        self.fleet = launcher.FleetStateTracker(None)
+        self.launched = []
+        self.instance_ids = set()
+
+    @property
+    def bid_price(self):
+        if self._bid_price is None:
+            raise AssertionError("No spot price history")
+        return self._bid_price
+
+    @property
+    def instance_count(self):
+        return len(self.instance_ids)
+
+    def launch(self, num_instances, **kwargs):
+        if self.instance_type == "broken":
+            raise IOError("Capacity not available")
+        request_ids = ["%s-%d" % (self.instance_type, len(self.launched) + i) for i in range(num_instances)]
+        self.launched.extend(request_ids)
+        return request_ids
+
+    def fulfill(self, request_id):
+        instance_id = "i-" + request_id
+        self.instance_ids.add(instance_id)
+        for listener in self.fleet.listeners:
+            listener("fulfilled", request_id, instance_id)
+        return instance_id
+
+    def terminate(self, num_instances=None, instance_ids=None):
+        if num_instances:
+            instance_ids = sorted(self.instance_ids)[:num_instances]
+        self.instance_ids -= set(instance_ids)
+
+class TestFleetLauncher(unittest.TestCase):
+
+    def setUp(self):
+        self.small = MockLauncher("m1.small", 0.01)
+        self.large = MockLauncher("m1.large", 0.02)
+        self.cluster_stats = ClusterStats()
+        self.launcher = fleet.FleetLauncher([(self.small, 1), (self.large, 4)], self.cluster_stats)
+
+    def test_allocate(self):
+        # Large instances give twice the capacity per dollar
+        self.assertEqual(self.launcher.allocate(9), [3, 6])
+        self.assertEqual(self.launcher.allocate(10), [3, 7])
+        self.assertEqual(self.launcher.allocate(1), [0, 1])
+
+        self.large._bid_price = None
+        self.assertEqual(self.launcher.allocate(10), [10, 0])
+
+        self.small._bid_price = None
+        with self.assertRaisesRegexp(AssertionError, "No pools"):
+            self.launcher.allocate(10)
+
+    def test_launch(self):
+        batch = self.launcher.launch(3)
+        self.assertEqual(len(self.small.launched), 1)
+        self.assertEqual(len(self.large.launched), 2)
+        self.assertEqual(batch.request_ids, set(self.small.launched + self.large.launched))
+
+        [report] = self.launcher.batch_reports()
+        self.assertEqual(report["requested"], 3)
+        self.assertEqual(report["fulfilled"], 0)
+        self.assertIsNone(report["time_to_first_fulfilled"])
+        self.assertIsNone(report["time_to_first_request_served"])
+
+        instance_id = self.large.fulfill(self.large.launched[0])
+        self.cluster_stats.update(instance_id, 0, 1, batch.launch_time, batch.launch_time + 10)
+        self.cluster_stats.update(instance_id, 5, 0, batch.launch_time + 10, batch.launch_time + 20)
+        [report] = self.launcher.batch_reports()
+        self.assertEqual(report["fulfilled"], 1)
+        self.assertIsNotNone(report["time_to_first_fulfilled"])
+        self.assertIsNone(report["time_to_all_fulfilled"])
+        self.assertEqual(report["time_to_first_request_served"], 20)
+        # Boot marks wait for the control loop
+        self.assertNotIn(instance_id, self.cluster_stats.boot_marks)
+        self.assertEqual(self.launcher.apply_updates(), 1)
+        self.assertEqual(self.cluster_stats.boot_marks[instance_id]["requested"], batch.launch_time)
+        self.assertEqual(self.cluster_stats.boot_phases["spot_fulfillment"].count, 1)
+
+        self.small.fulfill(self.small.launched[0])
+        self.large.fulfill(self.large.launched[1])
+        [report] = self.launcher.batch_reports()
+        self.assertIsNotNone(report["time_to_all_fulfilled"])
+        self.assertEqual(self.launcher.instance_count, 3)
+
+    def test_clock_offset(self):
+        self.launcher.clock_offset_secs = 1.5
+        batch = self.launcher.launch(1)
+        instance_id = self.large.fulfill(self.large.launched[0])
+        self.launcher.apply_updates()
+        self.assertEqual(self.cluster_stats.boot_marks[instance_id]["requested"], batch.launch_time + 1.5)
+
+    def test_launch_errors(self):
+        broken = MockLauncher("broken", 0.01)
+        self.launcher = fleet.FleetLauncher([(broken, 1), (self.small, 1)])
+        batch = self.launcher.launch(4)
+        self.assertEqual(len(batch.request_ids), 2)
+        self.assertEqual(len(batch.errors), 1)
+
+    def test_terminate(self):
+        self.launcher.launch(3)
+        for request_id in self.small.launched + self.large.launched:
+            launcher = self.small if request_id.startswith("m1.small") else self.large
+            launcher.fulfill(request_id)
+
+        # Small instances are the most expensive per unit of capacity
+        self.launcher.terminate(num_instances=2)
+        self.assertEqual(self.small.instance_count, 0)
+        self.assertEqual(self.large.instance_count, 1)
+
+        self.launcher.terminate(instance_ids=self.large.instance_ids)
+        self.assertEqual(self.launcher.instance_count, 0)
@@ -0,0 +1,63 @@
+import json
+import unittest
+
+from spotmark.histogram import LatencyHistogram
+
+class TestLatencyHistogram(unittest.TestCase):
+
+    def setUp(self):
+        self.histogram = LatencyHistogram()
+        # 1ms to 1s in 1ms steps
+        for i in range(1, 1001):
+            self.histogram.record(i / 1000.0)
+
+    def test_percentile(self):
+        self.assertIsNone(LatencyHistogram().percentile(50))
+        with self.assertRaisesRegexp(AssertionError, "between 0 and 100"):
+            self.histogram.percentile(101)
+
+        self.assertEqual(self.histogram.count, 1000)
+        for percentile, expected in [(50, 0.5), (90, 0.9), (99, 0.99), (100, 1.0)]:
+            result = self.histogram.percentile(percentile)
+            self.assertAlmostEqual(result, expected, delta=expected / 64)
+            self.assertGreaterEqual(result, expected)
+
+        self.assertAlmostEqual(self.histogram.percentile(0), 0.001, delta=0.001 / 64)
+
+    def test_small_values_exact(self):
+        histogram = LatencyHistogram()
+        for micros in range(128):
+            histogram.record(micros / 1e6)
+        self.assertEqual(len(histogram.counts), 128)
+        self.assertEqual(histogram.percentile(100), 127 / 1e6)
+
+    def test_clamped(self):
+        histogram = LatencyHistogram(max_latency_secs=10)
+        histogram.record(-1)
+        histogram.record(1e6)
+        self.assertEqual(histogram.percentile(0), 0)
+        self.assertAlmostEqual(histogram.percentile(100), 10, delta=10 / 64.0)
+
+    def test_merge(self):
+        other = LatencyHistogram()
+        for i in range(1001, 2001):
+            other.record(i / 1000.0)
+
+        self.histogram.merge(other)
+        self.assertEqual(self.histogram.count, 2000)
+        self.assertAlmostEqual(self.histogram.percentile(50), 1.0, delta=1.0 / 64)
+
+        with self.assertRaisesRegexp(AssertionError, "different precision"):
+            self.histogram.merge(LatencyHistogram(sub_bucket_bits=5))
+
+    def test_serialization(self):
+        data = json.loads(json.dumps(self.histogram.to_dict()))
+        histogram = LatencyHistogram.from_dict(data)
+        self.assertEqual(histogram.count, self.histogram.count)
+        self.assertEqual(histogram.counts, self.histogram.counts)
+        self.assertEqual(histogram.percentile(99), self.histogram.percentile(99))
+
+    def test_reset(self):
+        self.histogram.reset()
+        self.assertEqual(self.histogram.count, 0)
+        self.assertEqual(self.histogram.counts, {})
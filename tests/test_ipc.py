@@ -1,9 +1,13 @@
+import json
 import multiprocessing
 import subprocess
 import unittest
 import time
 
+import zmq
+
 from spotmark import ipc, constants
+from spotmark.histogram import LatencyHistogram
 
 class EmitterProcess(multiprocessing.Process):
     
@@ -154,3 +158,151 @@ class TestZMQPeriodicReceiver(TestIPCBase):
             for emitter in self.emitters:
                 self.assertIn(emitter.id, emitter_ids)
             have_validated_messages = True
+
+
+class TestShardURI(unittest.TestCase):
+
+    def test_shard_uri(self):
+        self.assertEqual(ipc.shard_uri("tcp://0.0.0.0:10000", 0), "tcp://0.0.0.0:10001")
+        self.assertEqual(ipc.shard_uri("tcp://0.0.0.0:10000", 2), "tcp://0.0.0.0:10003")
+        self.assertEqual(ipc.shard_uri("ipc:///tmp/spotmark", 1), "ipc:///tmp/spotmark-1")
+        self.assertEqual(ipc.emitter_uri("tcp://0.0.0.0:10000", 0), "tcp://0.0.0.0:10000")
+        self.assertIn(ipc.emitter_uri("tcp://0.0.0.0:10000", 2), ["tcp://0.0.0.0:10001", "tcp://0.0.0.0:10002"])
+
+class ShardEmitterProcess(multiprocessing.Process):
+
+    def __init__(self, shard, num_messages):
+        super(ShardEmitterProcess, self).__init__()
+        self.shard = shard
+        self.num_messages = num_messages
+
+    def run(self):
+        zmq_emitter = ipc.ZMQEmitter(ipc.shard_uri(constants.ZMQ_URI, self.shard))
+        for i in range(self.num_messages):
+            zmq_emitter.send_string(json.dumps({"success_count": 1, "latencies": [0.1]}))
+        zmq_emitter.push_socket.close(linger=5000)
+
+class TestShardWorker(TestIPCBase):
+
+    def setUp(self):
+        super(TestShardWorker, self).setUp()
+        self.num_shards = 3
+        self.emitters = [ShardEmitterProcess(i % self.num_shards, self.num_messages)
+            for i in range(self.num_emitters)]
+        self.shards = [ipc.ShardWorker(i, constants.ZMQ_URI, partial_interval_ms=100)
+            for i in range(self.num_shards)]
+
+    def tearDown(self):
+        super(TestShardWorker, self).tearDown()
+        for shard in self.shards:
+            shard.terminate()
+
+    def test_sharded_receive(self):
+        """Emitters spread over the shards; the shards' partial totals
+        all arrive at the collector"""
+
+        self.receiver = ReceiverProcess(self.queue)
+        self.receiver.start()
+        for shard in self.shards:
+            shard.start()
+        for emitter in self.emitters:
+            emitter.start()
+
+        success_count, latency_count = 0, 0
+        while success_count < self.num_messages * self.num_emitters:
+            for message in self.queue.get(timeout=10):
+                partial = json.loads(message)
+                success_count += partial["success_count"]
+                latency_count += LatencyHistogram.from_dict(partial["latency_histogram"]).count
+        self.assertEqual(success_count, self.num_messages * self.num_emitters)
+        self.assertEqual(latency_count, success_count)
+
+
+class TestAggregatingEmitter(unittest.TestCase):
+
+    def setUp(self):
+        class MockSocket(object):
+            def __init__(self):
+                self.sent = []
+                self.blocked = False
+                self.attempts = 0
+            def send(self, message, flags=0):
+                self.attempts += 1
+                if self.blocked:
+                    raise zmq.Again()
+                self.sent.append(json.loads(message))
+
+        self.emitter = ipc.AggregatingEmitter(constants.ZMQ_URI, flush_count=5, flush_interval_ms=60000)
+        self.emitter.push_socket.close(linger=0)
+        self.socket = self.emitter.push_socket = MockSocket()
+
+    def test_flush_count(self):
+        for i in range(4):
+            self.emitter.record_success(0.1)
+        self.assertEqual(self.socket.sent, [])
+
+        self.emitter.record_failure("timeout", 1.0)
+        [message] = self.socket.sent
+        self.assertEqual(message["success_count"], 4)
+        self.assertEqual(message["failure_count"], 1)
+        self.assertEqual(message["failure_kinds"], {"timeout": 1})
+        self.assertEqual(LatencyHistogram.from_dict(message["latency_histogram"]).count, 5)
+        self.assertEqual(self.emitter.success_count, 0)
+
+    def test_flush_interval(self):
+        self.emitter.flush_interval_secs = 0
+        self.emitter.record_failure()
+        [message] = self.socket.sent
+        self.assertEqual(message["failure_count"], 1)
+        self.assertEqual(message["failure_kinds"], {})
+        self.assertNotIn("tags", message)
+
+    def test_tags(self):
+        search = self.emitter.tag_id({"endpoint": "/search"})
+        self.emitter.record_success(0.1, tags=search)
+        self.emitter.record_success(0.2, tags=search)
+        self.emitter.record_failure("timeout", tags={"endpoint": "/home"})
+        self.emitter.record_success()
+        self.emitter.record_success()
+
+        [message] = self.socket.sent
+        self.assertEqual(message["success_count"], 4)
+        self.assertEqual(message["tags"]["endpoint=/search"]["success_count"], 2)
+        self.assertEqual(LatencyHistogram.from_dict(message["tags"]["endpoint=/search"]["latency_histogram"]).count, 2)
+        self.assertEqual(message["tags"]["endpoint=/home"]["failure_count"], 1)
+        # Ids stay valid after a flush
+        self.assertEqual(self.emitter.tag_id({"endpoint": "/search"}), search)
+
+    def test_flush_blocked(self):
+        self.socket.blocked = True
+        for i in range(5):
+            self.emitter.record_success()
+        self.assertFalse(self.emitter.flush())
+        self.assertEqual(self.emitter.success_count, 5)
+
+        # The next attempt waits for another flush_count records
+        for i in range(4):
+            self.emitter.record_success()
+        self.assertEqual(self.socket.attempts, 2)
+
+        # Totals are kept until they can be sent
+        self.socket.blocked = False
+        self.emitter.record_success()
+        [message] = self.socket.sent
+        self.assertEqual(message["success_count"], 10)
+
+        # Nothing to send
+        self.assertTrue(self.emitter.flush())
+        self.assertEqual(len(self.socket.sent), 1)
+
+
+class TestNextAlignedTime(unittest.TestCase):
+
+    def test_next_aligned_time(self):
+        self.assertEqual(ipc.next_aligned_time(101, 10), 110)
+        self.assertEqual(ipc.next_aligned_time(110, 10), 120)
+        # The reference clock is 3 seconds ahead, so its boundary at
+        # 110 is at 107 locally
+        self.assertEqual(ipc.next_aligned_time(101, 10, 3), 107)
+        self.assertEqual(ipc.next_aligned_time(101, 10, -3), 103)
+        self.assertAlmostEqual(ipc.next_aligned_time(100.2, 0.5), 100.5)
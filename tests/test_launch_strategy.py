@@ -2,6 +2,7 @@ import time
 import unittest
 
 from spotmark import launch_strategy
+from spotmark.load_profile import LoadProfile, Soak
 
 class TestRequestsPerSecondStrategy(unittest.TestCase):
 
@@ -13,6 +14,8 @@ class TestRequestsPerSecondStrategy(unittest.TestCase):
             pass
 
         stats = MockClusterStats()
+        # Every instance reported for a second
+        stats.instance_seconds = lambda *args: stats.instance_count()
         self.launcher = launch_strategy.RequestsPerSecondStrategy(stats, 100)
 
     def test_get_instance_count_delta(self):
@@ -57,3 +60,176 @@ class TestRequestsPerSecondStrategy(unittest.TestCase):
         delta = self.launcher.get_instance_count_delta()
         self.assertEqual(delta, 1)
 
+
+    def test_get_instance_count_delta_window(self):
+        class MockWindow(object):
+            def __init__(self):
+                self.requests, self.seconds = 4800, 480
+            def instance_count(self, now):
+                return 8
+            def request_count(self, now):
+                # 80 requests per second over a 60 second window
+                return self.requests
+            def instance_seconds(self, now):
+                return self.seconds
+
+        window = MockWindow()
+        self.launcher.window_secs = 60
+        self.launcher.cluster_stats.window = lambda window_secs: window
+        delta = self.launcher.get_instance_count_delta()
+        self.assertEqual(delta, 2)
+
+        # Two instances only reported for half the window, at the same rate
+        window.requests, window.seconds = 4200, 420
+        self.assertEqual(self.launcher.get_counts(0), (8, 80))
+
+
+class TestPredictiveStrategy(unittest.TestCase):
+
+    def setUp(self):
+        class MockClusterStats(object):
+            pass
+
+        self.stats = MockClusterStats()
+        self.strategy = launch_strategy.PredictiveStrategy(self.stats, 100, window_secs=10, smoothing=1)
+
+    def report(self, instance_count, requests_per_second):
+        self.stats.instance_count = lambda *args: instance_count
+        self.stats.request_count = lambda *args: requests_per_second * 10
+        self.stats.instance_seconds = lambda *args: instance_count * 10
+
+    def test_bootstrap(self):
+        self.report(0, 0)
+        self.assertEqual(self.strategy.get_instance_count_delta(), 1)
+        # Waits for the first instance to report
+        self.assertEqual(self.strategy.get_instance_count_delta(), 0)
+        self.assertEqual(self.strategy.in_flight_count, 1)
+
+        self.report(1, 10)
+        self.assertEqual(self.strategy.get_instance_count_delta(), 9)
+
+    def test_in_flight(self):
+        self.report(8, 80)
+        self.assertEqual(self.strategy.get_instance_count_delta(), 2)
+
+        # Instances in flight count towards the target, but don't stop
+        # the strategy from acting on new information
+        self.assertEqual(self.strategy.get_instance_count_delta(), 0)
+        self.report(8, 40)
+        self.assertEqual(self.strategy.get_instance_count_delta(), 10)
+        self.assertEqual(self.strategy.in_flight_count, 12)
+
+        self.report(15, 75)
+        self.assertEqual(self.strategy.get_instance_count_delta(), 0)
+        self.assertEqual(self.strategy.in_flight_count, 5)
+
+    def test_boot_timeout(self):
+        self.report(8, 80)
+        self.assertEqual(self.strategy.get_instance_count_delta(), 2)
+
+        # The spot requests were never fulfilled
+        self.strategy.in_flight[0][0] -= self.strategy.boot_timeout_secs + 1
+        self.assertEqual(self.strategy.get_instance_count_delta(), 2)
+
+    def test_scale_down(self):
+        self.report(10, 200)
+        self.assertEqual(self.strategy.get_instance_count_delta(), -5)
+        self.assertEqual(self.strategy.get_instance_count_delta(), 0)
+
+        self.report(5, 100)
+        self.assertEqual(self.strategy.get_instance_count_delta(), 0)
+        self.assertEqual(self.strategy.terminating, 0)
+
+    def test_low_throughput(self):
+        # Under one request per second per instance
+        self.report(5, 2)
+        self.assertEqual(self.strategy.get_instance_count_delta(), 245)
+
+    def test_rounding(self):
+        # 6.25 instances needed: round up rather than fall short
+        self.report(5, 80)
+        self.assertEqual(self.strategy.get_instance_count_delta(), 2)
+
+        # Slightly over target with 7: don't terminate
+        self.report(7, 112)
+        self.assertEqual(self.strategy.get_instance_count_delta(), 0)
+
+    def test_max_step(self):
+        self.strategy.max_step = 3
+        self.report(5, 2)
+        self.assertEqual(self.strategy.get_instance_count_delta(), 3)
+
+    def test_smoothing(self):
+        self.strategy.smoothing = 0.5
+        self.report(10, 100)
+        self.strategy.get_instance_count_delta()
+        self.report(10, 200)
+        self.strategy.get_instance_count_delta()
+        self.assertEqual(self.strategy.per_instance_rps, 15)
+
+    def test_window(self):
+        class MockWindow(object):
+            def instance_count(self, now):
+                return 8
+            def request_count(self, now):
+                return 800
+            def instance_seconds(self, now):
+                return 80
+
+        self.stats.windows = {10: MockWindow()}
+        self.assertEqual(self.strategy.get_instance_count_delta(), 2)
+
+
+class TestScheduledStrategy(unittest.TestCase):
+
+    def setUp(self):
+        class MockClusterStats(object):
+            pass
+
+        self.stats = MockClusterStats()
+        profile = LoadProfile([Soak(100, 600), Soak(200, 600)])
+        self.strategy = launch_strategy.ScheduledStrategy(
+            self.stats, profile, boot_latency_secs=300, window_secs=10, smoothing=1
+        )
+        self.strategy.start_time = time.time()
+
+    def report(self, instance_count, requests_per_second):
+        self.stats.instance_count = lambda *args: instance_count
+        self.stats.request_count = lambda *args: requests_per_second * 10
+        self.stats.instance_seconds = lambda *args: instance_count * 10
+
+    def test_get_instance_count_delta(self):
+        self.report(10, 100)
+        self.assertEqual(self.strategy.get_instance_count_delta(), 0)
+        self.assertEqual(self.strategy.target_requests_per_second, 100)
+
+        # The next step is within the boot latency, so launch for it now
+        self.strategy.start_time -= 400
+        self.assertEqual(self.strategy.get_instance_count_delta(), 10)
+        self.assertEqual(self.strategy.target_requests_per_second, 200)
+
+        self.strategy.start_time -= 400
+        self.report(20, 150)
+        self.strategy.get_instance_count_delta()
+
+        reports = self.strategy.step_reports()
+        self.assertEqual([r["segment"] for r in reports], [0, 1])
+        self.assertEqual(reports[0]["decisions"], 2)
+        self.assertEqual(reports[0]["mean_target"], 100)
+        self.assertEqual(reports[0]["achieved_ratio"], 1)
+        self.assertEqual(reports[1]["kind"], "soak")
+        self.assertEqual(reports[1]["mean_achieved"], 150)
+        self.assertEqual(reports[1]["min_achieved_ratio"], 0.75)
+
+    def test_measured_boot_latency(self):
+        self.strategy.boot_latency_percentile = 90
+        self.stats.boot_latency = lambda percentile: None
+        self.assertEqual(self.strategy.lead_time_secs(), 300)
+
+        # Boots are quick, so the next step is still too far off to launch for
+        self.stats.boot_latency = lambda percentile: 100
+        self.assertEqual(self.strategy.lead_time_secs(), 100)
+        self.report(10, 100)
+        self.strategy.start_time -= 400
+        self.assertEqual(self.strategy.get_instance_count_delta(), 0)
+        self.assertEqual(self.strategy.target_requests_per_second, 100)
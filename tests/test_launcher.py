@@ -0,0 +1,206 @@
+from collections import namedtuple
+import time
+import unittest
+
+from spotmark import launcher
+
+price_history = namedtuple("price_history", "timestamp price availability_zone")
+spot_status = namedtuple("spot_status", "code")
+
+class MockSpotRequest(object):
+
+    def __init__(self, id, state="open", code="pending-evaluation", instance_id=None):
+        self.id = id
+        self.state = state
+        self.status = spot_status(code)
+        self.instance_id = instance_id
+
+class MockEC2Error(Exception):
+
+    def __init__(self, error_code):
+        super(MockEC2Error, self).__init__(error_code)
+        self.error_code = error_code
+
+class MockEC2(object):
+
+    class region(object):
+        name = "us-east-1"
+
+    def __init__(self):
+        self.history = []
+        self.calls = []
+        self.spot_requests = {}
+        self.describe_calls = []
+        self.failing = set()
+        self.cancelled, self.terminated = [], []
+
+    def get_all_spot_instance_requests(self, request_ids):
+        self.describe_calls.append(request_ids)
+        if self.failing.intersection(request_ids):
+            raise MockEC2Error("RequestLimitExceeded")
+        if not set(request_ids).issubset(self.spot_requests):
+            raise MockEC2Error(launcher.REQUEST_NOT_FOUND)
+        return [self.spot_requests[i] for i in request_ids]
+
+    def request_spot_instances(self, price, ami, count, **kwargs):
+        requests = []
+        for i in range(count):
+            request = MockSpotRequest("sir-%d" % len(self.spot_requests))
+            self.spot_requests[request.id] = request
+            requests.append(request)
+        return requests
+
+    def cancel_spot_instance_requests(self, request_ids):
+        self.cancelled.extend(request_ids)
+
+    def terminate_instances(self, instance_ids):
+        self.terminated.extend(instance_ids)
+
+    def get_spot_price_history(self, start_time, instance_type, product_description):
+        self.calls.append(start_time)
+        return [i for i in self.history if i.timestamp >= start_time]
+
+class TestSpotPriceCache(unittest.TestCase):
+
+    def setUp(self):
+        self.ec2 = MockEC2()
+        self.ec2.history = [
+            price_history("2030-01-01T00:05:00.000Z", 0.05, "us-east-1b"),
+            price_history("2030-01-01T00:01:00.000Z", 0.02, "us-east-1a"),
+            price_history("2030-01-01T00:00:00.000Z", 0.01, "us-east-1b"),
+        ]
+        self.cache = launcher.SpotPriceCache(ttl_secs=300)
+
+    def get_price(self, availability_zone=None):
+        return self.cache.get_price(self.ec2, "m1.small", availability_zone=availability_zone)
+
+    def test_get_price(self):
+        self.assertEqual(self.get_price("us-east-1a"), 0.02)
+        self.assertEqual(self.get_price("us-east-1b"), 0.05)
+        # Most recent in any zone
+        self.assertEqual(self.get_price(), 0.05)
+        # All served from the one fetch
+        self.assertEqual(len(self.ec2.calls), 1)
+
+        with self.assertRaisesRegexp(AssertionError, "No spot price history"):
+            self.get_price("us-east-1c")
+
+    def test_refresh(self):
+        self.get_price()
+        self.ec2.history.insert(0, price_history("2030-01-01T00:10:00.000Z", 0.03, "us-east-1a"))
+        self.assertEqual(self.get_price("us-east-1a"), 0.02)
+
+        self.cache.ttl_secs = 0
+        self.assertEqual(self.get_price("us-east-1a"), 0.03)
+        self.assertEqual(self.get_price("us-east-1b"), 0.05)
+        # Only asked for history since the newest price seen
+        self.assertEqual(self.ec2.calls[1:], ["2030-01-01T00:05:00.000Z", "2030-01-01T00:10:00.000Z"])
+
+
+class TestFleetStateTracker(unittest.TestCase):
+
+    def setUp(self):
+        self.ec2 = MockEC2()
+        self.tracker = launcher.FleetStateTracker(self.ec2, batch_size=2)
+        self.events = []
+        self.tracker.on_event(lambda *event: self.events.append(event))
+
+        self.requests = self.ec2.request_spot_instances(0.01, "ami", 3)
+        self.tracker.track(self.requests)
+
+    def test_refresh(self):
+        self.assertEqual(self.tracker.refresh(), [])
+        # Described in batches
+        self.assertEqual([len(i) for i in self.ec2.describe_calls], [2, 1])
+
+        request = self.requests[0]
+        request.state, request.status, request.instance_id = "active", spot_status("fulfilled"), "i-0"
+        self.tracker.refresh()
+        self.assertEqual(self.events, [("fulfilled", "sir-0", "i-0"), ("active", "sir-0", "i-0")])
+        self.assertEqual(self.tracker.instance_ids, {"i-0"})
+
+        self.events = []
+        request.status = spot_status("instance-terminated-by-price")
+        self.tracker.refresh()
+        request.state = "closed"
+        self.tracker.refresh()
+        self.assertEqual(self.events, [("interrupted", "sir-0", "i-0"), ("closed", "sir-0", "i-0")])
+        self.assertEqual(self.tracker.instance_ids, set())
+        # Closed requests are no longer described
+        self.assertEqual(self.tracker.request_ids, {"sir-1", "sir-2"})
+
+    def fulfil(self, request_ids):
+        for request_id in request_ids:
+            request = self.ec2.spot_requests[request_id]
+            request.state, request.instance_id = "active", request_id.replace("sir", "i")
+
+    def test_deleted_request(self):
+        # EC2 deletes requests a few hours after they close
+        del self.ec2.spot_requests["sir-1"]
+        self.fulfil(["sir-0", "sir-2"])
+        self.tracker.refresh()
+        self.assertEqual(self.tracker.request_ids, {"sir-0", "sir-2"})
+        self.assertEqual(self.tracker.instance_ids, {"i-0", "i-2"})
+
+    def test_failed_batch(self):
+        self.tracker.batch_size = 1
+        self.ec2.failing.add("sir-1")
+        self.fulfil(["sir-0", "sir-1", "sir-2"])
+        self.tracker.refresh()
+        # The other batches are still described
+        self.assertEqual(self.tracker.instance_ids, {"i-0", "i-2"})
+        self.assertEqual(self.tracker.request_ids, {"sir-0", "sir-1", "sir-2"})
+
+        self.ec2.failing.clear()
+        self.tracker.refresh()
+        self.assertEqual(self.tracker.instance_ids, {"i-0", "i-1", "i-2"})
+
+    def test_reads_are_local(self):
+        self.tracker.refresh()
+        calls = len(self.ec2.describe_calls)
+        self.tracker.instance_ids
+        self.tracker.request_statuses()
+        self.tracker.request_ids_for(["i-0"])
+        self.assertEqual(len(self.ec2.describe_calls), calls)
+
+    def test_untrack(self):
+        self.tracker.untrack(["sir-0", "sir-1"])
+        self.assertEqual(self.tracker.request_ids, {"sir-2"})
+        self.tracker.refresh()
+        self.assertEqual(self.ec2.describe_calls, [["sir-2"]])
+
+    def test_poll(self):
+        self.tracker.poll_interval_secs = 0.01
+        self.tracker.start()
+        try:
+            while not self.ec2.describe_calls:
+                time.sleep(0.01)
+        finally:
+            self.tracker.stop()
+        self.assertIsNone(self.tracker.thread)
+
+
+class TestSpotInstanceLauncher(unittest.TestCase):
+
+    def setUp(self):
+        self.ec2 = MockEC2()
+        self.launcher = launcher.SpotInstanceLauncher("m1.small", "default", "key")
+        self.launcher._ec2 = self.ec2
+        self.launcher.fleet.start = lambda: None
+
+    def test_terminate(self):
+        self.ec2.history = [price_history("2030-01-01T00:00:00.000Z", 0.01, "us-east-1a")]
+        self.launcher.launch(3)
+        for i, request in enumerate(self.ec2.spot_requests.values()):
+            request.state, request.instance_id = "active", "i-%d" % i
+        self.launcher.fleet.refresh()
+        self.assertEqual(self.launcher.instance_count, 3)
+
+        describe_calls = len(self.ec2.describe_calls)
+        self.launcher.terminate(num_instances=2)
+        # Terminating reads local state only
+        self.assertEqual(len(self.ec2.describe_calls), describe_calls)
+        self.assertEqual(len(self.ec2.terminated), 2)
+        self.assertEqual(len(self.ec2.cancelled), 2)
+        self.assertEqual(self.launcher.instance_count, 1)
+        self.assertEqual(len(self.launcher.spot_request_ids), 1)
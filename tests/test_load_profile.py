@@ -0,0 +1,50 @@
+import unittest
+
+from spotmark.load_profile import LoadProfile, Ramp, Soak, Spike, step_ladder
+
+class TestLoadProfile(unittest.TestCase):
+
+    def setUp(self):
+        self.profile = LoadProfile([
+            Ramp(1000, 5000, 100),
+            Soak(5000, 50),
+            Spike(5000, 20000, 100, spike_start_secs=40, spike_secs=10),
+        ] + step_ladder(1000, 1000, 10, 3))
+
+    def test_segments(self):
+        self.assertEqual(self.profile.duration_secs, 280)
+        self.assertEqual(self.profile.start_offsets, [0, 100, 150, 250, 260, 270])
+        self.assertEqual(self.profile.segment_index_at(-1), 0)
+        self.assertEqual(self.profile.segment_index_at(100), 1)
+        self.assertEqual(self.profile.segment_index_at(1000), 5)
+
+        with self.assertRaisesRegexp(AssertionError, "must be positive"):
+            Soak(100, 0)
+        with self.assertRaisesRegexp(AssertionError, "within the segment"):
+            Spike(1, 2, 10, 5, 6)
+        with self.assertRaisesRegexp(AssertionError, "at least one segment"):
+            LoadProfile([])
+
+    def test_target_at(self):
+        self.assertEqual(self.profile.target_at(0), 1000)
+        self.assertEqual(self.profile.target_at(50), 3000)
+        self.assertEqual(self.profile.target_at(120), 5000)
+        self.assertEqual(self.profile.target_at(189), 5000)
+        self.assertEqual(self.profile.target_at(190), 20000)
+        self.assertEqual(self.profile.target_at(200), 5000)
+        self.assertEqual(self.profile.target_at(265), 2000)
+        self.assertEqual(self.profile.target_at(275), 3000)
+        # Stays at the final target
+        self.assertEqual(self.profile.target_at(1000), 3000)
+        self.assertTrue(self.profile.finished(280))
+        self.assertFalse(self.profile.finished(279))
+
+    def test_max_target(self):
+        self.assertEqual(self.profile.max_target(0, 10), 1400)
+        self.assertEqual(self.profile.max_target(0, 1000), 20000)
+        self.assertEqual(self.profile.max_target(150, 189), 5000)
+        self.assertEqual(self.profile.max_target(150, 190), 20000)
+        # Spike is over
+        self.assertEqual(self.profile.max_target(201, 250), 5000)
+        self.assertAlmostEqual(self.profile.max_target(240, 255), 5000)
+        self.assertEqual(self.profile.max_target(251, 262), 2000)
@@ -0,0 +1,110 @@
+import csv
+import os
+import shutil
+import StringIO
+import tempfile
+import unittest
+
+from spotmark import report
+from spotmark.stats import ClusterStats
+from test_stats import make_histogram
+
+class TestResample(unittest.TestCase):
+
+    def setUp(self):
+        self.stats = ClusterStats()
+        self.stats.update("i-1", 10, 0, 0, 10, make_histogram(0.1))
+        self.stats.update("i-2", 15, 5, 5, 15, make_histogram(0.3))
+        self.stats.update("i-1", 10, 10, 10, 20)
+        # Nothing reported between 20 and 30
+        self.stats.update("i-2", 4, 0, 30, 40)
+
+    def test_cluster_updates_in_time_order(self):
+        self.assertEqual([u[3] for u in self.stats.updates()], [0, 5, 10, 30])
+
+    def test_resample(self):
+        rows = list(report.resample(self.stats.updates(), 10))
+        self.assertEqual([row["time"] for row in rows], [0, 10, 20, 30])
+        self.assertEqual([row["instance_id"] for row in rows], ["cluster"] * 4)
+
+        # i-2's 5-15 interval is split evenly between the first two buckets
+        self.assertEqual(rows[0]["successes"], 17.5)
+        self.assertEqual(rows[0]["failures"], 2.5)
+        self.assertEqual(rows[0]["instances"], 2)
+        self.assertEqual(rows[0]["requests_per_second"], 2)
+        self.assertEqual(rows[1]["requests"], 30)
+        self.assertEqual(rows[1]["success_rate"], 17.5 / 30)
+
+        # Histograms go to the bucket holding the interval's midpoint
+        self.assertAlmostEqual(rows[0]["latency_p99"], 0.1, delta=0.1 / 64)
+        self.assertAlmostEqual(rows[1]["latency_p50"], 0.3, delta=0.3 / 64)
+        self.assertIsNone(rows[3]["latency_p50"])
+
+        self.assertEqual(rows[2]["requests"], 0)
+        self.assertEqual(rows[2]["instances"], 0)
+        self.assertIsNone(rows[2]["success_rate"])
+
+    def test_resample_per_instance(self):
+        rows = list(report.resample(self.stats.updates(), 20, per_instance=True))
+        self.assertEqual([(row["time"], row["instance_id"]) for row in rows],
+            [(0, "cluster"), (0, "i-1"), (0, "i-2"), (20, "cluster"), (20, "i-2")])
+        self.assertEqual(rows[1]["requests"], 30)
+        self.assertEqual(rows[4]["requests_per_second"], 0.2)
+
+    def test_buckets_are_released(self):
+        def updates():
+            for start_time in xrange(0, 100000, 10):
+                yield ("i-1", 1, 0, start_time, start_time + 10, None)
+
+        rows = report.resample(updates(), 10)
+        self.assertEqual(sum(1 for row in rows), 10000)
+
+    def test_write_csv(self):
+        output = StringIO.StringIO()
+        count = report.write_csv(report.resample(self.stats.updates(), 10), output)
+        self.assertEqual(count, 4)
+
+        rows = list(csv.DictReader(StringIO.StringIO(output.getvalue())))
+        self.assertEqual(rows[0]["instance_id"], "cluster")
+        self.assertEqual(float(rows[1]["requests"]), 30)
+        self.assertEqual(rows[2]["success_rate"], "")
+
+
+class TestMissingPyarrow(unittest.TestCase):
+
+    def setUp(self):
+        self.pyarrow, report.pyarrow = report.pyarrow, None
+
+    def tearDown(self):
+        report.pyarrow = self.pyarrow
+
+    def test_import_error(self):
+        with self.assertRaisesRegexp(ImportError, "pyarrow is required"):
+            report.write_parquet([], "unused.parquet")
+        with self.assertRaisesRegexp(ImportError, "pyarrow is required"):
+            report.write_arrow([], "unused.arrow")
+
+
+@unittest.skipIf(report.pyarrow is None, "pyarrow is not installed")
+class TestArrowExport(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.stats = ClusterStats()
+        for start_time in range(0, 100, 10):
+            self.stats.update("i-1", 9, 1, start_time, start_time + 10, make_histogram(0.1))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_write_parquet(self):
+        path = os.path.join(self.directory, "report.parquet")
+        rows = report.resample(self.stats.updates(), 10)
+        self.assertEqual(report.write_parquet(rows, path, batch_rows=3), 10)
+        table = report.pyarrow.parquet.read_table(path)
+        self.assertEqual(table.num_rows, 10)
+
+    def test_write_arrow(self):
+        path = os.path.join(self.directory, "report.arrow")
+        rows = report.resample(self.stats.updates(), 10)
+        self.assertEqual(report.write_arrow(rows, path, batch_rows=3), 10)
@@ -0,0 +1,59 @@
+import time
+import unittest
+
+from spotmark import launch_strategy, simulator
+from spotmark.load_profile import LoadProfile, Ramp, Soak
+
+def predictive(target):
+    return lambda cluster_stats: launch_strategy.PredictiveStrategy(cluster_stats, target)
+
+class TestFleetSimulator(unittest.TestCase):
+
+    def test_reaches_target(self):
+        start = time.time()
+        sim = simulator.FleetSimulator(predictive(5000))
+        result = sim.run(3600)
+        # An hour of a 100 instance fleet shouldn't take long
+        self.assertLess(time.time() - start, 30)
+
+        self.assertEqual(result["duration_secs"], 3600)
+        self.assertIsNotNone(result["time_to_target_secs"])
+        self.assertLess(result["time_to_target_secs"], 1200)
+        self.assertLess(result["overshoot"], 0.2)
+        self.assertGreater(result["instance_hours"], 80)
+        self.assertLess(result["max_instances"], 130)
+
+        # Measured throughput tracks what the fleet is really serving
+        now, target, served, measured, serving, running = sim.timeline[-1]
+        self.assertAlmostEqual(measured, served, delta=served * 0.1)
+
+    def test_repeatable(self):
+        first = simulator.FleetSimulator(predictive(1000), seed=1).run(1800)
+        second = simulator.FleetSimulator(predictive(1000), seed=1).run(1800)
+        self.assertEqual(first, second)
+
+    def test_interruptions(self):
+        sim = simulator.FleetSimulator(predictive(2000), interruptions_per_hour=0.5)
+        result = sim.run(3600)
+        self.assertGreater(result["interruptions"], 0)
+        self.assertGreater(result["instances_launched"], result["max_instances"])
+
+        # Interrupted instances are replaced
+        served = [entry[2] for entry in sim.timeline[60:]]
+        self.assertGreater(sum(served) / len(served), 2000 * 0.9)
+
+    def test_scheduled_target(self):
+        profile = LoadProfile([Ramp(500, 2000, 1200), Soak(2000, 1200)])
+        factory = lambda cluster_stats: launch_strategy.ScheduledStrategy(cluster_stats, profile)
+        sim = simulator.FleetSimulator(factory)
+        sim.run(2400)
+        self.assertEqual(sim.timeline[0][1], 500)
+        self.assertEqual(sim.timeline[-1][1], 2000)
+
+    def test_compare(self):
+        results = simulator.compare({
+            "fast": lambda stats: launch_strategy.PredictiveStrategy(stats, 1000),
+            "capped": lambda stats: launch_strategy.PredictiveStrategy(stats, 1000, max_step=2),
+        }, 1800)
+        self.assertEqual(set(results), {"fast", "capped"})
+        self.assertLessEqual(results["fast"]["time_to_target_secs"], results["capped"]["time_to_target_secs"])
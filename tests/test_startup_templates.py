@@ -14,3 +14,54 @@ class TestStartupTemplates(unittest.TestCase):
         self.assertTrue(expected_key in script)
         self.assertTrue(expected_secret in script)
 
+    def test_environment_exported_to_client(self):
+        script = startup_templates.get_startup_script("base_template.sh", "key", "secret")
+        export = script.index("export SPOTMARK_ENVIRONMENT='AWS'")
+        self.assertTrue(export < script.index("./spotmark/client &"))
+
+    def test_default_script_builds_environment(self):
+        script = startup_templates.get_startup_script("base_template.sh", "key", "secret")
+        self.assertTrue("apt-get install -y git python-pip python-virtualenv python-dev" in script)
+        self.assertTrue("pip install -r requirements.txt" in script)
+        self.assertFalse("curl" in script)
+
+    def test_prebaked_dir_skips_install(self):
+        script = startup_templates.get_startup_script("base_template.sh", "key", "secret",
+            prebaked_dir="/opt/spotmark")
+        self.assertTrue("cd /opt/spotmark" in script)
+        self.assertFalse("apt-get" in script)
+        self.assertFalse("pip install" in script)
+        self.assertTrue("./spotmark/client &" in script)
+
+    def test_environment_url_unpacks_virtualenv(self):
+        script = startup_templates.get_startup_script("base_template.sh", "key", "secret",
+            environment_url="http://artifacts/spotmark-env.tar.gz", install_dir="/opt/spotmark")
+        self.assertTrue('curl -sSfL "http://artifacts/spotmark-env.tar.gz" | tar -xz -C /opt/spotmark' in script)
+        self.assertFalse("apt-get" in script)
+        self.assertFalse("pip install" in script)
+
+    def test_wheelhouse_url_skips_compilation(self):
+        script = startup_templates.get_startup_script("base_template.sh", "key", "secret",
+            wheelhouse_url="http://artifacts/wheels.tar.gz")
+        self.assertTrue("pip install --no-index --find-links=wheelhouse -r requirements.txt" in script)
+        self.assertFalse("python-dev" in script)
+
+    def test_environment_is_cached(self):
+        self.assertTrue(startup_templates.ENVIRONMENT.get_template("base_template.sh")
+            is startup_templates.ENVIRONMENT.get_template("base_template.sh"))
+
+    def test_aggregator_settings(self):
+        script = startup_templates.get_startup_script("base_template.sh", "key", "secret")
+        self.assertFalse("SPOTMARK_AGGREGATOR_URI" in script)
+
+        script = startup_templates.get_startup_script("base_template.sh", "key", "secret",
+            aggregator_uri="tcp://10.0.0.1:10200")
+        self.assertTrue('export SPOTMARK_AGGREGATOR_URI="tcp://10.0.0.1:10200"' in script)
+        self.assertFalse("SPOTMARK_RUN_AGGREGATOR" in script)
+
+        script = startup_templates.get_startup_script("base_template.sh", "key", "secret", run_aggregator=True)
+        self.assertTrue("export SPOTMARK_RUN_AGGREGATOR=1" in script)
+
+        script = startup_templates.get_startup_script("base_template.sh", "key", "secret",
+            controller_uri="tcp://10.0.0.2:10300")
+        self.assertTrue('export SPOTMARK_CONTROLLER_URI="tcp://10.0.0.2:10300"' in script)
@@ -1,6 +1,14 @@
 import unittest
 
-from spotmark.stats import InstanceStats, ClusterStats
+from spotmark import tags
+from spotmark.histogram import LatencyHistogram
+from spotmark.stats import InstanceStats, ClusterStats, TrailingWindow
+
+def make_histogram(*latencies):
+    histogram = LatencyHistogram()
+    for latency in latencies:
+        histogram.record(latency)
+    return histogram
 
 class TestInstanceStats(unittest.TestCase):
 
@@ -28,22 +36,38 @@ class TestInstanceStats(unittest.TestCase):
         self.assertEqual(result, [])
 
         result = self.stats.get_period(0, 2)
-        self.assertEqual(result, [self.stats._stats[0]]) 
+        self.assertEqual(result, [self.stats[0]]) 
 
         result = self.stats.get_period(1, 2)
-        self.assertEqual(result, [self.stats._stats[0]]) 
+        self.assertEqual(result, [self.stats[0]]) 
 
         result = self.stats.get_period(2, 5)
-        self.assertEqual(result, [self.stats._stats[1]]) 
+        self.assertEqual(result, [self.stats[1]]) 
 
         result = self.stats.get_period(2, 3)
-        self.assertEqual(result, [self.stats._stats[1]]) 
+        self.assertEqual(result, [self.stats[1]]) 
 
         result = self.stats.get_period(0, 5)
-        self.assertEqual(result, self.stats._stats) 
+        self.assertEqual(result, list(self.stats)) 
 
         result = self.stats.get_period(5, 10)
-        self.assertEqual(result, []) 
+        self.assertEqual(result, [])
+
+    def test_getitem(self):
+        self.assertEqual(len(self.stats), 2)
+        interval = self.stats[1]
+        self.assertEqual(interval.successes, 1)
+        self.assertEqual(interval.failures, 3)
+        self.assertEqual(interval.requests, 4)
+        self.assertEqual(interval.start_time, 2)
+        self.assertEqual(interval.end_time, 3)
+        self.assertEqual(interval.interval, 1)
+
+    def test_update_out_of_order(self):
+        self.stats.update(successes=5, failures=0, start_time=0, end_time=1)
+        self.assertEqual([i.start_time for i in self.stats], [0, 1, 2])
+        self.assertEqual(self.stats.request_count(0, 2), 7)
+        self.assertEqual(self.stats.get_period(0, 1), [self.stats[0]])
 
     def test_success_rate(self):
         result = self.stats.success_rate(1, 1)
@@ -52,8 +76,9 @@ class TestInstanceStats(unittest.TestCase):
         result = self.stats.success_rate(1, 2)
         self.assertEqual(result, 0.5)
 
+        # 2 of the 6 requests succeeded
         result = self.stats.success_rate(1, 3)
-        self.assertEqual(result, 0.375)
+        self.assertAlmostEqual(result, 1 / 3.0)
 
     def test_request_count(self):
         result = self.stats.request_count(1, 1)
@@ -65,6 +90,82 @@ class TestInstanceStats(unittest.TestCase):
         result = self.stats.request_count(1, 3)
         self.assertEqual(result, 6)
 
+    def test_partial_overlap(self):
+        # Intervals partly in the period count in proportion
+        self.assertEqual(self.stats.request_count(1.5, 3), 5)
+        self.assertEqual(self.stats.request_count(1.5, 2.5), 3)
+        self.assertEqual(self.stats.instance_seconds(1.5, 2.5), 1)
+        # An interval covering the whole period
+        self.assertEqual(self.stats.request_count(2.25, 2.75), 2)
+        self.assertEqual(self.stats.instance_seconds(2.25, 2.75), 0.5)
+        self.assertEqual(self.stats.request_count(3, 5), 0)
+
+class TestTrailingWindow(unittest.TestCase):
+
+    def setUp(self):
+        self.window = TrailingWindow(10)
+        self.window.add(1, successes=1, failures=1, start_time=100, end_time=105)
+        self.window.add(2, successes=1, failures=3, start_time=103, end_time=108)
+        self.window.add(1, successes=4, failures=0, start_time=105, end_time=110)
+
+    def test_totals(self):
+        self.assertEqual(self.window.request_count(110), 10)
+        self.assertEqual(self.window.instance_count(110), 2)
+        self.assertEqual(self.window.instance_ids(110), {1, 2})
+        self.assertEqual(self.window.instance_seconds(110), 15)
+        # Instance 1 has 5 successes in 6 requests, instance 2 is 0.25
+        self.assertAlmostEqual(self.window.success_rate(110), (5 / 6.0 + 0.25) / 2)
+
+    def test_expiry(self):
+        self.assertEqual(self.window.request_count(112), 8)
+        self.assertEqual(self.window.instance_seconds(112), 10)
+        self.assertEqual(self.window.success_rate(112), 0.625)
+
+        self.assertEqual(self.window.request_count(114), 4)
+        self.assertEqual(self.window.instance_count(114), 1)
+        self.assertEqual(self.window.success_rate(114), 1)
+
+        # Time doesn't move backwards
+        self.assertEqual(self.window.request_count(100), 4)
+
+        self.assertEqual(self.window.request_count(200), 0)
+        self.assertEqual(self.window.instance_count(200), 0)
+        self.assertEqual(self.window.success_rate(200), 0)
+
+    def test_add_expired(self):
+        self.window.advance(120)
+        self.window.add(3, successes=1, failures=0, start_time=105, end_time=110)
+        self.assertEqual(self.window.request_count(120), 0)
+
+        self.window.add(3, successes=1, failures=0, start_time=112, end_time=117)
+        self.assertEqual(self.window.request_count(120), 1)
+
+    def test_matches_cluster_stats(self):
+        stats = ClusterStats(windows=(10,))
+        window = stats.window(10)
+        # Intervals are added as they're reported, ie. once they've ended
+        for now in range(5, 100, 5):
+            for instance_id in range(5):
+                stats.update(instance_id, instance_id, 5 - instance_id, now - 5, now)
+            # Idle, eg. before the user's code has started
+            stats.update(5, 0, 0, now - 5, now)
+
+            self.assertEqual(window.request_count(now), stats.request_count(now - 10, now))
+            self.assertEqual(window.instance_count(now), stats.instance_count(now - 10, now))
+            self.assertEqual(window.instance_seconds(now), stats.instance_seconds(now - 10, now))
+            self.assertAlmostEqual(window.success_rate(now), stats.success_rate(now - 10, now))
+
+        with self.assertRaisesRegexp(AssertionError, "No trailing window"):
+            stats.window(60)
+
+    def test_expires_without_queries(self):
+        stats = ClusterStats(windows=(10,))
+        for now in range(5, 5000, 5):
+            for instance_id in range(5):
+                stats.update(instance_id, 1, 0, now - 5, now)
+        # Intervals started in the last 10 seconds, from each instance
+        self.assertTrue(len(stats.window(10)._intervals) <= 15)
+
 class TestClusterStats(unittest.TestCase):
 
     def setUp(self):
@@ -131,3 +232,79 @@ class TestClusterStats(unittest.TestCase):
 
         result = self.stats.request_count(1, 3)
         self.assertEqual(result, 6)
+
+    def test_latency_percentile(self):
+        self.assertIsNone(self.stats.latency_percentile(50, 0, 5))
+
+        self.stats.update(1, 2, 0, 3, 4, make_histogram(0.1, 0.2))
+        self.stats.update(2, 2, 0, 3, 4, make_histogram(0.3, 0.4))
+        self.stats.update(2, 1, 0, 4, 5, make_histogram(1.0))
+
+        self.assertEqual(self.stats.latency_histogram(3, 4).count, 4)
+        self.assertAlmostEqual(self.stats.latency_percentile(50, 3, 4), 0.2, delta=0.2 / 64)
+        self.assertAlmostEqual(self.stats.latency_percentile(100, 3, 4), 0.4, delta=0.4 / 64)
+        self.assertAlmostEqual(self.stats.latency_percentile(100, 0, 5), 1.0, delta=1.0 / 64)
+
+    def test_partial_overlap(self):
+        stats = ClusterStats()
+        stats.update("a", 100, 0, 0, 10, make_histogram(0.1))
+        stats.update("b", 50, 50, 5, 15, make_histogram(0.2))
+
+        # Only "b" straddles the period
+        self.assertEqual(stats.instance_count(12, 14), 1)
+        self.assertEqual([i.instance_id for i in stats.get_period(12, 14)], ["b"])
+        self.assertEqual(stats.request_count(12, 14), 20)
+        self.assertEqual(stats.success_rate(12, 14), 0.5)
+        self.assertEqual(stats.latency_histogram(12, 14).count, 0)
+
+        # "a" lies within the period, "b" straddles it
+        self.assertEqual(stats.instance_count(0, 10), 2)
+        self.assertEqual(stats.request_count(0, 10), 150)
+        self.assertEqual(stats.success_rate(0, 10), 0.75)
+        self.assertEqual(stats.latency_histogram(0, 10).count, 1)
+
+        # Touching the period isn't overlapping it
+        self.assertEqual(stats.instance_count(15, 20), 0)
+        self.assertEqual(stats.success_rate(15, 20), 0)
+
+    def test_tagged(self):
+        self.assertIsNone(self.stats.for_tags({"endpoint": "/search"}))
+
+        self.stats.tagged({"endpoint": "/search"}).update(1, 3, 1, 1, 2)
+        self.stats.tagged("endpoint=/search").update(2, 1, 0, 2, 3)
+        search = self.stats.for_tags({"endpoint": "/search"})
+        self.assertEqual(search.request_count(0, 5), 5)
+        self.assertEqual(search.instance_count(0, 5), 2)
+        # The untagged totals are separate
+        self.assertEqual(self.stats.request_count(0, 5), 6)
+
+        stats = ClusterStats(max_tags=1)
+        stats.tagged({"endpoint": "/search"}).update(1, 1, 0, 1, 2)
+        stats.tagged({"endpoint": "/home"}).update(1, 2, 0, 1, 2)
+        self.assertIsNone(stats.for_tags({"endpoint": "/home"}))
+        self.assertEqual(stats.for_tags(tags.OVERFLOW_TAG).request_count(0, 5), 2)
+
+    def test_boot_report(self):
+        self.assertIsNone(self.stats.boot_latency(50))
+
+        self.stats.update_boot_report("i-1", {"requested": 0, "fulfilled": 20})
+        self.stats.update_boot_report("i-1", {"os_boot": 60, "user_data_start": 80, "client_start": 200})
+        self.stats.update_boot_report("i-1", {"first_request": 230})
+        # Repeated marks don't count twice or move
+        self.stats.update_boot_report("i-1", {"requested": 10, "first_request": 300})
+        self.stats.update_boot_report("i-2", {"requested": 0, "first_request": 100})
+
+        self.assertEqual(self.stats.boot_marks["i-1"]["first_request"], 230)
+        self.assertAlmostEqual(self.stats.boot_latency(100, "spot_fulfillment"), 20, delta=20 / 64.0)
+        self.assertAlmostEqual(self.stats.boot_latency(100, "warm_up"), 30, delta=30 / 64.0)
+        self.assertAlmostEqual(self.stats.boot_latency(100), 230, delta=230 / 64.0)
+        self.assertAlmostEqual(self.stats.boot_latency(50), 100, delta=100 / 64.0)
+
+        report = self.stats.boot_report()
+        self.assertEqual(report["total"]["count"], 2)
+        # install_end wasn't reported
+        self.assertEqual(report["install"]["count"], 0)
+        self.assertIsNone(report["install"]["p50"])
+
+        with self.assertRaisesRegexp(AssertionError, "Unknown boot phase"):
+            self.stats.boot_latency(50, "bogus")
@@ -0,0 +1,96 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from spotmark.stats import ClusterStats
+from spotmark.store import StatsStore
+from test_stats import make_histogram
+
+class TestStatsStore(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "stats.db")
+        self.store = StatsStore(self.path, rollups=[(100, 60)])
+        self.stats = ClusterStats(store=self.store)
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.directory)
+
+    def test_replay(self):
+        self.stats.update("i-1", 10, 1, 0, 10, make_histogram(0.1, 0.2))
+        self.stats.update_many([("i-1", 20, 2, 10, 20, None), ("i-2", 5, 0, 5, 15, make_histogram(0.3))])
+        self.stats.update_boot_report("i-1", {"requested": 0, "first_request": 90})
+
+        # Reopening the file, as a restarted controller would
+        self.store.close()
+        self.store = StatsStore(self.path)
+        restored = ClusterStats(store=self.store)
+        self.assertEqual(self.store.replay(restored), 3)
+
+        self.assertEqual(restored.request_count(0, 20), 38)
+        self.assertEqual(restored.instance_count(0, 20), 2)
+        self.assertEqual(restored.latency_histogram(0, 20).count, 3)
+        self.assertEqual(restored.window(30).request_count(20), 38)
+        self.assertEqual(restored.boot_phases["total"].count, 1)
+
+        # Replaying didn't store everything a second time
+        self.assertEqual(len(list(self.store.intervals())), 3)
+
+    def test_intervals(self):
+        for start_time in range(0, 50, 10):
+            self.stats.update("i-1", 1, 0, start_time, start_time + 10)
+
+        intervals = list(self.store.intervals(10, 40))
+        self.assertEqual([i[3] for i in intervals], [10, 20, 30])
+        self.assertEqual(intervals[0], ("i-1", 1, 0, 10, 20, None))
+
+        small_batches = list(self.store.intervals(batch_size=2))
+        self.assertEqual(len(small_batches), 5)
+
+    def test_downsample(self):
+        for start_time in range(0, 180, 10):
+            self.stats.update("i-1", 9, 1, start_time, start_time + 10, make_histogram(0.1))
+            self.stats.update("i-2", 1, 0, start_time, start_time + 10)
+
+        # Intervals ending before 100 fall into the 0-60 and 60-120 buckets
+        self.assertEqual(self.store.downsample(200), 14)
+        intervals = list(self.store.intervals())
+        self.assertEqual(len(intervals), 36 - 14)
+
+        rollup = [i for i in intervals if i[0] == "i-1" and i[3] == 0][0]
+        self.assertEqual(rollup[1:5], (54, 6, 0, 60))
+        self.assertEqual(rollup[5].count, 6)
+
+        # Totals are unchanged
+        restored = ClusterStats()
+        self.store.replay(restored)
+        self.assertEqual(restored.request_count(0, 180), 18 * 11)
+
+        # Already rolled up intervals are left alone
+        self.assertEqual(self.store.downsample(200), 0)
+
+
+class TestRetention(unittest.TestCase):
+
+    def test_prune(self):
+        stats = ClusterStats(windows=(30,), retention_secs=100)
+        for end_time in range(10, 510, 10):
+            stats.update("i-1", 1, 0, end_time - 10, end_time)
+            if end_time <= 100:
+                stats.update("i-2", 1, 0, end_time - 10, end_time)
+
+        # Memory is bounded by the retention period, plus a tenth
+        self.assertTrue(100 / 10 <= len(stats.instance_stats["i-1"]) <= 110 / 10 + 1)
+        self.assertNotIn("i-2", stats.instance_stats)
+        self.assertEqual(stats.window(30).request_count(500), 3)
+        self.assertTrue(len(stats.window(30)._intervals) <= 30 / 10 + 1)
+
+        stats.prune(1000)
+        self.assertEqual(stats.instance_stats, {})
+        self.assertEqual(stats.window(30)._intervals, [])
+
+        with self.assertRaisesRegexp(AssertionError, "retention_secs must cover"):
+            ClusterStats(windows=(30, 60), retention_secs=40)
@@ -0,0 +1,145 @@
+import unittest
+
+from spotmark import stragglers
+from spotmark.stats import ClusterStats
+
+class TestRobustScores(unittest.TestCase):
+
+    def test_median(self):
+        self.assertEqual(stragglers.median([3, 1, 2]), 2)
+        self.assertEqual(stragglers.median([4, 1, 2, 3]), 2.5)
+
+    def test_outlier_doesnt_shift_baseline(self):
+        scores = stragglers.robust_scores([10, 11, 9, 10, 12, 8, 1])
+        # MAD is 1, so the outlier is 9 / 1.4826 deviations below
+        self.assertAlmostEqual(scores[-1], -9 / 1.4826)
+        self.assertTrue(all(abs(score) < 2 for score in scores[:-1]))
+
+    def test_zero_mad(self):
+        scores = stragglers.robust_scores([10, 10, 10, 10, 2])
+        self.assertEqual(scores[:4], [0.0] * 4)
+        self.assertTrue(scores[4] < -3.5)
+
+    def test_near_identical(self):
+        # One failure in a thousand isn't many deviations from a fleet
+        # that never fails
+        scores = stragglers.robust_scores([1.0] * 19 + [0.999])
+        self.assertAlmostEqual(scores[-1], -0.05)
+
+    def test_all_equal(self):
+        self.assertEqual(stragglers.robust_scores([5, 5, 5]), [0.0, 0.0, 0.0])
+
+
+class TestStragglerDetector(unittest.TestCase):
+
+    def setUp(self):
+        self.cluster_stats = ClusterStats()
+        self.detector = stragglers.StragglerDetector(self.cluster_stats, window_secs=100)
+
+    def report(self, instance_id, requests_per_interval, failures=0, start_time=0, end_time=100):
+        for t in range(start_time, end_time, 10):
+            self.cluster_stats.update(instance_id, requests_per_interval - failures, failures, t, t + 10)
+
+    def test_slow_instance(self):
+        for i, requests in enumerate([100, 105, 95, 100, 102, 98]):
+            self.report("i-%d" % i, requests)
+        self.report("i-slow", 50)
+
+        found = self.detector.find_stragglers(100)
+        self.assertEqual([s.instance_id for s in found], ["i-slow"])
+        self.assertEqual(found[0].requests_per_second, 5)
+        self.assertEqual(found[0].success_rate, 1)
+
+    def test_failing_instance(self):
+        for i in range(6):
+            self.report("i-%d" % i, 100, failures=i % 2)
+        self.report("i-failing", 100, failures=40)
+
+        found = self.detector.find_stragglers(100)
+        self.assertEqual([s.instance_id for s in found], ["i-failing"])
+        self.assertAlmostEqual(found[0].success_rate, 0.6)
+
+    def test_near_identical_not_flagged(self):
+        for i in range(19):
+            self.report("i-%d" % i, 100)
+        self.report("i-one-failure", 100, failures=1)
+        self.report("i-one-percent", 99)
+        self.assertEqual(self.detector.find_stragglers(100), [])
+
+    def test_small_shortfall_not_flagged(self):
+        # Clearly below a tight fleet, but by less than min_shortfall
+        for i in range(10):
+            self.report("i-%d" % i, 1000 + i % 2)
+        self.report("i-slower", 920)
+        self.assertEqual(self.detector.find_stragglers(100), [])
+
+        self.detector.min_shortfall = 0.05
+        self.assertEqual([s.instance_id for s in self.detector.find_stragglers(100)], ["i-slower"])
+
+    def test_fast_instance_not_flagged(self):
+        for i in range(6):
+            self.report("i-%d" % i, 100 + i)
+        self.report("i-fast", 300)
+        self.assertEqual(self.detector.find_stragglers(100), [])
+
+    def test_new_instance_not_scored(self):
+        for i in range(6):
+            self.report("i-%d" % i, 100 + i)
+        # Only reported for 20 of the 100 seconds
+        self.report("i-new", 10, start_time=80)
+        instance_ids, throughputs, success_rates = self.detector.instance_metrics(100)
+        self.assertNotIn("i-new", instance_ids)
+        self.assertEqual(self.detector.find_stragglers(100), [])
+
+    def test_min_instances(self):
+        for i in range(3):
+            self.report("i-%d" % i, 100)
+        self.report("i-slow", 10)
+        self.assertEqual(self.detector.find_stragglers(100), [])
+
+
+class TestStragglerReplacer(unittest.TestCase):
+
+    class MockLauncher(object):
+
+        def __init__(self, instance_ids):
+            self.instance_ids = set(instance_ids)
+            self.terminated, self.launched = [], 0
+
+        def terminate(self, num_instances=None, instance_ids=None):
+            self.terminated.extend(instance_ids)
+            self.instance_ids -= set(instance_ids)
+
+        def launch(self, num_instances):
+            self.launched += num_instances
+
+    class MockDetector(object):
+
+        def __init__(self, instance_ids):
+            self.instance_ids = instance_ids
+
+        def find_stragglers(self, now):
+            return [stragglers.straggler_tuple(i, 1, 1, -5, 0) for i in self.instance_ids]
+
+    def test_replace(self):
+        launcher = self.MockLauncher(["i-%d" % i for i in range(10)])
+        detector = self.MockDetector(["i-1", "i-2", "i-other"])
+        replacer = stragglers.StragglerReplacer(detector, launcher, max_fraction=0.1, cooldown_secs=60)
+
+        # Capped at a tenth of the fleet, and only instances it launched
+        self.assertEqual(replacer.replace(0), ["i-1"])
+        self.assertEqual(launcher.terminated, ["i-1"])
+        self.assertEqual(launcher.launched, 1)
+
+        # Cooling down
+        self.assertEqual(replacer.replace(30), [])
+
+        self.assertEqual(replacer.replace(60), ["i-2"])
+        self.assertEqual(replacer.replaced, ["i-1", "i-2"])
+        self.assertEqual(launcher.launched, 2)
+
+    def test_nothing_to_replace(self):
+        launcher = self.MockLauncher(["i-1"])
+        replacer = stragglers.StragglerReplacer(self.MockDetector([]), launcher)
+        self.assertEqual(replacer.replace(0), [])
+        self.assertEqual(replacer.last_replacement_time, None)
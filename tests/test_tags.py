@@ -0,0 +1,74 @@
+import unittest
+
+from spotmark import tags
+from spotmark.histogram import LatencyHistogram
+
+class TestTagKey(unittest.TestCase):
+
+    def test_tag_key(self):
+        self.assertEqual(tags.tag_key({"status": "2xx", "endpoint": "/search"}), "endpoint=/search,status=2xx")
+        self.assertEqual(tags.tag_key("endpoint=/search"), "endpoint=/search")
+        self.assertIsNone(tags.tag_key(None))
+        self.assertIsNone(tags.tag_key({}))
+
+
+class TestTagRegistry(unittest.TestCase):
+
+    def test_intern(self):
+        registry = tags.TagRegistry(max_tags=2)
+        search = registry.intern({"endpoint": "/search"})
+        self.assertEqual(registry.intern("endpoint=/search"), search)
+        self.assertEqual(registry.intern(search), search)
+        self.assertEqual(registry.key(search), "endpoint=/search")
+        self.assertIsNone(registry.intern(None))
+
+        home = registry.intern({"endpoint": "/home"})
+        self.assertNotEqual(home, search)
+        # Over the cap
+        self.assertEqual(registry.intern({"endpoint": "/about"}), tags.OVERFLOW_ID)
+        self.assertEqual(registry.key(tags.OVERFLOW_ID), tags.OVERFLOW_TAG)
+        self.assertEqual(registry.overflow_count, 1)
+        # Known tag sets are still interned
+        self.assertEqual(registry.intern({"endpoint": "/home"}), home)
+
+
+class TestTaggedTotals(unittest.TestCase):
+
+    def test_record(self):
+        totals = tags.TaggedTotals()
+        self.assertFalse(totals)
+        search = totals.registry.intern({"endpoint": "/search"})
+        totals.record(search, True, 0.5)
+        totals.record({"endpoint": "/search"}, False)
+        totals.record({"endpoint": "/home"}, True)
+        totals.record(None, True)
+
+        data = totals.to_dict()
+        self.assertEqual(sorted(data), ["endpoint=/home", "endpoint=/search"])
+        self.assertEqual(data["endpoint=/search"]["success_count"], 1)
+        self.assertEqual(data["endpoint=/search"]["failure_count"], 1)
+        self.assertEqual(LatencyHistogram.from_dict(data["endpoint=/search"]["latency_histogram"]).count, 1)
+        self.assertIsNone(data["endpoint=/home"]["latency_histogram"])
+
+        totals.reset()
+        self.assertFalse(totals)
+        self.assertEqual(totals.to_dict(), {})
+        self.assertEqual(totals.registry.intern({"endpoint": "/search"}), search)
+
+    def test_merge_dict(self):
+        first = tags.TaggedTotals()
+        first.add("endpoint=/search", 2, 1, [0.1, 0.2])
+        second = tags.TaggedTotals()
+        second.merge_dict(first.to_dict())
+        second.merge_dict(first.to_dict())
+
+        data = second.to_dict()["endpoint=/search"]
+        self.assertEqual((data["success_count"], data["failure_count"]), (4, 2))
+        self.assertEqual(LatencyHistogram.from_dict(data["latency_histogram"]).count, 4)
+
+    def test_overflow(self):
+        totals = tags.TaggedTotals(max_tags=1)
+        totals.add("endpoint=/search", 1)
+        totals.add("endpoint=/home", 2)
+        totals.add("endpoint=/about", 3)
+        self.assertEqual(totals.to_dict()[tags.OVERFLOW_TAG]["success_count"], 5)
@@ -0,0 +1,106 @@
+import json
+import time
+import unittest
+
+from spotmark import accumulator, consumer, constants, transport
+from spotmark.stats import ClusterStats
+
+CONTROLLER_URI = "tcp://127.0.0.1:10350"
+
+class TestInProcessTransport(unittest.TestCase):
+
+    def setUp(self):
+        self.cluster_stats = ClusterStats()
+        self.consumer = consumer.SQSConsumer(self.cluster_stats)
+        self.transport = transport.InProcessTransport(self.consumer.handle_body)
+
+    def test_accumulator_to_consumer(self):
+        sqs_accumulator = accumulator.SQSAccumulator(transport=self.transport)
+        sqs_accumulator.enqueue({"status": "running"})
+        sqs_accumulator.process_messages([json.dumps({"success_count": 3, "failure_count": 1})])
+        sqs_accumulator.enqueue_update()
+        sqs_accumulator.process_messages([json.dumps({"success_count": 2})])
+        sqs_accumulator.enqueue_update()
+
+        self.assertEqual(self.consumer.apply_updates(), 2)
+        self.assertEqual(self.consumer.statuses, {constants.INSTANCE_ID: {"status": "running"}})
+        self.assertEqual(self.cluster_stats.request_count(0, time.time()), 6)
+
+    def test_batched(self):
+        batching = accumulator.BatchingSQSAccumulator(transport=self.transport, flush_size=3)
+        for i in range(3):
+            batching.enqueue({"status": i})
+        self.assertEqual(self.consumer.statuses, {constants.INSTANCE_ID: {"status": 2}})
+
+    def test_kept_without_handler(self):
+        kept = transport.InProcessTransport()
+        kept.send("body")
+        self.assertEqual(kept.bodies, ["body"])
+
+
+class TestSQSTransport(unittest.TestCase):
+
+    def test_send_batch_retries(self):
+        class MockQueue(object):
+            def __init__(self):
+                self.written = []
+                self.failures = [
+                    [{"id": "0", "sender_fault": "false"}, {"id": "1", "sender_fault": "true"}],
+                    [{"id": "0", "sender_fault": "false"}]
+                ]
+            def write_batch(self, entries):
+                self.written.append([body for i, body, delay in entries])
+                return type("BatchResults", (object,), {"errors": self.failures.pop(0)})
+
+        sqs_transport = transport.SQSTransport()
+        sqs_transport._queue = MockQueue()
+        sqs_transport.send_batch(["a", "b", "c"])
+        # Only the entry that wasn't the sender's fault is retried
+        self.assertEqual(sqs_transport.queue.written, [["a", "b", "c"], ["a"]])
+        self.assertEqual(sqs_transport.failed_count, 2)
+
+
+class TestZMQTransport(unittest.TestCase):
+
+    def setUp(self):
+        self.cluster_stats = ClusterStats()
+        self.fallback = transport.InProcessTransport()
+        self.transport = transport.ZMQTransport(CONTROLLER_URI, fallback=self.fallback, send_timeout_ms=50)
+
+    def tearDown(self):
+        self.transport.close(0)
+
+    def test_fallback(self):
+        # Nothing is listening, so messages go to the fallback
+        sqs_accumulator = accumulator.SQSAccumulator(transport=self.transport)
+        sqs_accumulator.enqueue({"status": "running"})
+        batching = accumulator.BatchingSQSAccumulator(transport=self.transport)
+        batching.enqueue({"status": "batched"})
+        batching.flush()
+
+        self.assertEqual(self.transport.fallback_count, 2)
+        self.assertEqual(len(self.fallback.bodies), 2)
+        self.assertEqual(accumulator.decode_body(self.fallback.bodies[1])[0]["content"], {"status": "batched"})
+
+        self.transport.fallback = None
+        self.transport.send("dropped")
+        self.assertEqual(self.transport.dropped_count, 1)
+
+    def test_zmq_consumer(self):
+        zmq_consumer = consumer.ZMQConsumer(self.cluster_stats, CONTROLLER_URI, poll_timeout_ms=50)
+        zmq_consumer.start()
+        self.addCleanup(zmq_consumer.stop)
+
+        sqs_accumulator = accumulator.SQSAccumulator(transport=self.transport)
+        self.transport.send_timeout_ms = 5000
+        sqs_accumulator.enqueue({"status": "running"})
+        sqs_accumulator.process_messages([json.dumps({"success_count": 3})])
+        sqs_accumulator.enqueue_update()
+
+        deadline = time.time() + 5
+        while not zmq_consumer.updates.qsize() and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(zmq_consumer.apply_updates(), 1)
+        self.assertEqual(zmq_consumer.statuses, {constants.INSTANCE_ID: {"status": "running"}})
+        self.assertEqual(self.transport.sent_count, 2)
+        self.assertEqual(self.fallback.bodies, [])
@@ -0,0 +1,46 @@
+import json
+import unittest
+
+from spotmark import wire
+
+class TestWire(unittest.TestCase):
+
+    def test_pack_record(self):
+        record = wire.pack_record(3, 1)
+        self.assertEqual(len(record), wire.HEADER.size)
+        self.assertTrue(wire.is_record(record))
+        self.assertFalse(wire.is_record(json.dumps({"success_count": 1})))
+
+        record = wire.pack_record(1, 0, [0.5, 0.25], tag=u"/search")
+        self.assertEqual(len(record), wire.HEADER.size + 8 + len("/search"))
+
+        with self.assertRaisesRegexp(AssertionError, "Tag is too long"):
+            wire.pack_record(1, 0, tag="x" * 256)
+
+    def test_unpack_records(self):
+        frames = [
+            wire.pack_record(3, 1),
+            wire.pack_record(1, 0, [0.5, 0.25], tag="/search"),
+            # Several records concatenated in one frame
+            wire.pack_record(0, 2, [1.5], tag="/search") + wire.pack_record(2, 0, [0.125], tag="/home"),
+        ]
+        batch = wire.unpack_records(frames)
+        self.assertEqual(batch.success_count, 6)
+        self.assertEqual(batch.failure_count, 3)
+        self.assertEqual(list(batch.latencies), [0.5, 0.25, 1.5, 0.125])
+        self.assertEqual(batch.tag_counts, {"/search": [1, 2], "/home": [2, 0]})
+        self.assertEqual(list(batch.tag_latencies["/search"]), [0.5, 0.25, 1.5])
+        self.assertEqual(list(batch.tag_latencies["/home"]), [0.125])
+
+        batch = wire.unpack_records([])
+        self.assertEqual(batch.success_count, 0)
+        self.assertEqual(list(batch.latencies), [])
+
+    def test_tag_dict(self):
+        record = wire.pack_record(1, 0, tag={"status": "2xx", "endpoint": "/search"})
+        batch = wire.unpack_records([record])
+        self.assertEqual(batch.tag_counts, {"endpoint=/search,status=2xx": [1, 0]})
+
+    def test_unpack_records_invalid(self):
+        with self.assertRaisesRegexp(AssertionError, "Not a binary record"):
+            wire.unpack_records([wire.pack_record(1, 0) + "{}" + "x" * 10])